@@ -1,4 +1,5 @@
 from django.contrib import admin
+from .metadata import display_settings
 from .models import BaseSetting, CsvColumnMapping, ModelDisplaySetting, QrCodeAction
 
 class DynamicAdminMixin:
@@ -9,14 +10,14 @@ class DynamicAdminMixin:
     def get_dynamic_settings(self, field_name):
         if not hasattr(self, '_data_type') or not self._data_type:
             return None
-        
-        filter_kwargs = {
-            'data_type': self._data_type,
-            field_name: True
-        }
-        settings = ModelDisplaySetting.objects.filter(**filter_kwargs).order_by('display_order').values_list('model_field_name', flat=True)
-        
-        return list(settings) if settings.exists() else None
+
+        # 表示設定はキャッシュから取得する (一覧表示・検索・フィルタで同じ設定を共有する)
+        settings = [
+            setting.model_field_name
+            for setting in display_settings.objects(self._data_type)
+            if getattr(setting, field_name)
+        ]
+        return settings or None
 
     def get_list_display(self, request):
         dynamic_list_display = self.get_dynamic_settings('is_list_display')
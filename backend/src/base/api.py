@@ -1,17 +1,18 @@
 from rest_framework.views import APIView
 from rest_framework.response import Response
-from rest_framework import status, permissions, viewsets
+from rest_framework import exceptions, status, permissions, viewsets
 from rest_framework.decorators import action
 from django.conf import settings
 from django_filters.rest_framework import DjangoFilterBackend
 from django.apps import apps
 from django.db import transaction, IntegrityError
+from django.utils import timezone
 from django.db.models import DateField, DateTimeField, IntegerField, PositiveIntegerField, BooleanField
 from datetime import datetime
-from django.http import HttpResponse
+from django.http import Http404, HttpResponse
+from django.views.decorators.http import require_GET
 from django.core.files.storage import FileSystemStorage
 import csv
-import re
 import io
 import os
 import uuid
@@ -19,7 +20,12 @@ import django_filters
 
 from .models import CsvColumnMapping, ModelDisplaySetting, QrCodeAction, AsyncTask
 from .serializers import CsvColumnMappingSerializer, ModelDisplaySettingSerializer, QrCodeActionSerializer
-from .tasks import import_csv_task
+from .async_api import authenticate_request
+from .csv_import import request_cancel
+from .metrics import render as render_metrics
+from .metadata import MetadataCacheMixin, active_csv_mappings, csv_mappings, display_settings
+from .qr_dispatch import QrActionError, dispatcher
+from .tasks import import_csv_task, import_csv_sharded_task
 
 DATA_TYPE_MODEL_MAPPING = {
     'item': 'master.Item',
@@ -47,11 +53,28 @@ class AppInfoView(APIView):
         })
 
 
-class HealthCheckView(APIView):
-    permission_classes = [permissions.AllowAny]
-
-    def get(self, request, *args, **kwargs):
-        return Response({"status": "ok"}, status=status.HTTP_200_OK)
+@require_GET
+def metrics(request):
+    """
+    全プロセスの性能メトリクスを Prometheus のテキスト形式で返す (METRICS_ENABLED の場合のみ)。
+    METRICS_TOKEN が設定されている場合は Authorization: Bearer <METRICS_TOKEN> が、
+    設定されていない場合はスタッフユーザーの認証 (JWT またはセッション) が必要です。
+    """
+    if not settings.METRICS_ENABLED:
+        raise Http404
+    if settings.METRICS_TOKEN:
+        authorized = request.headers.get('Authorization') == f'Bearer {settings.METRICS_TOKEN}'
+    else:
+        try:
+            user = authenticate_request(request)
+        except exceptions.APIException:
+            user = None
+        if user is not None and not user.is_authenticated:
+            user = request.user  # 管理サイトのセッション
+        authorized = user is not None and user.is_staff
+    if not authorized:
+        return HttpResponse(status=status.HTTP_401_UNAUTHORIZED)
+    return HttpResponse(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
 
 
 class ModelDisplaySettingFilter(django_filters.FilterSet):
@@ -108,7 +131,7 @@ class ModelFieldsView(APIView):
         return Response(fields_data)
 
 
-class CsvColumnMappingViewSet(viewsets.ModelViewSet):
+class CsvColumnMappingViewSet(MetadataCacheMixin, viewsets.ModelViewSet):
     """
     CSV列マッピング設定を管理するためのAPIビューセット。
     """
@@ -117,13 +140,14 @@ class CsvColumnMappingViewSet(viewsets.ModelViewSet):
     permission_classes = [permissions.IsAdminUser]
     filter_backends = [DjangoFilterBackend]
     filterset_class = CsvColumnMappingFilter
+    metadata_cache = csv_mappings
 
     def get_permissions(self):
         """
         アクションに応じてパーミッションを動的に設定する。
         'csv_template'アクションは認証済みユーザーなら誰でもアクセス可能とする。
         """
-        if self.action in ['csv_template', 'import_csv', 'get_task_status', 'cancel_task']:
+        if self.action in ['csv_template', 'import_csv', 'cancel_task']:
             return [permissions.IsAuthenticated()]
         return super().get_permissions()
 
@@ -137,12 +161,7 @@ class CsvColumnMappingViewSet(viewsets.ModelViewSet):
         if not data_type:
             return Response({'error': 'Query parameter "data_type" is required.'}, status=status.HTTP_400_BAD_REQUEST)
 
-        mappings = CsvColumnMapping.objects.filter(
-            data_type=data_type,
-            is_active=True
-        ).order_by('order')
-
-        headers = [mapping.csv_header for mapping in mappings]
+        headers = [mapping.csv_header for mapping in active_csv_mappings(data_type)]
 
         output = io.StringIO()
         writer = csv.writer(output)
@@ -171,7 +190,11 @@ class CsvColumnMappingViewSet(viewsets.ModelViewSet):
         file_path = fs.path(filename)
 
         # 非同期タスクを開始
-        task = import_csv_task.delay(data_type, file_path)
+        # mode=sharded の場合は上書きキーで分割し、複数のワーカーで並列に取り込む
+        if request.query_params.get('mode') == 'sharded':
+            task = import_csv_sharded_task.delay(data_type, file_path, settings.CSV_IMPORT_SHARD_COUNT)
+        else:
+            task = import_csv_task.delay(data_type, file_path)
 
         # タスク情報をDBに保存
         AsyncTask.objects.create(
@@ -182,29 +205,19 @@ class CsvColumnMappingViewSet(viewsets.ModelViewSet):
 
         return Response({'status': 'processing', 'task_id': task.id}, status=status.HTTP_202_ACCEPTED)
 
-    @action(detail=True, methods=['get'], url_path='csv-import-status')
-    def get_task_status(self, request, pk=None):
-        try:
-            task = AsyncTask.objects.get(task_id=pk)
-            response_data = {
-                'task_id': task.task_id,
-                'status': task.status,
-                'progress': task.progress,
-                'total': task.total,
-                'result': task.result
-            }
-            return Response(response_data)
-        except AsyncTask.DoesNotExist:
-            return Response({'status': 'error', 'message': 'タスクが見つかりません。'}, status=status.HTTP_404_NOT_FOUND)
-
     @action(detail=True, methods=['post'], url_path='csv-import-cancel')
     def cancel_task(self, request, pk=None):
         try:
             task = AsyncTask.objects.get(task_id=pk)
             if task.status in ['PENDING', 'STARTED']:
-                import_csv_task.AsyncResult(task.task_id).revoke(terminate=True)
-                task.status = 'REVOKED'
-                task.save()
+                # 実行中のタスクはキャンセルフラグを確認して停止し、自身で REVOKED を記録する。
+                # 書き込み途中で強制終了しないよう terminate は指定しない。
+                # ステータスはここでは変更しない (停止前に完了したタスクの SUCCESS / FAILURE と競合するため)
+                request_cancel(task.task_id)
+                import_csv_task.AsyncResult(task.task_id).revoke()
+                # まだ開始していないタスクはワーカーが破棄し、自身で REVOKED を記録しないため、ここで記録する
+                # (開始済みであれば条件に一致せず、上記のフラグでタスクが停止します)
+                AsyncTask.objects.filter(pk=task.pk, status='PENDING').update(status='REVOKED', updated_at=timezone.now())
                 return Response({'status': 'success', 'message': 'タスクのキャンセルをリクエストしました。'})
             else:
                 return Response({'status': 'error', 'message': 'このタスクはすでに完了またはキャンセルされています。'}, status=status.HTTP_400_BAD_REQUEST)
@@ -246,6 +259,8 @@ class CsvColumnMappingViewSet(viewsets.ModelViewSet):
             CsvColumnMapping.objects.filter(data_type=data_type).delete()
             # 新しいマッピングを一括作成
             CsvColumnMapping.objects.bulk_create(objects_to_create)
+            # bulk_create は post_save を送信しないため、キャッシュを明示的に無効にする
+            csv_mappings.invalidate()
 
         return Response({'status': 'success', 'message': f'{data_type} のマッピングを保存しました。'}, status=status.HTTP_200_OK)
 
@@ -271,62 +286,27 @@ class QrCodeActionViewSet(viewsets.ModelViewSet):
         if not qr_data:
             return Response({'error': 'qr_data is required.'}, status=status.HTTP_400_BAD_REQUEST)
 
-        # スクリプト判定を先に、正規表現判定を後に評価する
-        actions = QrCodeAction.objects.filter(is_active=True).order_by('-action_type')
-        
-        for action in actions:
-            try:
-                # **セキュリティ警告**: execの使用は非常に危険です。
-                # これはあくまで概念実証のためのコードです。
-                # 実際のアプリケーションでは、より安全な方法を検討してください。
-                script_body = '\n'.join([f'    {line}' for line in action.script.splitlines()])
-                wrapped_script = f"""
-def run_action(qr_data):
-{script_body}
-"""
-                script_globals = {}
-                exec(wrapped_script, script_globals)
-                action_func = script_globals['run_action']
-
-                result = None
-                matched = False
-
-                if action.action_type == 'regex':
-                    if action.qr_code_pattern and re.match(action.qr_code_pattern, qr_data):
-                        matched = True
-                        result = action_func(qr_data)
-                
-                elif action.action_type == 'script':
-                    # スクリプト判定では、スクリプト自体が判定と結果返却を行う
-                    result = action_func(qr_data)
-                    if result is not None:
-                        matched = True
-
-                if matched:
-                    # スクリプトがNoneを返した場合、それは「マッチしなかった」と見なす
-                    if result is None:
-                        continue
-
-                    return Response({
-                        'status': 'success',
-                        'action_name': action.name,
-                        'result': result,
-                    })
-
-            except re.error as e:
-                # パターンが無効な場合はログに記録するなど
-                # logger.warning(f"Invalid regex pattern for action '{action.name}': {e}")
-                continue
-            except Exception as e:
-                return Response({
-                    'status': 'error',
-                    'action_name': action.name,
-                    'message': f"An error occurred while executing action '{action.name}': {e}"
-                }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        # コンパイル済みのアクションをスクリプト判定、正規表現判定の順に評価する
+        try:
+            matched = dispatcher.dispatch(qr_data)
+        except QrActionError as e:
+            return Response({
+                'status': 'error',
+                'action_name': e.action_name,
+                'message': str(e)
+            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        if matched is not None:
+            action_name, result = matched
+            return Response({
+                'status': 'success',
+                'action_name': action_name,
+                'result': result,
+            })
 
         return Response({'status': 'not_found', 'message': 'No matching action found for the given QR data.'}, status=status.HTTP_404_NOT_FOUND)
 
-class ModelDisplaySettingViewSet(viewsets.ModelViewSet):
+class ModelDisplaySettingViewSet(MetadataCacheMixin, viewsets.ModelViewSet):
     """
     モデル項目表示設定を管理するためのAPIビューセット。
     """
@@ -335,6 +315,7 @@ class ModelDisplaySettingViewSet(viewsets.ModelViewSet):
     permission_classes = [permissions.IsAdminUser]
     filter_backends = [DjangoFilterBackend]
     filterset_class = ModelDisplaySettingFilter
+    metadata_cache = display_settings
 
     @action(detail=False, methods=['post'], url_path='bulk-save')
     def bulk_save(self, request, *args, **kwargs):
@@ -366,5 +347,7 @@ class ModelDisplaySettingViewSet(viewsets.ModelViewSet):
         with transaction.atomic():
             ModelDisplaySetting.objects.filter(data_type=data_type).delete()
             ModelDisplaySetting.objects.bulk_create(objects_to_create)
+            # bulk_create は post_save を送信しないため、キャッシュを明示的に無効にする
+            display_settings.invalidate()
 
         return Response({'status': 'success', 'message': f'{data_type} の表示設定を保存しました。'}, status=status.HTTP_200_OK)
@@ -1,7 +1,8 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
+from .async_api import csv_import_status, health_check
 from .api import (
-    AppInfoView, HealthCheckView, ModelFieldsView, CsvColumnMappingViewSet,
+    AppInfoView, ModelFieldsView, metrics, CsvColumnMappingViewSet,
     ModelDisplaySettingViewSet, QrCodeActionViewSet
 )
 
@@ -14,9 +15,10 @@ router.register(r'qr-code-actions', QrCodeActionViewSet, basename='qr-code-actio
 
 urlpatterns = [
     path('info/', AppInfoView.as_view(), name='app-info'),
-    path('health/', HealthCheckView.as_view(), name='health-check'),
+    path('health/', health_check, name='health-check'),
+    path('metrics/', metrics, name='metrics'),
     path('model-fields/', ModelFieldsView.as_view(), name='model-fields'),
-    path('csv-import-status/<str:pk>/', CsvColumnMappingViewSet.as_view({'get': 'get_task_status'}), name='csv-import-status'),
+    path('csv-import-status/<str:pk>/', csv_import_status, name='csv-import-status'),
     path('csv-import-cancel/<str:pk>/', CsvColumnMappingViewSet.as_view({'post': 'cancel_task'}), name='csv-import-cancel'),
     path('', include(router.urls)),
 ]
\ No newline at end of file
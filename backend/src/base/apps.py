@@ -5,3 +5,18 @@ class BaseConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'base'
     verbose_name = '基本設定'
+
+    def ready(self):
+        # 設定・QRコードアクションのキャッシュを無効にするシグナル、Celery タスクの計測のシグナルを接続する
+        import base.metadata
+        import base.metrics
+        import base.qr_dispatch
+        from django.db.backends.signals import connection_created
+        from base.cache import check_shared_cache
+        from base.query_inspection import install_query_dispatcher
+
+        # 計測・クエリ検査のミドルウェアが、リクエストを処理するどのスレッドの接続のクエリも集計できるようにする
+        connection_created.connect(install_query_dispatcher, dispatch_uid='base.query_inspection')
+
+        # 共有キャッシュが無いとワーカーごとに別々の値になるため、メトリクス・設定やユーザーのキャッシュが有効なら起動時に確認する
+        check_shared_cache()
@@ -9,8 +9,14 @@ https://docs.djangoproject.com/en/5.1/howto/deployment/asgi/
 
 import os
 
+from django.conf import settings
+from django.contrib.staticfiles.handlers import ASGIStaticFilesHandler
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'base.settings')
 
 application = get_asgi_application()
+
+# WhiteNoise (同期専用) を外した ASGI モードでは、静的ファイルのリクエストだけをこのハンドラーで配信する
+if 'whitenoise.middleware.WhiteNoiseMiddleware' not in settings.MIDDLEWARE:
+    application = ASGIStaticFilesHandler(application)
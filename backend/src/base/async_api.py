@@ -0,0 +1,80 @@
+"""
+非同期 (async) の読み取り専用APIビュー。
+
+ASGI (gunicorn の uvicorn ワーカー、`gunicorn.conf.py` を参照) で配信する場合、これらのビューは
+ワーカーのイベントループ上で Django の非同期ORMを使って処理され、状態の確認 (ポーリング) などの
+頻繁なリクエストがワーカーのプロセス・スレッドを占有しません。WSGI で配信する場合も同じく動作します。
+
+DRF のビューは非同期に対応していないため、認証は `async_api_view` で DRF の既定の認証クラス
+(DEFAULT_AUTHENTICATION_CLASSES) を呼び出して行い、エラーは DRF と同じ形式の JSON で返します。
+"""
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import AnonymousUser
+from django.http import JsonResponse
+from django.views.decorators.http import require_GET
+from rest_framework import exceptions
+from rest_framework.settings import api_settings
+
+from .models import AsyncTask
+
+
+def authenticate_request(request):
+    """DRF の既定の認証クラスで認証したユーザーを返す。認証情報が無い場合は AnonymousUser を返します。"""
+    for auth_class in api_settings.DEFAULT_AUTHENTICATION_CLASSES:
+        user_auth = auth_class().authenticate(request)
+        if user_auth is not None:
+            return user_auth[0]
+    return AnonymousUser()
+
+
+def error_response(request, exc):
+    """APIException を DRF の例外ハンドラーと同じ形式のレスポンスにする。"""
+    data = exc.detail if isinstance(exc.detail, (list, dict)) else {'detail': exc.detail}
+    response = JsonResponse(data, status=exc.status_code, safe=False)
+    auth_classes = api_settings.DEFAULT_AUTHENTICATION_CLASSES
+    if exc.status_code == 401 and auth_classes:
+        response['WWW-Authenticate'] = auth_classes[0]().authenticate_header(request)
+    return response
+
+
+def async_api_view(login_required=True):
+    """
+    非同期ビューを DRF と同じ方法で認証するデコレーター。
+    認証されたユーザーは request.user に設定されます。login_required の場合、未認証のリクエストには 401 を返します。
+    """
+    def decorator(view):
+        @wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            try:
+                request.user = await sync_to_async(authenticate_request)(request)
+            except exceptions.APIException as exc:
+                return error_response(request, exc)
+            if login_required and not request.user.is_authenticated:
+                return error_response(request, exceptions.NotAuthenticated())
+            return await view(request, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+@require_GET
+async def health_check(request):
+    return JsonResponse({'status': 'ok'})
+
+
+@require_GET
+@async_api_view()
+async def csv_import_status(request, pk):
+    """CSVインポートのタスクの進捗を返す (取り込み画面から定期的にポーリングされます)。"""
+    try:
+        task = await AsyncTask.objects.aget(task_id=pk)
+    except AsyncTask.DoesNotExist:
+        return JsonResponse({'status': 'error', 'message': 'タスクが見つかりません。'}, status=404)
+    return JsonResponse({
+        'task_id': task.task_id,
+        'status': task.status,
+        'progress': task.progress,
+        'total': task.total,
+        'result': task.result,
+    })
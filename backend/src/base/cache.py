@@ -0,0 +1,87 @@
+"""
+名前空間ごとにバージョンを持つキャッシュ。
+
+キャッシュの値は `(名前空間, キー)` に名前空間の現在のバージョンを付けて保存します。
+`invalidate` はバージョンを1つ進めるだけなので、名前空間に属するキーを列挙・削除せずに
+古い値をまとめて無効にできます (古い値は有効期限で消えます)。
+
+無効化は既定のキャッシュに対して行うため、プロセス間で共有されるキャッシュ (CACHE_URL) でなければ
+他のプロセスには伝わりません。共有キャッシュを前提とする機能は `SHARED_CACHE_SETTINGS` の設定で
+有効にし、起動時に `check_shared_cache` で確認します。
+"""
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+
+VERSION_KEY = 'cache_version:{namespace}'
+
+# 全プロセスで共有されるキャッシュが必要な機能の設定 (既定では CACHE_URL を設定した場合のみ有効)
+SHARED_CACHE_SETTINGS = ('METRICS_ENABLED', 'METADATA_CACHE_ENABLED', 'JWT_USER_CACHE_ENABLED')
+
+
+def check_shared_cache():
+    """
+    共有キャッシュが必要な機能が有効なのに、既定のキャッシュがプロセスごとのもの (locmem・dummy) であれば
+    ImproperlyConfigured を送出する。
+    """
+    enabled = [name for name in SHARED_CACHE_SETTINGS if getattr(settings, name)]
+    if enabled and isinstance(caches['default'], (LocMemCache, DummyCache)):
+        raise ImproperlyConfigured(
+            f'{", ".join(enabled)} requires a cache shared by all processes (set CACHE_URL, e.g. rediscache://redis:6379/1); '
+            'with a per-process cache each gunicorn worker and Celery worker would keep its own counters and '
+            'would not see invalidations made by the others.'
+        )
+
+
+def _initial_version():
+    # キャッシュの再起動などでバージョンが消えた場合に、以前と同じ番号から数え直さないよう現在時刻を初期値とする
+    return time.time_ns()
+
+
+def get_version(namespace):
+    """名前空間の現在のバージョンを返す。プロセス内に保持した値の鮮度確認にも使用できます。"""
+    key = VERSION_KEY.format(namespace=namespace)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, _initial_version(), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def _bump_version(namespace):
+    key = VERSION_KEY.format(namespace=namespace)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, _initial_version(), timeout=None)
+
+
+def invalidate(namespace):
+    """
+    名前空間のキャッシュを無効にする。
+    トランザクション内で呼び出した場合は、コミット前の古いデータが再びキャッシュされないようコミット後に無効にします。
+    """
+    transaction.on_commit(lambda: _bump_version(namespace))
+
+
+def make_key(namespace, *parts):
+    """キーの構成要素から、長さが一定のキャッシュキーを作成する。"""
+    digest = hashlib.sha1(repr(parts).encode('utf-8')).hexdigest()
+    return f'{namespace}:{digest}'
+
+
+def get_or_set(namespace, parts, compute, timeout):
+    """名前空間の現在のバージョンのキャッシュから値を返す。無ければ compute() の結果を保存して返す。"""
+    key = make_key(namespace, *parts)
+    version = get_version(namespace)
+    value = cache.get(key, version=version)
+    if value is None:
+        value = compute()
+        cache.set(key, value, timeout=timeout, version=version)
+    return value
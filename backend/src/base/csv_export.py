@@ -0,0 +1,132 @@
+"""
+CSVエクスポートの出力処理。
+
+一覧APIと同じ絞り込み条件のクエリセットを `values_list(...).iterator(chunk_size=...)` で
+サーバーサイドカーソルから少しずつ読み出し、`StreamingHttpResponse` で1行ずつ返します。
+全件をメモリに載せないため、数百万件の出力でもメモリ使用量は一定で、
+ヘッダー行はクエリの実行を待たずにすぐ送信されます。
+ASGI では Django が同期のイテレーターを全件読み込んでから送信するため、非同期のイテレーター (`aiter_csv`) を返します。
+"""
+import csv
+from datetime import date, datetime
+from itertools import islice
+
+from asgiref.sync import sync_to_async
+
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist
+from django.core.handlers.asgi import ASGIRequest
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from rest_framework.decorators import action
+
+from .metadata import active_csv_mappings
+
+# 日時・日付列の出力書式 (CSVインポートの DATE_FORMATS で読み込める形式)
+EXPORT_DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+EXPORT_DATE_FORMAT = '%Y-%m-%d'
+
+# Excelでの文字化けを防ぐためのBOM
+UTF8_BOM = '\ufeff'
+
+
+class Echo:
+    """csv.writer の書き込み先として、書き込まれた文字列をそのまま返す疑似バッファ。"""
+
+    def write(self, value):
+        return value
+
+
+def export_columns(model, data_type):
+    """
+    出力する列を (CSVヘッダー名, values_list に渡すフィールド名) のリストで返す。
+
+    data_type の有効なCSV列マッピングがあればインポートと同じヘッダー名・表示順を使用し、
+    無ければモデルの全フィールドを項目名 (verbose_name) で出力します。
+    外部キーは関連オブジェクトではなくIDを出力します。
+    """
+    columns = []
+    for mapping in active_csv_mappings(data_type):
+        try:
+            field = model._meta.get_field(mapping.model_field_name)
+        except FieldDoesNotExist:
+            continue  # モデルに存在しないフィールドのマッピングは出力しない
+        if not field.concrete:
+            continue
+        columns.append((mapping.csv_header, field.attname if field.is_relation else field.name))
+    if columns:
+        return columns
+    return [
+        (str(field.verbose_name), field.attname if field.is_relation else field.name)
+        for field in model._meta.concrete_fields
+    ]
+
+
+def format_value(value):
+    """1セル分の値をCSVインポートで読み戻せる文字列に変換する。"""
+    if value is None:
+        return ''
+    if isinstance(value, datetime):
+        if timezone.is_aware(value):
+            value = timezone.localtime(value)
+        return value.strftime(EXPORT_DATETIME_FORMAT)
+    if isinstance(value, date):
+        return value.strftime(EXPORT_DATE_FORMAT)
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    return value
+
+
+def iter_csv(queryset, columns, chunk_size=None):
+    """
+    BOM付きヘッダー行に続けて、クエリセットの各行をCSVの1行の文字列として返すジェネレーター。
+    クエリはヘッダー行を送信した後、最初の行が必要になった時点で実行されます。
+    """
+    chunk_size = chunk_size or settings.CSV_EXPORT_CHUNK_SIZE
+    writer = csv.writer(Echo())
+    yield UTF8_BOM + writer.writerow([header for header, _ in columns])
+    rows = queryset.values_list(*[field_name for _, field_name in columns]).iterator(chunk_size=chunk_size)
+    for row in rows:
+        yield writer.writerow([format_value(value) for value in row])
+
+
+async def aiter_csv(queryset, columns, chunk_size=None):
+    """
+    iter_csv の非同期版。iter_csv と同じサーバーサイドカーソルから、チャンクごとにスレッドで読み出します。
+    (values_list の aiterator() は最初のチャンクの前にイベントループ上でクエリを実行してしまうため使用しません。)
+    """
+    chunk_size = chunk_size or settings.CSV_EXPORT_CHUNK_SIZE
+    writer = csv.writer(Echo())
+    yield UTF8_BOM + writer.writerow([header for header, _ in columns])
+    # iterator() はジェネレーターのため、最初のチャンクを読み出すまでクエリは実行されない
+    rows = queryset.values_list(*[field_name for _, field_name in columns]).iterator(chunk_size=chunk_size)
+    next_chunk = sync_to_async(lambda: list(islice(rows, chunk_size)))
+    while chunk := await next_chunk():
+        for row in chunk:
+            yield writer.writerow([format_value(value) for value in row])
+
+
+class CsvExportMixin:
+    """
+    一覧ビューセットに `export-csv` アクションを追加するミックスイン。
+
+    `get_queryset()` (一覧と同じクエリパラメータで絞り込み・並び替え) の結果を
+    ページネーションせずにストリーミングで出力します。
+    ビューセットには `csv_export_data_type` (CsvColumnMapping のデータ種別) を定義してください。
+    """
+    csv_export_data_type = None
+
+    @action(detail=False, methods=['get'], url_path='export-csv')
+    def export_csv(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        if not queryset.ordered:
+            queryset = queryset.order_by('pk')
+        columns = export_columns(queryset.model, self.csv_export_data_type)
+
+        # ASGI では非同期のイテレーターでないと全件がメモリに読み込まれる
+        rows = aiter_csv if isinstance(request._request, ASGIRequest) else iter_csv
+        # 文字列はチャンクごとにエンコードされるため、utf-8-sig ではなく utf-8 とし、BOMはヘッダー行に付ける
+        response = StreamingHttpResponse(rows(queryset, columns), content_type='text/csv; charset=utf-8')
+        filename = f"{self.csv_export_data_type}_{timezone.localtime().strftime('%Y%m%d%H%M%S')}.csv"
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
@@ -0,0 +1,434 @@
+"""
+CSVインポートの読み込み・書き込み処理。
+
+`import_csv_task` から利用されます。アップロードされたファイルは一度に
+メモリへ読み込まず逐次処理し、変換済みの行をバッチ単位でまとめて
+既存レコードの一括取得・`bulk_create`・`bulk_update` を行います。
+"""
+import csv
+import time
+import zlib
+from datetime import datetime
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import models, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import AsyncTask
+from .signals import csv_batch_imported
+
+# 行数カウント時に一度に読み込むバイト数
+COUNT_CHUNK_SIZE = 1024 * 1024
+
+# 日付・日時列として受け付ける書式
+DATE_FORMATS = ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y/%m/%d %H:%M:%S', '%Y/%m/%d %H:%M', '%Y-%m-%d', '%Y/%m/%d')
+
+# 真偽値列で True とみなす値 (小文字で比較)
+BOOLEAN_TRUE_VALUES = frozenset(['true', '1', 'yes', 't', 'はい'])
+
+# 分割インポートのシャードファイルで元の行番号を保持する列のヘッダー名
+SHARD_ROW_NUMBER_HEADER = '__row_number__'
+
+
+def request_cancel(task_id):
+    """
+    インポートタスクのキャンセルを要求する。実行中のタスクはバッチの区切りでこのフラグを確認します。
+    フラグはキャッシュではなく AsyncTask に保持するため、CACHE_URL が未設定 (プロセスごとのキャッシュ) でも
+    Webプロセスから Celery ワーカーへ伝わります。
+    """
+    AsyncTask.objects.filter(task_id=task_id).update(cancel_requested=True, updated_at=timezone.now())
+
+
+def is_cancel_requested(task_id):
+    return AsyncTask.objects.filter(task_id=task_id, cancel_requested=True).exists()
+
+
+class ProgressReporter:
+    """
+    AsyncTask.progress の保存を間引くためのレポーター。
+    前回の保存から一定秒数または一定行数が経過した時点でのみ保存します。
+    update() は保存した場合に True を返します (import_rows はこの間隔でキャンセル要求も確認します)。
+    """
+
+    def __init__(self, task, interval_seconds=None, interval_rows=None):
+        self.task = task
+        self.interval_seconds = settings.CSV_IMPORT_PROGRESS_INTERVAL_SECONDS if interval_seconds is None else interval_seconds
+        self.interval_rows = settings.CSV_IMPORT_PROGRESS_INTERVAL_ROWS if interval_rows is None else interval_rows
+        self._saved_progress = task.progress
+        self._saved_at = time.monotonic()
+
+    def update(self, progress):
+        if (progress - self._saved_progress >= self.interval_rows
+                or time.monotonic() - self._saved_at >= self.interval_seconds):
+            self.save(progress)
+            return True
+        return False
+
+    def save(self, progress):
+        self.task.progress = progress
+        self.task.save(update_fields=['progress', 'updated_at'])
+        self._saved_progress = progress
+        self._saved_at = time.monotonic()
+
+
+class ShardProgressReporter(ProgressReporter):
+    """
+    分割インポートのシャードから親タスクの進捗を報告するレポーター。
+    複数のシャードが同時に報告するため、差分を F() 式で加算します。
+    """
+
+    def __init__(self, parent_task, interval_seconds=None, interval_rows=None):
+        super().__init__(parent_task, interval_seconds, interval_rows)
+        self._saved_progress = 0
+
+    def save(self, progress):
+        AsyncTask.objects.filter(pk=self.task.pk).update(
+            progress=F('progress') + (progress - self._saved_progress),
+            updated_at=timezone.now(),
+        )
+        self._saved_progress = progress
+        self._saved_at = time.monotonic()
+
+
+def count_csv_rows(file_path):
+    """
+    ヘッダーを除いたデータ行数を見積もる。
+    ファイルをバイナリで固定サイズずつ読み、改行の数だけを数えるため
+    ファイルサイズに関わらずメモリ使用量は一定です。
+    (引用符内の改行も1行として数えるため、実際の行数より多くなる場合があります)
+    """
+    line_count = 0
+    last_chunk = b''
+    with open(file_path, 'rb') as f:
+        while chunk := f.read(COUNT_CHUNK_SIZE):
+            line_count += chunk.count(b'\n')
+            last_chunk = chunk
+    if last_chunk and not last_chunk.endswith(b'\n'):
+        line_count += 1  # 末尾に改行がない最終行
+    return max(line_count - 1, 0)
+
+
+def iter_csv_rows(file_path):
+    """
+    CSVファイルを1行ずつ読み込み、(行番号, 値のリスト) を返すジェネレーター。
+    最初に返される行 (行番号1) はヘッダー行です。空行は csv.DictReader と同様に読み飛ばします。
+    """
+    with open(file_path, 'r', encoding='utf-8-sig', newline='') as f:
+        for row_number, values in enumerate(csv.reader(f), start=1):
+            if values:
+                yield row_number, values
+
+
+class DateParser:
+    """
+    DATE_FORMATS の書式で日付文字列を解析する変換関数。
+    同じ列は同じ書式で書かれていることが多いため、最後に成功した書式から試します。
+    日時はデフォルトのタイムゾーン (TIME_ZONE) の時刻として解釈します。
+    """
+
+    def __init__(self, as_date):
+        self.as_date = as_date
+        self.formats = list(DATE_FORMATS)
+        self.tzinfo = timezone.get_default_timezone() if settings.USE_TZ else None
+
+    def __call__(self, value):
+        for index, fmt in enumerate(self.formats):
+            try:
+                parsed = datetime.strptime(value, fmt)
+            except ValueError:
+                continue
+            if index:
+                self.formats.insert(0, self.formats.pop(index))
+            if self.as_date:
+                return parsed.date()
+            return parsed.replace(tzinfo=self.tzinfo) if self.tzinfo else parsed
+        raise ValueError("対応する日付形式ではありません。")
+
+
+def to_int(value):
+    try:
+        return int(value)
+    except ValueError:
+        return int(float(value))  # "10.0" のような表記も受け付ける
+
+
+def to_bool(value):
+    return value.lower() in BOOLEAN_TRUE_VALUES
+
+
+def get_converter(field):
+    """モデルフィールドの型に応じた変換関数を返す。"""
+    if isinstance(field, models.DateTimeField):
+        return DateParser(as_date=False)
+    if isinstance(field, models.DateField):
+        return DateParser(as_date=True)
+    if isinstance(field, models.IntegerField):
+        return to_int
+    if isinstance(field, models.BooleanField):
+        return to_bool
+    if field.is_relation:
+        return field.target_field.to_python
+    return str
+
+
+class CsvImportPlan:
+    """
+    CSVマッピング設定とモデル定義から1タスクにつき1回だけ組み立てる変換計画。
+
+    各列について (列位置, CSVヘッダー名, フィールド名, 変換関数) を事前に決定しておき、
+    行ごとの `_meta.get_field()` や型判定を不要にします。
+    """
+
+    def __init__(self, model, mappings):
+        self.model = model
+        self.fields = []
+        self.update_keys = []
+        for mapping in mappings:
+            field = model._meta.get_field(mapping.model_field_name)
+            # 外部キーは関連オブジェクトではなくIDとして代入する
+            field_name = field.attname if field.is_relation else field.name
+            self.fields.append((mapping.csv_header, field_name, get_converter(field)))
+            if mapping.is_update_key:
+                self.update_keys.append(field_name)
+        self.columns = []
+
+    def bind_header(self, header_row):
+        """
+        CSVのヘッダー行から各列の位置を決定する。
+        ファイルに存在しない列は常に空欄として扱います。
+        """
+        positions = {header.strip(): index for index, header in enumerate(header_row)}
+        self.columns = [
+            (positions.get(csv_header), csv_header, field_name, converter)
+            for csv_header, field_name, converter in self.fields
+        ]
+
+    def convert_row(self, values):
+        """
+        1行分の値を変換し、(上書きキーの値の辞書, 更新値の辞書, エラーのリスト) を返す。
+        """
+        model_data = {}
+        errors = []
+        value_count = len(values)
+        for index, csv_header, field_name, converter in self.columns:
+            value = values[index].strip() if index is not None and index < value_count else ''
+            if not value:
+                continue
+            try:
+                model_data[field_name] = converter(value)
+            except (ValueError, TypeError, ValidationError) as e:
+                errors.append(f"フィールド '{csv_header}' の値 '{value}' は型が不正です: {e}")
+        if errors:
+            return None, None, errors
+
+        lookup = {key: model_data.pop(key) for key in self.update_keys if key in model_data}
+        if len(lookup) != len(self.update_keys):
+            return None, None, [f"上書きキー ({', '.join(self.update_keys)}) の値が空、または見つかりません。"]
+        return lookup, model_data, []
+
+    def shard_of(self, values, shard_count):
+        """
+        上書きキーの変換後の値から行の振り分け先シャード番号を決める。
+        同じキーの行は必ず同じシャードに入るため、シャード同士が同じレコードを更新することはありません。
+        キーが変換できない行はエラー報告のためシャード0に入れます。
+        """
+        value_count = len(values)
+        key = []
+        for index, csv_header, field_name, converter in self.columns:
+            if field_name not in self.update_keys:
+                continue
+            value = values[index].strip() if index is not None and index < value_count else ''
+            try:
+                key.append(converter(value) if value else None)
+            except (ValueError, TypeError, ValidationError):
+                return 0
+        return zlib.crc32(repr(key).encode('utf-8')) % shard_count
+
+
+def import_rows(plan, writer, rows, reporter, cancel_task_id):
+    """
+    行の変換・バッチ書き込み・進捗報告・キャンセル確認を行う共通ループ。
+    rows は (行番号, 値のリスト) のイテラブル。
+    戻り値は (処理した行数, キャンセルされたかどうか)。
+    """
+    batch_size = settings.CSV_IMPORT_BATCH_SIZE
+    batch = []
+    processed = 0
+    for row_number, values in rows:
+        processed += 1
+        update_kwargs, defaults_data, row_errors = plan.convert_row(values)
+        if row_errors:
+            writer.errors.append(f"行 {row_number}: {'; '.join(row_errors)}")
+        else:
+            batch.append((row_number, update_kwargs, defaults_data))
+
+        batch_written = len(batch) >= batch_size
+        if batch_written:
+            writer.write_batch(batch)
+            batch = []
+        # キャンセル要求はバッチの区切りと進捗の保存の間隔で、AsyncTask のフラグを確認する
+        # (エラー行が続いてバッチが埋まらない場合も、進捗の保存の間隔で停止できるようにする)
+        if (reporter.update(processed) or batch_written) and is_cancel_requested(cancel_task_id):
+            writer.write_batch(batch)
+            return processed, True
+
+    writer.write_batch(batch)
+    return processed, False
+
+
+def split_csv_into_shards(plan, rows, shard_paths):
+    """
+    CSVの行を上書きキーのハッシュでシャードファイルに振り分ける。
+    各シャードファイルの先頭列には元ファイルの行番号 (SHARD_ROW_NUMBER_HEADER) を書き込みます。
+    """
+    files = [open(path, 'w', encoding='utf-8', newline='') for path in shard_paths]
+    try:
+        writers = [csv.writer(f) for f in files]
+        header_row = [column for _, column, _, _ in plan.columns]
+        for writer in writers:
+            writer.writerow([SHARD_ROW_NUMBER_HEADER] + header_row)
+        for row_number, values in rows:
+            writers[plan.shard_of(values, len(files))].writerow(
+                [row_number] + [values[index] if index is not None and index < len(values) else '' for index, _, _, _ in plan.columns]
+            )
+    finally:
+        for f in files:
+            f.close()
+
+
+def iter_shard_rows(file_path):
+    """
+    シャードファイルを読み込み、(ヘッダー行, (元の行番号, 値のリスト) のジェネレーター) を返す。
+    """
+    rows = iter_csv_rows(file_path)
+    _, header_row = next(rows, (1, [SHARD_ROW_NUMBER_HEADER]))
+    return header_row[1:], ((int(values[0]), values[1:]) for _, values in rows)
+
+
+class CsvImportWriter:
+    """
+    CSVの行をバッチ単位でDBへ書き込むライター。
+
+    1バッチにつき、上書きキーに一致する既存レコードを1クエリで取得し、
+    新規分は `bulk_create`、既存分は `bulk_update` でまとめて保存します。
+    一括保存に失敗した場合はそのバッチのみ1件ずつ保存し直し、
+    従来どおり行単位でエラーを報告します。
+    """
+
+    def __init__(self, model, update_keys):
+        self.model = model
+        self.update_keys = list(update_keys)
+        self.created_count = 0
+        self.updated_count = 0
+        self.errors = []
+        # bulk_update では auto_now が自動更新されないため、明示的に更新対象に含める
+        self._auto_now_fields = [
+            f.name for f in model._meta.concrete_fields if getattr(f, 'auto_now', False)
+        ]
+
+    def write_batch(self, rows):
+        """
+        1バッチ分の行を保存する。
+
+        rows は (行番号, 上書きキーの値の辞書, 更新値の辞書) のリスト。
+        """
+        if not rows:
+            return
+
+        existing = self._fetch_existing(rows)
+        pending = {}  # key -> 保存予定のオブジェクト情報
+        for row_number, lookup, defaults in rows:
+            key = tuple(lookup[k] for k in self.update_keys)
+            entry = pending.get(key)
+            if entry is None:
+                matches = existing.get(key, [])
+                if len(matches) > 1:
+                    self.errors.append(
+                        f"行 {row_number} ({lookup}): データベース保存エラー - 上書きキーに一致するレコードが複数存在します。"
+                    )
+                    continue
+                if matches:
+                    entry = {'obj': matches[0], 'is_new': False, 'fields': set(), 'rows': [], 'created': 0, 'updated': 0}
+                else:
+                    entry = {'obj': self.model(**lookup), 'is_new': True, 'fields': set(), 'rows': [], 'created': 0, 'updated': 0}
+                pending[key] = entry
+
+            try:
+                for field_name, value in defaults.items():
+                    setattr(entry['obj'], field_name, value)
+            except (ValueError, TypeError) as e:
+                self.errors.append(f"行 {row_number} ({lookup}): データベース保存エラー - {e}")
+                continue
+
+            entry['fields'].update(defaults.keys())
+            entry['rows'].append((row_number, lookup))
+            # 同一バッチ内で同じキーが再登場した場合、update_or_create と同様に2回目以降は更新として数える
+            if entry['is_new'] and entry['created'] == 0:
+                entry['created'] = 1
+            else:
+                entry['updated'] += 1
+
+        entries = [e for e in pending.values() if e['rows']]
+        try:
+            with transaction.atomic():
+                self._bulk_save(entries)
+        except Exception:
+            # 一括保存に失敗したバッチは1件ずつ保存し、失敗した行を特定する
+            self._save_one_by_one(entries)
+        else:
+            for entry in entries:
+                self.created_count += entry['created']
+                self.updated_count += entry['updated']
+
+    def _fetch_existing(self, rows):
+        """
+        バッチ内の上書きキーに一致する既存レコードを1クエリで取得する。
+        複合キーの場合は各キーの IN 条件で候補を絞り込み、Python側で完全一致を判定する。
+        """
+        filters = {}
+        for key_name in self.update_keys:
+            filters[f'{key_name}__in'] = {lookup[key_name] for _, lookup, _ in rows}
+
+        existing = {}
+        for obj in self.model.objects.filter(**filters):
+            key = tuple(getattr(obj, k) for k in self.update_keys)
+            existing.setdefault(key, []).append(obj)
+        return existing
+
+    def _bulk_save(self, entries):
+        to_create = [e['obj'] for e in entries if e['is_new']]
+        to_update = [e['obj'] for e in entries if not e['is_new']]
+        if to_create:
+            self.model.objects.bulk_create(to_create)
+        if to_update:
+            update_fields = set(self._auto_now_fields)
+            for entry in entries:
+                if not entry['is_new']:
+                    update_fields.update(entry['fields'])
+            update_fields.difference_update(self.update_keys)
+            if update_fields:
+                for field_name in self._auto_now_fields:
+                    for obj in to_update:
+                        self.model._meta.get_field(field_name).pre_save(obj, add=False)
+                self.model.objects.bulk_update(to_update, sorted(update_fields))
+        csv_batch_imported.send(sender=self.model, objs=to_create + to_update)
+
+    def _save_one_by_one(self, entries):
+        for entry in entries:
+            obj = entry['obj']
+            try:
+                with transaction.atomic():
+                    if entry['is_new']:
+                        obj.save(force_insert=True)
+                    else:
+                        update_fields = entry['fields'].difference(self.update_keys)
+                        if update_fields:
+                            obj.save(update_fields=sorted(update_fields | set(self._auto_now_fields)))
+            except Exception as e:
+                for row_number, lookup in entry['rows']:
+                    self.errors.append(f"行 {row_number} ({lookup}): データベース保存エラー - {e}")
+                continue
+            self.created_count += entry['created']
+            self.updated_count += entry['updated']
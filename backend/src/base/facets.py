@@ -0,0 +1,91 @@
+"""
+一覧画面の絞り込み用プルダウンに表示する、項目ごとの値と件数 (ファセット) の集計。
+
+複数の項目の `GROUP BY` を `UNION ALL` でまとめ、1回のクエリで集計します。
+集計結果は検索条件ごとに短時間キャッシュされ、入庫処理やCSVインポートで
+`invalidate_facets` によりモデル単位で無効化されます。
+"""
+from django.conf import settings
+from django.db.models import CharField, Count, F, Value
+from rest_framework import status
+from rest_framework.decorators import action
+from rest_framework.response import Response
+
+from . import cache as versioned_cache
+
+# ページネーションなど、絞り込み結果に影響しないクエリパラメータ (キャッシュキーに含めない)
+IGNORED_PARAMS = frozenset(['fields', 'page', 'page_size', 'count', 'cursor', 'pagination', 'format'])
+
+
+def facet_namespace(model):
+    return f'facets:{model._meta.label_lower}'
+
+
+def invalidate_facets(*models):
+    """モデルのファセット集計のキャッシュを無効にする。"""
+    for model in models:
+        versioned_cache.invalidate(facet_namespace(model))
+
+
+def facet_counts(queryset, fields):
+    """
+    クエリセットの各項目の値ごとの件数を1回のクエリで集計し、
+    {項目名: [{'value': 値, 'count': 件数}, ...]} (値の昇順) を返す。空・NULLの値は含めません。
+    """
+    queryset = queryset.order_by()
+    parts = [
+        queryset.filter(**{f'{field}__isnull': False}).exclude(**{field: ''})
+        .annotate(facet_field=Value(field, output_field=CharField()), facet_value=F(field))
+        .values('facet_field', 'facet_value')
+        .annotate(facet_count=Count('pk'))
+        .values_list('facet_field', 'facet_value', 'facet_count')
+        for field in fields
+    ]
+    facets = {field: [] for field in fields}
+    if not parts:
+        return facets
+    query = parts[0].union(*parts[1:], all=True) if len(parts) > 1 else parts[0]
+    for field, value, count in query:
+        facets[field].append({'value': value, 'count': count})
+    for values in facets.values():
+        values.sort(key=lambda item: item['value'])
+    return facets
+
+
+def cached_facet_counts(queryset, fields, params=()):
+    """
+    facet_counts の結果をキャッシュから返す。params には絞り込み条件 (キャッシュキーの一部) を渡します。
+    """
+    return versioned_cache.get_or_set(
+        facet_namespace(queryset.model),
+        (tuple(fields), tuple(params)),
+        lambda: facet_counts(queryset, fields),
+        timeout=settings.FACET_CACHE_TIMEOUT,
+    )
+
+
+class FacetMixin:
+    """
+    一覧ビューセットに `facets` アクションを追加するミックスイン。
+
+    `?fields=warehouse,status` で指定した項目 (省略時は `facet_fields` のすべて) について、
+    一覧と同じ絞り込み条件での値ごとの件数を返します。
+    ビューセットには集計を許可する項目 (CharField) を `facet_fields` に定義してください。
+    """
+    facet_fields = ()
+
+    @action(detail=False, methods=['get'], url_path='facets')
+    def facets(self, request, *args, **kwargs):
+        requested = [f.strip() for f in request.query_params.get('fields', '').split(',') if f.strip()]
+        fields = requested or list(self.facet_fields)
+        invalid = [field for field in fields if field not in self.facet_fields]
+        if invalid:
+            return Response(
+                {'error': f"Invalid facet field(s): {', '.join(invalid)}. Allowed: {', '.join(self.facet_fields)}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        params = sorted(
+            (key, tuple(values)) for key, values in request.query_params.lists() if key not in IGNORED_PARAMS
+        )
+        return Response(cached_facet_counts(self.filter_queryset(self.get_queryset()), fields, params))
@@ -0,0 +1,116 @@
+"""
+HTTPの負荷計測 (benchmark_http・benchmark_db_connections コマンドで使用)。
+
+gunicorn を指定した環境変数で起動し、同時リクエストを送信してスループットと応答時間の分布を求めます。
+"""
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from django.conf import settings
+from django.core.management.base import CommandError
+
+HEALTH_PATH = '/api/base/health/'
+
+
+def free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_gunicorn(port, env_overrides):
+    """gunicorn.conf.py の設定で gunicorn を起動する。env_overrides で環境変数 (配信方式・DB接続設定など) を上書きします。"""
+    env = dict(os.environ, GUNICORN_BIND=f'127.0.0.1:{port}', **env_overrides)
+    return subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '--config', 'gunicorn.conf.py'],
+        cwd=settings.BASE_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+
+
+def wait_until_ready(base_url, server, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise CommandError('gunicorn が起動できませんでした (asgi の場合は uvicorn がインストールされているか確認してください)。')
+        try:
+            if requests.get(base_url + HEALTH_PATH, timeout=1).status_code == 200:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    raise CommandError(f'{timeout} 秒以内にサーバーが応答しませんでした。')
+
+
+class running_gunicorn:
+    """gunicorn を起動し、応答可能になってからベースURLを返すコンテキストマネージャー。終了時に停止します。"""
+
+    def __init__(self, env_overrides):
+        self.port = free_port()
+        self.env_overrides = env_overrides
+
+    def __enter__(self):
+        self.server = start_gunicorn(self.port, self.env_overrides)
+        base_url = f'http://127.0.0.1:{self.port}'
+        try:
+            wait_until_ready(base_url, self.server)
+        except Exception:
+            self.__exit__()
+            raise
+        return base_url
+
+    def __exit__(self, *exc_info):
+        self.server.terminate()
+        self.server.wait(timeout=30)
+
+
+def percentile(sorted_values, ratio):
+    if not sorted_values:
+        return 0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * ratio))]
+
+
+def run_load(base_url, paths, headers, total, concurrency):
+    """paths を順番に total 回、concurrency 件ずつ同時に GET し、計測結果を返す。"""
+    local = threading.local()
+
+    def send(index):
+        # スレッドごとに接続を再利用する
+        if not hasattr(local, 'session'):
+            local.session = requests.Session()
+        started = time.perf_counter()
+        try:
+            ok = local.session.get(base_url + paths[index % len(paths)], headers=headers, timeout=60).status_code < 400
+        except requests.RequestException:
+            ok = False
+        return time.perf_counter() - started, ok
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(send, range(total)))
+    elapsed = time.perf_counter() - started
+
+    latencies = sorted(latency for latency, _ in results)
+    return {
+        'requests': total,
+        'errors': sum(1 for _, ok in results if not ok),
+        'elapsed': elapsed,
+        'throughput': total / elapsed if elapsed else 0,
+        'p50': statistics.median(latencies) if latencies else 0,
+        'p95': percentile(latencies, 0.95),
+        'p99': percentile(latencies, 0.99),
+    }
+
+
+def format_result(label, result):
+    return (
+        f'{label}: {result["requests"]} リクエスト, {result["elapsed"]:.2f} 秒, '
+        f'{result["throughput"]:,.0f} リクエスト/秒, p50 {result["p50"] * 1000:.1f} ms, '
+        f'p95 {result["p95"] * 1000:.1f} ms, p99 {result["p99"] * 1000:.1f} ms, エラー {result["errors"]} 件'
+    )
@@ -0,0 +1,148 @@
+import csv
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import models, transaction
+
+from base.csv_import import CsvImportPlan, CsvImportWriter, iter_csv_rows
+from base.models import CsvColumnMapping
+from inventory.models import PurchaseOrder
+
+# ベンチマーク用の入庫予定CSVの列定義 (CSVヘッダー名, モデルフィールド名, 上書きキー)
+PURCHASE_ORDER_COLUMNS = [
+    ('発注番号', 'order_number', True),
+    ('仕入先', 'supplier', False),
+    ('品目', 'item', False),
+    ('品番', 'part_number', False),
+    ('品名', 'product_name', False),
+    ('発注数量', 'quantity', False),
+    ('入荷予定日時', 'expected_arrival', False),
+    ('入庫倉庫', 'warehouse', False),
+    ('入庫棚番', 'location', False),
+    ('初回', 'is_first_time', False),
+]
+
+
+def legacy_convert_row(model, header_to_model_map, update_keys, row):
+    """
+    変換計画導入前の import_csv_task と同じ、セルごとに型判定を行う変換処理 (比較用)。
+    """
+    model_data = {}
+    errors = []
+    for csv_header, model_field_name in header_to_model_map.items():
+        value = row.get(csv_header, '').strip()
+        if not value:
+            model_data[model_field_name] = None
+            continue
+        try:
+            field_obj = model._meta.get_field(model_field_name)
+            if isinstance(field_obj, (models.DateTimeField, models.DateField)):
+                parsed_date = None
+                for fmt in ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y/%m/%d %H:%M:%S', '%Y/%m/%d %H:%M', '%Y-%m-%d', '%Y/%m/%d'):
+                    try:
+                        parsed_date = datetime.strptime(value, fmt)
+                        break
+                    except ValueError:
+                        continue
+                if parsed_date is None:
+                    raise ValueError("対応する日付形式ではありません。")
+                model_data[model_field_name] = parsed_date.date() if isinstance(field_obj, models.DateField) else parsed_date
+            elif isinstance(field_obj, (models.IntegerField, models.PositiveIntegerField)):
+                model_data[model_field_name] = int(float(value))
+            elif isinstance(field_obj, models.BooleanField):
+                model_data[model_field_name] = value.lower() in ['true', '1', 'yes', 't', 'はい']
+            else:
+                model_data[model_field_name] = value
+        except (ValueError, TypeError) as e:
+            errors.append(str(e))
+    update_kwargs = {key: model_data.pop(key) for key in update_keys if model_data.get(key) is not None}
+    return update_kwargs, {k: v for k, v in model_data.items() if v is not None}, errors
+
+
+class Command(BaseCommand):
+    help = '入庫予定 (purchase_order) のCSVを生成し、インポートの変換処理の行/秒を変換計画の導入前後で比較します。'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=100000, help='生成する行数 (既定: 100000)')
+        parser.add_argument(
+            '--with-db', action='store_true',
+            help='変換後にバッチ書き込みも実行して計測します (トランザクションはロールバックされます)。'
+        )
+
+    def handle(self, *args, **options):
+        row_count = options['rows']
+        mappings = [
+            CsvColumnMapping(data_type='purchase_order', csv_header=header, model_field_name=field, is_update_key=is_key)
+            for header, field, is_key in PURCHASE_ORDER_COLUMNS
+        ]
+
+        fd, file_path = tempfile.mkstemp(suffix='.csv')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8-sig', newline='') as f:
+                self._write_sample_csv(f, row_count)
+
+            legacy_elapsed = self._run_legacy(file_path, mappings)
+            plan_elapsed = self._run_plan(file_path, mappings)
+
+            self.stdout.write(f'行数: {row_count}')
+            self.stdout.write(f'変換 (導入前): {legacy_elapsed:.2f} 秒, {row_count / legacy_elapsed:,.0f} 行/秒')
+            self.stdout.write(f'変換 (変換計画): {plan_elapsed:.2f} 秒, {row_count / plan_elapsed:,.0f} 行/秒')
+            self.stdout.write(self.style.SUCCESS(f'高速化: {legacy_elapsed / plan_elapsed:.1f} 倍'))
+
+            if options['with_db']:
+                db_elapsed = self._run_plan_with_db(file_path, mappings)
+                self.stdout.write(f'変換 + DB書き込み: {db_elapsed:.2f} 秒, {row_count / db_elapsed:,.0f} 行/秒')
+        finally:
+            os.remove(file_path)
+
+    def _write_sample_csv(self, f, row_count):
+        writer = csv.writer(f)
+        writer.writerow([header for header, _, _ in PURCHASE_ORDER_COLUMNS])
+        base_date = datetime(2025, 1, 1, 8, 0)
+        for i in range(row_count):
+            writer.writerow([
+                f'BM-{i:08d}', f'仕入先{i % 50}', f'品目{i % 1000}', f'PART-{i % 5000:05d}', f'品名{i % 1000}',
+                (i % 100) + 1, (base_date + timedelta(hours=i % 2000)).strftime('%Y/%m/%d %H:%M'),
+                f'WH-{i % 5}', f'L-{i % 200:03d}', 'はい' if i % 10 == 0 else '',
+            ])
+
+    def _run_legacy(self, file_path, mappings):
+        header_to_model_map = {m.csv_header: m.model_field_name for m in mappings}
+        update_keys = [m.model_field_name for m in mappings if m.is_update_key]
+        started = time.perf_counter()
+        with open(file_path, 'r', encoding='utf-8-sig', newline='') as f:
+            for row in csv.DictReader(f):
+                legacy_convert_row(PurchaseOrder, header_to_model_map, update_keys, row)
+        return time.perf_counter() - started
+
+    def _run_plan(self, file_path, mappings):
+        started = time.perf_counter()
+        plan = CsvImportPlan(PurchaseOrder, mappings)
+        rows = iter_csv_rows(file_path)
+        plan.bind_header(next(rows)[1])
+        for _, values in rows:
+            plan.convert_row(values)
+        return time.perf_counter() - started
+
+    def _run_plan_with_db(self, file_path, mappings):
+        started = time.perf_counter()
+        with transaction.atomic():
+            plan = CsvImportPlan(PurchaseOrder, mappings)
+            writer = CsvImportWriter(PurchaseOrder, plan.update_keys)
+            rows = iter_csv_rows(file_path)
+            plan.bind_header(next(rows)[1])
+            batch = []
+            for row_number, values in rows:
+                lookup, defaults, errors = plan.convert_row(values)
+                if not errors:
+                    batch.append((row_number, lookup, defaults))
+                if len(batch) >= 2000:
+                    writer.write_batch(batch)
+                    batch = []
+            writer.write_batch(batch)
+            elapsed = time.perf_counter() - started
+            transaction.set_rollback(True)
+        return elapsed
@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+
+from base.http_benchmark import format_result, run_load, running_gunicorn
+
+# 既定で計測するエンドポイント (非同期ビューに変換した読み取り専用のもの)
+DEFAULT_PATHS = ['/api/base/health/', '/api/users/session/']
+
+
+class Command(BaseCommand):
+    help = (
+        'gunicorn を同期ワーカー (sync) と uvicorn ワーカー (asgi) でそれぞれ起動し、'
+        '同時リクエストのスループット (リクエスト/秒) と応答時間を比較します。'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--modes', nargs='+', default=['sync', 'asgi'], choices=['sync', 'asgi'], help='計測する配信方式 (既定: sync asgi)')
+        parser.add_argument('--path', dest='paths', action='append', help=f'計測するパス (複数指定可、既定: {" ".join(DEFAULT_PATHS)})')
+        parser.add_argument('--requests', type=int, default=2000, help='配信方式ごとのリクエスト数 (既定: 2000)')
+        parser.add_argument('--concurrency', type=int, default=50, help='同時リクエスト数 (既定: 50)')
+        parser.add_argument('--workers', type=int, default=2, help='gunicorn のワーカー数 (既定: 2)')
+        parser.add_argument('--token', help='Authorization: Bearer に指定するアクセストークン (認証が必要なパスを計測する場合)')
+        parser.add_argument('--url', help='起動済みのサーバーのURL (指定した場合は gunicorn を起動せず、そのサーバーを計測します)')
+
+    def handle(self, *args, **options):
+        paths = options['paths'] or DEFAULT_PATHS
+        headers = {'Authorization': f'Bearer {options["token"]}'} if options['token'] else {}
+
+        if options['url']:
+            result = run_load(options['url'].rstrip('/'), paths, headers, options['requests'], options['concurrency'])
+            self.stdout.write(format_result('server', result))
+            return
+
+        results = {}
+        for mode in options['modes']:
+            with running_gunicorn({'GUNICORN_WORKER_MODE': mode, 'GUNICORN_WORKERS': str(options['workers'])}) as base_url:
+                results[mode] = run_load(base_url, paths, headers, options['requests'], options['concurrency'])
+            self.stdout.write(format_result(mode, results[mode]))
+
+        if 'sync' in results and 'asgi' in results and results['sync']['throughput']:
+            ratio = results['asgi']['throughput'] / results['sync']['throughput']
+            self.stdout.write(self.style.SUCCESS(f'asgi / sync のスループット比: {ratio:.2f} 倍'))
@@ -0,0 +1,122 @@
+"""
+表示設定 (ModelDisplaySetting) とCSV列マッピング (CsvColumnMapping) のキャッシュ。
+
+設定はプロセス内のメモリに保持し、無ければ共有キャッシュ (Redis など) から、それも無ければ
+データベースから読み込みます。保持している値の鮮度はモデルごとの名前空間のバージョン
+(`base.cache.get_version`) で確認し、設定が保存・削除されるとシグナル、または一括保存 (bulk-save)
+でバージョンが進みます。同じバージョンを ETag として返すため、フロントエンドは変更が無ければ
+304 Not Modified で設定を再利用できます。
+
+バージョンの更新は共有キャッシュを通じて他のプロセスに伝わるため、キャッシュは METADATA_CACHE_ENABLED
+(既定では CACHE_URL を設定した場合のみ) の場合だけ使用し、無効な場合は毎回データベースから読み込みます。
+"""
+import threading
+
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.response import Response
+
+from . import cache as versioned_cache
+from .models import CsvColumnMapping, ModelDisplaySetting
+from .signals import csv_batch_imported
+
+
+class MetadataCache:
+    """名前空間のバージョンごとに、プロセス内のメモリと共有キャッシュの2段でモデルの設定を保持する。"""
+
+    def __init__(self, model, ordering):
+        self.model = model
+        self.ordering = ordering
+        self.namespace = f'metadata:{model._meta.label_lower}'
+        self._lock = threading.Lock()
+        self._version = None
+        self._local = {}
+
+    def invalidate(self):
+        versioned_cache.invalidate(self.namespace)
+
+    def etag(self):
+        return f'"{self.namespace}:{versioned_cache.get_version(self.namespace)}"'
+
+    def get(self, key, load):
+        """キーの値をメモリ、共有キャッシュ、load() の順に探して返す。"""
+        if not settings.METADATA_CACHE_ENABLED:
+            return load()
+        version = versioned_cache.get_version(self.namespace)
+        with self._lock:
+            if version != self._version:
+                self._local = {}
+                self._version = version
+            if key in self._local:
+                return self._local[key]
+        value = versioned_cache.get_or_set(self.namespace, key, load, timeout=settings.METADATA_CACHE_TIMEOUT)
+        with self._lock:
+            if version == self._version:
+                self._local[key] = value
+        return value
+
+    def objects(self, data_type=None):
+        """データ種別 (省略時はすべて) の設定のリストを返す。"""
+        def load():
+            queryset = self.model.objects.order_by(*self.ordering)
+            if data_type is not None:
+                queryset = queryset.filter(data_type=data_type)
+            return list(queryset)
+        return self.get(('objects', data_type), load)
+
+
+display_settings = MetadataCache(ModelDisplaySetting, ['display_order'])
+csv_mappings = MetadataCache(CsvColumnMapping, ['order'])
+
+
+def active_csv_mappings(data_type):
+    """データ種別の有効なCSV列マッピングを表示順に返す。"""
+    return [mapping for mapping in csv_mappings.objects(data_type) if mapping.is_active]
+
+
+class MetadataCacheMixin:
+    """
+    設定のビューセットの一覧 (`?data_type=` による絞り込みのみ) をキャッシュから ETag 付きで返すミックスイン。
+    ビューセットには `metadata_cache` を定義してください。
+    """
+    metadata_cache = None
+
+    def list(self, request, *args, **kwargs):
+        data_type = request.query_params.get('data_type')
+        if (not settings.METADATA_CACHE_ENABLED
+                or set(request.query_params) - {'data_type', 'format'} or data_type == ''):
+            return super().list(request, *args, **kwargs)
+        if data_type is not None:
+            # 不正なデータ種別のエラー応答はフィルタに任せる
+            filterset = self.filterset_class(request.query_params, queryset=self.get_queryset())
+            if not filterset.is_valid():
+                return super().list(request, *args, **kwargs)
+
+        etag = self.metadata_cache.etag()
+        if etag in [tag.strip() for tag in request.headers.get('If-None-Match', '').split(',')]:
+            response = Response(status=304)
+        else:
+            data = self.metadata_cache.get(
+                ('serialized', data_type),
+                lambda: list(self.get_serializer(self.metadata_cache.objects(data_type), many=True).data),
+            )
+            response = Response(data)
+        response['ETag'] = etag
+        # ブラウザにはキャッシュさせるが、使用前に必ず ETag で再検証させる
+        response['Cache-Control'] = 'private, no-cache'
+        return response
+
+
+@receiver(post_save, sender=ModelDisplaySetting)
+@receiver(post_delete, sender=ModelDisplaySetting)
+@receiver(csv_batch_imported, sender=ModelDisplaySetting)
+def invalidate_display_settings(sender, **kwargs):
+    display_settings.invalidate()
+
+
+@receiver(post_save, sender=CsvColumnMapping)
+@receiver(post_delete, sender=CsvColumnMapping)
+@receiver(csv_batch_imported, sender=CsvColumnMapping)
+def invalidate_csv_mappings(sender, **kwargs):
+    csv_mappings.invalidate()
@@ -0,0 +1,242 @@
+"""
+Prometheus 形式の性能メトリクス。
+
+リクエスト (`base.middleware.MetricsMiddleware`) と Celery タスクの計測値をプロセス内で集計し、
+バックグラウンドのスレッドが METRICS_FLUSH_INTERVAL 秒ごとに共有キャッシュ (Redis) のカウンターへ加算します
+(リクエストの処理中にはキャッシュへ書き込みません)。Redis ではパイプラインでまとめて INCRBY するため、
+複数の gunicorn ワーカーや別コンテナの Celery ワーカーから同時に書き込んでも失われず、
+`/api/base/metrics/` はどのプロセスからでも全体の値を返します。
+プロセスごとに別のカウンターになるローカルメモリのキャッシュでは正しく集計できないため、
+METRICS_ENABLED の場合は共有キャッシュ (CACHE_URL) が必須です (`base.cache.check_shared_cache` を参照)。
+
+キャッシュのカウンターは整数のため、秒の合計はマイクロ秒単位で保存し、出力時に秒へ戻します。
+ヒストグラムはバケットごとの件数を保存し、出力時に累積します。
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+
+from celery.signals import task_postrun, task_prerun
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.cache.backends.redis import RedisCache
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = 'metrics'
+# 秒の合計を整数のカウンターに保存するための倍率 (マイクロ秒)
+SECONDS_SCALE = 1_000_000
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (100, 1_000, 10_000, 100_000, 1_000_000, 10_000_000)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+TASK_DURATION_BUCKETS = (0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0, 3600.0)
+
+# メトリクス名 -> (種類, 説明, ヒストグラムのバケット, 秒の値か)
+METRICS = {
+    'http_requests_total': ('counter', 'HTTP responses by view, method and status code.', None, False),
+    'http_request_duration_seconds': ('histogram', 'Request latency in seconds by view.', LATENCY_BUCKETS, True),
+    'http_request_db_queries': ('histogram', 'Database queries per request by view.', QUERY_COUNT_BUCKETS, False),
+    'http_request_db_duration_seconds_total': ('counter', 'Time spent in database queries by view.', None, True),
+    'http_response_size_bytes': ('histogram', 'Response body size in bytes by view (non-streaming responses).', SIZE_BUCKETS, False),
+    'celery_task_duration_seconds': ('histogram', 'Celery task run time in seconds by task and state.', TASK_DURATION_BUCKETS, True),
+    'celery_task_rows_total': ('counter', 'Rows processed by Celery tasks (e.g. CSV import), for rate() throughput.', None, False),
+}
+
+
+def _series(name, labels):
+    """系列 (メトリクス名とラベル) を表す文字列を返す。"""
+    return json.dumps([name, sorted(labels.items())], ensure_ascii=False, separators=(',', ':'))
+
+
+def _value_key(series):
+    # ラベルの値に空白などが含まれてもキャッシュキーとして使えるようにハッシュ化する
+    return f'{KEY_PREFIX}:value:{hashlib.sha1(series.encode("utf-8")).hexdigest()}'
+
+
+class MetricsRecorder:
+    """プロセス内で計測値を集計し、バックグラウンドのスレッドで一定間隔ごとに共有キャッシュのカウンターに加算する。"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = defaultdict(int)
+        self._registered = set()
+        self._flusher_pid = None
+
+    def _add(self, name, labels, value):
+        if not settings.METRICS_ENABLED:
+            return
+        with self._lock:
+            self._pending[_series(name, labels)] += value
+        self._start_flusher()
+
+    def inc(self, name, labels, value=1):
+        if METRICS[name][3]:
+            value = round(value * SECONDS_SCALE)
+        self._add(name, labels, value)
+
+    def observe(self, name, labels, value):
+        """ヒストグラムに値を記録する (値が入るバケットの件数・合計・件数を加算します)。"""
+        _, _, buckets, is_seconds = METRICS[name]
+        le = next((bound for bound in buckets if value <= bound), '+Inf')
+        self._add(f'{name}_bucket', dict(labels, le=str(le)), 1)
+        self._add(f'{name}_sum', labels, round(value * SECONDS_SCALE) if is_seconds else value)
+        self._add(f'{name}_count', labels, 1)
+
+    def _start_flusher(self):
+        # gunicorn・Celery のワーカーは fork されるため、スレッドはプロセスごとに起動する
+        if self._flusher_pid == os.getpid():
+            return
+        with self._lock:
+            if self._flusher_pid == os.getpid():
+                return
+            self._flusher_pid = os.getpid()
+        threading.Thread(target=self._run_flusher, name='metrics-flush', daemon=True).start()
+
+    def _run_flusher(self):
+        while True:
+            time.sleep(settings.METRICS_FLUSH_INTERVAL)
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Failed to flush metrics to the cache')
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, defaultdict(int)
+        if not pending:
+            return
+        series_list = list(pending)
+        for series, created in zip(series_list, _incr_many({_value_key(series): pending[series] for series in series_list})):
+            if created:
+                # 作成された (またはキャッシュから消えていた) カウンターは一覧に登録し直す
+                self._registered.discard(series)
+            self._register(series)
+
+    def _register(self, series):
+        """系列を一覧に登録する。cache.add で1つのプロセスだけが番号を採番して登録します。"""
+        if series in self._registered:
+            return
+        if cache.add(f'{_value_key(series)}:registered', 1, timeout=None):
+            index = _incr(f'{KEY_PREFIX}:series_count')
+            cache.set(f'{KEY_PREFIX}:series:{index}', series, timeout=None)
+        self._registered.add(series)
+
+
+def _incr_many(deltas):
+    """
+    キャッシュのカウンターに {キー: 加算する値} を加算し、キーごとにカウンターを新しく作成したかを返す。
+    Redis ではパイプラインで1往復にまとめて INCRBY します (存在しないキーは 0 から作成されます)。
+    """
+    backend = caches['default']
+    if isinstance(backend, RedisCache):
+        client = backend._cache.get_client(write=True)
+        pipeline = client.pipeline(transaction=False)
+        for key, delta in deltas.items():
+            pipeline.incrby(backend.make_and_validate_key(key), delta)
+        return [total == delta for total, delta in zip(pipeline.execute(), deltas.values())]
+
+    created = []
+    for key, delta in deltas.items():
+        try:
+            cache.incr(key, delta)
+            created.append(False)
+        except ValueError:
+            # 同時に作成された場合も add は一方のみ成功する
+            cache.add(key, 0, timeout=None)
+            cache.incr(key, delta)
+            created.append(True)
+    return created
+
+
+def _incr(key):
+    try:
+        return cache.incr(key)
+    except ValueError:
+        cache.add(key, 0, timeout=None)
+        return cache.incr(key)
+
+
+recorder = MetricsRecorder()
+
+
+def collect():
+    """共有キャッシュから全系列の値を読み込み、{系列の文字列: 値} を返す。"""
+    count = cache.get(f'{KEY_PREFIX}:series_count') or 0
+    series_keys = [f'{KEY_PREFIX}:series:{index}' for index in range(1, count + 1)]
+    value_keys = {_value_key(series): series for series in cache.get_many(series_keys).values()}
+    values = cache.get_many(list(value_keys))
+    return {value_keys[key]: value for key, value in values.items()}
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (
+        (name, str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"'))
+        for name, value in labels
+    )
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+
+def _format_value(value, is_seconds):
+    return repr(value / SECONDS_SCALE) if is_seconds else str(value)
+
+
+def render():
+    """全プロセスの計測値を Prometheus のテキスト形式 (version 0.0.4) で返す。"""
+    recorder.flush()
+    samples = defaultdict(dict)
+    for series, value in collect().items():
+        name, labels = json.loads(series)
+        samples[name][tuple(tuple(label) for label in labels)] = value
+
+    lines = []
+    for name, (metric_type, help_text, buckets, is_seconds) in METRICS.items():
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {metric_type}')
+        if metric_type == 'counter':
+            for labels, value in sorted(samples[name].items()):
+                lines.append(f'{name}{_format_labels(labels)} {_format_value(value, is_seconds)}')
+            continue
+
+        bucket_counts = defaultdict(dict)
+        for labels, value in samples[f'{name}_bucket'].items():
+            le = dict(labels)['le']
+            bucket_counts[tuple(label for label in labels if label[0] != 'le')][le] = value
+        for labels, count in sorted(samples[f'{name}_count'].items()):
+            # バケットの件数を累積して出力する
+            cumulative = 0
+            for bound in [*map(str, buckets), '+Inf']:
+                cumulative += bucket_counts[labels].get(bound, 0)
+                lines.append(f'{name}_bucket{_format_labels((*labels, ("le", bound)))} {cumulative}')
+            lines.append(f'{name}_sum{_format_labels(labels)} {_format_value(samples[f"{name}_sum"].get(labels, 0), is_seconds)}')
+            lines.append(f'{name}_count{_format_labels(labels)} {count}')
+    return '\n'.join(lines) + '\n'
+
+
+def record_task_rows(task_name, rows):
+    """Celery タスクが処理した行数を記録する (スループットは rate(celery_task_rows_total[5m]) で求めます)。"""
+    recorder.inc('celery_task_rows_total', {'task': task_name}, rows)
+
+
+_task_started = {}
+
+
+@task_prerun.connect
+def _record_task_start(task_id=None, **kwargs):
+    _task_started[task_id] = time.perf_counter()
+
+
+@task_postrun.connect
+def _record_task_duration(task_id=None, task=None, state=None, **kwargs):
+    started = _task_started.pop(task_id, None)
+    if started is not None and task is not None:
+        recorder.observe('celery_task_duration_seconds', {'task': task.name, 'state': state or 'UNKNOWN'}, time.perf_counter() - started)
+    # タスクの終了時点で共有キャッシュへ書き込む (ワーカーが次のタスクを待つ間に失われないように)
+    if settings.METRICS_ENABLED:
+        recorder.flush()
@@ -0,0 +1,116 @@
+import random
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+from .metrics import recorder
+from .query_inspection import inspect_queries, report, view_query_budget, wrap_queries
+
+
+class QueryStats:
+    """execute_wrapper でリクエスト中のクエリの件数と実行時間を数える。"""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.duration += time.perf_counter() - started
+
+
+class MetricsMiddleware:
+    """
+    ビューごとの応答時間・クエリ件数と時間・レスポンスサイズ・ステータスコードを記録するミドルウェア
+    (DEBUG に関係なく動作します)。記録した値は `/api/base/metrics/` で Prometheus 形式で参照できます。
+    ASGI では非同期のまま処理し、後続のミドルウェアと非同期ビューをスレッドに移しません。
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        if not settings.METRICS_ENABLED:
+            return self.get_response(request)
+
+        queries = QueryStats()
+        started = time.perf_counter()
+        with wrap_queries(queries):
+            response = self.get_response(request)
+        self.record(request, response, queries, time.perf_counter() - started)
+        return response
+
+    async def __acall__(self, request):
+        if not settings.METRICS_ENABLED:
+            return await self.get_response(request)
+
+        queries = QueryStats()
+        started = time.perf_counter()
+        with wrap_queries(queries):
+            response = await self.get_response(request)
+        self.record(request, response, queries, time.perf_counter() - started)
+        return response
+
+    def record(self, request, response, queries, duration):
+        match = getattr(request, 'resolver_match', None)
+        # ラベルの種類が増えすぎないよう、URLではなくビュー名 (未解決のURLは 'unresolved') で集計する
+        labels = {'view': match.view_name if match else 'unresolved'}
+        recorder.inc('http_requests_total', dict(labels, method=request.method, status=str(response.status_code)))
+        recorder.observe('http_request_duration_seconds', labels, duration)
+        recorder.observe('http_request_db_queries', labels, queries.count)
+        recorder.inc('http_request_db_duration_seconds_total', labels, queries.duration)
+        if not response.streaming:
+            recorder.observe('http_response_size_bytes', labels, len(response.content))
+
+
+class QueryInspectionMiddleware:
+    """
+    リクエスト中のクエリを検査し、N+1 の疑いとビューに宣言されたクエリ予算の超過を報告するミドルウェア
+    (`base.query_inspection` を参照)。QUERY_INSPECTION_SAMPLE_RATE の割合のリクエストだけを検査します。
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        if random.random() >= settings.QUERY_INSPECTION_SAMPLE_RATE:
+            return self.get_response(request)
+
+        with inspect_queries() as inspector:
+            response = self.get_response(request)
+        self.report(request, inspector)
+        return response
+
+    async def __acall__(self, request):
+        if random.random() >= settings.QUERY_INSPECTION_SAMPLE_RATE:
+            return await self.get_response(request)
+
+        with inspect_queries() as inspector:
+            response = await self.get_response(request)
+        self.report(request, inspector)
+        return response
+
+    def report(self, request, inspector):
+        # process_view は ASGI ではスレッドで呼び出されるため使わず、解決済みのビュー関数から予算を求める
+        match = getattr(request, 'resolver_match', None)
+        budget = view_query_budget(match.func, request.method) if match else None
+        report(request, inspector.problems(budget))
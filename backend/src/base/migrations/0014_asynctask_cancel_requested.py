@@ -0,0 +1,18 @@
+# Generated by Django 5.1.7 on 2026-10-18 20:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0013_asynctask'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='asynctask',
+            name='cancel_requested',
+            field=models.BooleanField(default=False, verbose_name='キャンセル要求'),
+        ),
+    ]
@@ -265,6 +265,8 @@ class AsyncTask(models.Model):
     progress = models.PositiveIntegerField(_("進捗"), default=0)
     total = models.PositiveIntegerField(_("総数"), default=100)
     result = models.JSONField(_("結果"), null=True, blank=True)
+    # 実行中のタスクがバッチの区切りで確認するキャンセル要求 (Webプロセスとワーカーで共有するためDBに保持する)
+    cancel_requested = models.BooleanField(_("キャンセル要求"), default=False)
     created_at = models.DateTimeField(_("作成日時"), auto_now_add=True)
     updated_at = models.DateTimeField(_("更新日時"), auto_now=True)
 
@@ -0,0 +1,239 @@
+"""
+一覧APIのページネーション部品。
+
+- `KeysetPagination`: キーセット (カーソル) 方式のページネーション
+- `CountModePaginationMixin`: ?count=exact|estimate|none による総件数の取得方法の切り替え
+"""
+import base64
+import binascii
+import json
+import math
+import uuid
+from datetime import date, datetime
+from functools import partial
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.paginator import EmptyPage, Page, PageNotAnInteger, Paginator
+from django.db import connections
+from django.db.models import F, Q
+from django.utils.functional import cached_property
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+# ?count= で指定できる総件数の取得方法
+#   exact:    COUNT(*) による正確な件数 (既定)
+#   estimate: PostgreSQL の実行計画の推定行数が閾値以上ならその値を返し、未満なら正確に数える
+#   none:     件数を数えない (count / total_pages は null)
+COUNT_MODES = ('exact', 'estimate', 'none')
+
+
+class KeysetPagination(BasePagination):
+    """
+    キーセット (カーソル) 方式のページネーション。
+
+    ビューの `cursor_ordering` (例: ('-movement_date', 'part_number', 'id')) の順に並べ、
+    前ページ最終行の値より後ろの行を WHERE 条件で取得します。OFFSET と件数の集計を行わないため、
+    深いページでも先頭ページと同じコストで取得できます。最後のキーは一意な列 (UUIDv7 の id) にしてください。
+    NULL を許可する列は NULL を末尾として並べます。前方向 (next) のみをサポートします。
+    """
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = '無効なカーソルです。'
+
+    def __init__(self, ordering, page_size):
+        self.ordering = [(name.lstrip('-'), name.startswith('-')) for name in ordering]
+        self.page_size = page_size
+
+    @classmethod
+    def is_requested(cls, request):
+        return request.query_params.get('pagination') == 'cursor' or cls.cursor_query_param in request.query_params
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        fields = [queryset.model._meta.get_field(name) for name, _ in self.ordering]
+        order_by = []
+        for field, (name, descending) in zip(fields, self.ordering):
+            expression = F(name).desc(nulls_last=True) if descending else F(name).asc(nulls_last=True)
+            if not field.null:
+                # NOT NULL の列は NULLS 指定なしで並べ、既存のインデックスの並び順と一致させる
+                expression = F(name).desc() if descending else F(name).asc()
+            order_by.append(expression)
+        queryset = queryset.order_by(*order_by)
+
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded:
+            queryset = queryset.filter(self._after(fields, self._decode(encoded, fields)))
+
+        rows = list(queryset[:self.page_size + 1])
+        self.has_next = len(rows) > self.page_size
+        self.page = rows[:self.page_size]
+        return self.page
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': None,
+            'page_size': self.page_size,
+            'results': data
+        })
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        last = self.page[-1]
+        cursor = self._encode([getattr(last, name) for name, _ in self.ordering])
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, cursor)
+
+    def _after(self, fields, values):
+        """並び順で values より後ろにある行の条件 (NULL は末尾) を組み立てる。"""
+        condition = Q(pk__in=[])
+        equal = Q()
+        for field, (name, descending), value in zip(fields, self.ordering, values):
+            if value is None:
+                # NULL は末尾のため、この列で後ろになる値はない
+                equal &= Q(**{f'{name}__isnull': True})
+                continue
+            after = Q(**{f'{name}__lt' if descending else f'{name}__gt': value})
+            if field.null:
+                after |= Q(**{f'{name}__isnull': True})
+            condition |= equal & after
+            equal &= Q(**{name: value})
+
+        # 先頭の列に範囲条件を明示し、インデックスをカーソル位置から走査できるようにする
+        (first_name, first_descending), first_value = self.ordering[0], values[0]
+        if first_value is None:
+            bound = Q(**{f'{first_name}__isnull': True})
+        else:
+            bound = Q(**{f'{first_name}__lte' if first_descending else f'{first_name}__gte': first_value})
+            if fields[0].null:
+                bound |= Q(**{f'{first_name}__isnull': True})
+        return bound & condition
+
+    def _encode(self, values):
+        # 日時はマイクロ秒まで保持する (DjangoJSONEncoder はミリ秒に丸めるため使用しない)
+        payload = json.dumps([
+            value.isoformat() if isinstance(value, (datetime, date)) else str(value) if isinstance(value, uuid.UUID) else value
+            for value in values
+        ])
+        return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii')
+
+    def _decode(self, encoded, fields):
+        try:
+            values = json.loads(base64.urlsafe_b64decode(encoded.encode('ascii')).decode('utf-8'))
+            if not isinstance(values, list) or len(values) != len(fields):
+                raise ValueError
+            return [None if value is None else field.to_python(value) for field, value in zip(fields, values)]
+        except (TypeError, ValueError, UnicodeError, binascii.Error, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+
+def estimate_count(queryset):
+    """
+    PostgreSQL の実行計画 (EXPLAIN) からクエリセットの推定行数を返す。
+    PostgreSQL 以外、またはクエリセットでない場合は None を返します。
+    """
+    if not hasattr(queryset, 'query'):
+        return None
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return None
+    sql, params = queryset.order_by().query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+class CountModePage(Page):
+    def __init__(self, object_list, number, paginator, has_next):
+        super().__init__(object_list, number, paginator)
+        self._has_next = has_next
+
+    def has_next(self):
+        return self._has_next
+
+
+class CountModePaginator(Paginator):
+    """
+    総件数の取得方法を切り替えられる Paginator。
+
+    件数が正確でない場合 (estimate で推定値を使用した場合と none) は、1件多く取得して
+    次ページの有無を判定するため、推定値の誤差によってページが欠けることはありません。
+    count_is_exact は count を評価した後に確定します。
+    """
+
+    def __init__(self, object_list, per_page, count_mode='exact', estimate_threshold=None, **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        self.count_mode = count_mode
+        self.estimate_threshold = (
+            settings.PAGINATION_COUNT_ESTIMATE_THRESHOLD if estimate_threshold is None else estimate_threshold
+        )
+        self.count_is_exact = count_mode == 'exact'
+
+    @cached_property
+    def count(self):
+        if self.count_mode == 'none':
+            return None
+        if self.count_mode == 'estimate':
+            estimated = estimate_count(self.object_list)
+            if estimated is not None and estimated >= self.estimate_threshold:
+                self.count_is_exact = False
+                return estimated
+        self.count_is_exact = True
+        if hasattr(self.object_list, 'query'):
+            return self.object_list.count()
+        return len(self.object_list)
+
+    @property
+    def num_pages(self):
+        if self.count is None:
+            # 件数を数えない場合は、取得済みのページから分かるページ数の下限を返す
+            page = getattr(self, '_last_page', None)
+            if page is None:
+                return 1
+            return page.number + 1 if page.has_next() else page.number
+        if self.count == 0 and not self.allow_empty_first_page:
+            return 0
+        hits = max(1, self.count - self.orphans)
+        return math.ceil(hits / self.per_page)
+
+    def validate_number(self, number):
+        if self.count is not None and self.count_is_exact:
+            return super().validate_number(number)
+        try:
+            number = int(number)
+        except (TypeError, ValueError):
+            raise PageNotAnInteger(self.error_messages['invalid_page'])
+        if number < 1:
+            raise EmptyPage(self.error_messages['min_page'])
+        return number
+
+    def page(self, number):
+        number = self.validate_number(number)
+        if self.count_is_exact:
+            return super().page(number)
+        bottom = (number - 1) * self.per_page
+        rows = list(self.object_list[bottom:bottom + self.per_page + 1])
+        if not rows and number > 1:
+            raise EmptyPage(self.error_messages['no_results'])
+        self._last_page = CountModePage(rows[:self.per_page], number, self, has_next=len(rows) > self.per_page)
+        return self._last_page
+
+
+class CountModePaginationMixin:
+    """
+    PageNumberPagination に ?count=exact|estimate|none を追加するミックスイン。
+    応答には総件数が正確かどうかを示す count_is_exact を含めてください。
+    """
+    count_query_param = 'count'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        count_mode = request.query_params.get(self.count_query_param, 'exact')
+        if count_mode not in COUNT_MODES:
+            count_mode = 'exact'
+        self.django_paginator_class = partial(CountModePaginator, count_mode=count_mode)
+        return super().paginate_queryset(queryset, request, view)
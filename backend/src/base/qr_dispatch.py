@@ -0,0 +1,126 @@
+"""
+QRコードアクションの実行 (ディスパッチ)。
+
+有効なアクションのスクリプトと正規表現はプロセス内で一度だけコンパイルして保持し、
+スキャンのたびにデータベースを読み込んだり exec() し直したりしません。
+保持している内容の鮮度は、共有キャッシュの名前空間のバージョン (`base.cache.get_version`) で確認します。
+アクションが保存・削除されるとシグナルでバージョンが進み、各プロセスは次のスキャンで
+アクションを読み込み直します。その際、ID と更新日時が変わっていないアクションはコンパイル済みのものを再利用します。
+
+**セキュリティ警告**: スクリプトは exec() で実行されます。これはあくまで概念実証のためのコードです。
+"""
+import re
+import threading
+
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import cache as versioned_cache
+from .models import QrCodeAction
+from .signals import csv_batch_imported
+
+CACHE_NAMESPACE = 'qr_code_actions'
+
+
+class QrActionError(Exception):
+    """アクションのスクリプトのコンパイル・実行中にエラーが発生した場合に送出されます。"""
+
+    def __init__(self, action_name, error):
+        super().__init__(f"An error occurred while executing action '{action_name}': {error}")
+        self.action_name = action_name
+        self.error = error
+
+
+class CompiledAction:
+    """コンパイル済みのアクション。コンパイルに失敗した場合は、実行時にそのエラーを送出します。"""
+
+    def __init__(self, action_id, name, action_type, qr_code_pattern, script):
+        self.id = action_id
+        self.name = name
+        self.action_type = action_type
+        self.pattern = None
+        self.func = None
+        self.error = None
+        try:
+            script_body = '\n'.join(f'    {line}' for line in script.splitlines())
+            code = compile(f"def run_action(qr_data):\n{script_body}\n", f'<qr_code_action {name}>', 'exec')
+            script_globals = {}
+            exec(code, script_globals)
+            self.func = script_globals['run_action']
+        except Exception as e:
+            self.error = e
+        if action_type == 'regex' and qr_code_pattern:
+            try:
+                self.pattern = re.compile(qr_code_pattern)
+            except re.error:
+                # 無効なパターンのアクションはマッチしないものとして扱う
+                self.pattern = None
+
+    def run(self, qr_data):
+        """QRコードのデータに対してアクションを評価し、マッチした場合は結果を、しなかった場合は None を返す。"""
+        if self.action_type == 'regex' and not (self.pattern and self.pattern.match(qr_data)):
+            return None
+        if self.error is not None:
+            raise QrActionError(self.name, self.error)
+        try:
+            # スクリプト判定ではスクリプト自体が判定と結果返却を行い、None は「マッチしなかった」と見なす
+            return self.func(qr_data)
+        except Exception as e:
+            raise QrActionError(self.name, e) from e
+
+
+class QrActionDispatcher:
+    """有効なアクションをコンパイル済みで保持し、スキャンされたデータをディスパッチする。"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._actions = []
+        # (アクションID, 更新日時) -> CompiledAction
+        self._compiled = {}
+
+    def _load(self):
+        compiled = {}
+        actions = []
+        # スクリプト判定を先に、正規表現判定を後に評価する
+        rows = QrCodeAction.objects.filter(is_active=True).order_by('-action_type', 'name').values_list(
+            'id', 'updated_at', 'name', 'action_type', 'qr_code_pattern', 'script'
+        )
+        for action_id, updated_at, name, action_type, qr_code_pattern, script in rows:
+            key = (action_id, updated_at)
+            action = self._compiled.get(key) or CompiledAction(action_id, name, action_type, qr_code_pattern, script)
+            compiled[key] = action
+            actions.append(action)
+        self._compiled = compiled
+        return actions
+
+    def actions(self):
+        """評価順のコンパイル済みアクションを返す。共有キャッシュのバージョンが変わっていれば読み込み直します。"""
+        version = versioned_cache.get_version(CACHE_NAMESPACE)
+        if version != self._version:
+            with self._lock:
+                if version != self._version:
+                    self._actions = self._load()
+                    self._version = version
+        return self._actions
+
+    def dispatch(self, qr_data):
+        """
+        最初にマッチしたアクションの (アクション名, 結果) を返す。マッチするアクションが無ければ None を返す。
+        スクリプトのエラーは QrActionError として送出します。
+        """
+        for action in self.actions():
+            result = action.run(qr_data)
+            if result is not None:
+                return action.name, result
+        return None
+
+
+dispatcher = QrActionDispatcher()
+
+
+@receiver(post_save, sender=QrCodeAction)
+@receiver(post_delete, sender=QrCodeAction)
+@receiver(csv_batch_imported, sender=QrCodeAction)
+def invalidate_qr_actions(sender, **kwargs):
+    versioned_cache.invalidate(CACHE_NAMESPACE)
@@ -0,0 +1,221 @@
+"""
+リクエスト単位のクエリ検査 (N+1 の検出とクエリ予算の確認)。
+
+リクエスト中に実行されたSQLを、値を除いたテンプレート (正規化したSQL) ごとにまとめ、
+同じテンプレートが QUERY_INSPECTION_REPEAT_THRESHOLD 回以上実行されていれば N+1 の疑いとして報告します
+(一覧のシリアライズ中に select_related / prefetch_related されていない外部キーを参照した場合など)。
+ビュー (ビューセット) に `query_budget` が宣言されていれば、リクエストのクエリ数がそれを超えていないかも確認します。
+認証 (JWT のユーザーの読み込みなど) のクエリ数はキャッシュの設定によって変わるため、`QueryBudgetMixin` を使用して
+予算の対象から除きます (N+1 の検出には含めます)。
+
+    class InspectionResultViewSet(QueryBudgetMixin, viewsets.ModelViewSet):
+        # アクションごとの上限 (宣言の無いアクションは確認しません)。全アクション共通の場合は整数を指定します。
+        query_budget = {'list': 2, 'retrieve': 2}
+
+検査は `base.middleware.QueryInspectionMiddleware` が行います。テスト (`base.test_runner.QueryInspectionTestRunner`)
+ではすべてのリクエストを検査し、問題があれば QueryInspectionError を送出してテストを失敗させます。
+本番では QUERY_INSPECTION_SAMPLE_RATE の割合のリクエストだけを検査し、問題を警告としてログに出力します。
+"""
+import logging
+import os
+import re
+import time
+import traceback
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import partial
+
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r'\b\d+(?:\.\d+)?\b')
+_PLACEHOLDER_LIST = re.compile(r'\(\s*%s(?:\s*,\s*%s)+\s*\)')
+
+
+# wrap_queries で有効にした execute_wrapper (外側から順)。contextvars はリクエストの処理中に
+# sync_to_async で移ったスレッドにも引き継がれるため、どのスレッドで実行されたクエリも集計できます
+_active_wrappers = ContextVar('query_wrappers', default=())
+# exclude_from_budget のブロック内かどうか
+_excluded_from_budget = ContextVar('query_budget_excluded', default=False)
+
+
+def _dispatch(execute, sql, params, many, context):
+    wrappers = _active_wrappers.get()
+    for wrapper in reversed(wrappers):
+        execute = partial(wrapper, execute)
+    return execute(sql, params, many, context)
+
+
+def install_query_dispatcher(connection, **kwargs):
+    """
+    接続に wrap_queries の execute_wrapper を呼び出す常設のラッパーを追加する (connection_created シグナルの受信側)。
+
+    Django の接続はスレッドごとのため、リクエストの開始時に現在のスレッドの接続へラッパーを追加するだけでは
+    ASGI で sync_to_async のスレッドから実行されるクエリを集計できません。
+    接続の作成時に常設のラッパーを追加し、実行時に contextvars から有効なラッパーを参照します。
+    """
+    if _dispatch not in connection.execute_wrappers:
+        # connection.execute_wrapper() は終了時に末尾を取り除くため、先頭に追加する
+        connection.execute_wrappers.insert(0, _dispatch)
+
+
+@contextmanager
+def wrap_queries(wrapper):
+    """ブロック内 (sync_to_async で移ったスレッドを含む) で実行されたすべての接続のクエリを wrapper (execute_wrapper) に通す。"""
+    for connection in connections.all():
+        install_query_dispatcher(connection)
+    token = _active_wrappers.set(_active_wrappers.get() + (wrapper,))
+    try:
+        yield
+    finally:
+        _active_wrappers.reset(token)
+
+
+@contextmanager
+def exclude_from_budget():
+    """ブロック内で実行されたクエリをクエリ予算の対象から除く (N+1 の検出には含めます)。"""
+    token = _excluded_from_budget.set(True)
+    try:
+        yield
+    finally:
+        _excluded_from_budget.reset(token)
+
+
+class QueryBudgetMixin:
+    """
+    認証のクエリをクエリ予算の対象から除く APIView 用のミックスイン。
+    `query_budget` を宣言するビューセットで使用し、予算にはビュー自身のクエリ数だけを指定します。
+    """
+
+    def perform_authentication(self, request):
+        with exclude_from_budget():
+            super().perform_authentication(request)
+
+
+class QueryInspectionError(Exception):
+    """テスト中にクエリ予算の超過、または N+1 の疑いが検出された場合に送出されます。"""
+
+
+def normalize_sql(sql):
+    """SQLから値 (リテラル、IN 句のプレースホルダーの個数) を除き、同じ形のクエリが同じ文字列になるようにする。"""
+    sql = _STRING_LITERAL.sub('?', sql)
+    # LIMIT / OFFSET などSQLに直接埋め込まれる数値
+    sql = _NUMBER_LITERAL.sub('?', sql)
+    return _PLACEHOLDER_LIST.sub('(%s, ...)', sql)
+
+
+def _caller():
+    """クエリを発行したアプリケーションのコードの位置 (Django のDB層より外側で最も内側の呼び出し元) を返す。"""
+    base_dir = str(settings.BASE_DIR)
+    db_layer = os.path.join('django', 'db', '')
+    in_wrappers = True
+    for frame in reversed(traceback.extract_stack()):
+        # execute_wrapper (この検査やメトリクスのミドルウェア) の呼び出しは DB 層の内側にあるため読み飛ばす
+        if in_wrappers:
+            in_wrappers = db_layer not in frame.filename
+            continue
+        if frame.filename.startswith(base_dir) and 'site-packages' not in frame.filename:
+            return f'{frame.filename[len(base_dir) + 1:]}:{frame.lineno} ({frame.name})'
+    return None
+
+
+class QueryTemplate:
+    """同じテンプレートのクエリの実行回数と合計時間。"""
+
+    def __init__(self, sql):
+        self.sql = sql
+        self.count = 0
+        self.duration = 0.0
+        # 2回目の実行の呼び出し元 (N+1 ではループの中の位置になります)
+        self.caller = None
+
+
+class QueryInspector:
+    """execute_wrapper でクエリをテンプレートごとに集計する。"""
+
+    def __init__(self):
+        self.count = 0
+        # exclude_from_budget のブロック内で実行されたクエリ数 (予算の確認では count から除きます)
+        self.excluded = 0
+        self.templates = {}
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            if _excluded_from_budget.get():
+                self.excluded += 1
+            template = normalize_sql(sql)
+            stats = self.templates.get(template)
+            if stats is None:
+                stats = self.templates[template] = QueryTemplate(template)
+            stats.count += 1
+            stats.duration += time.perf_counter() - started
+            if stats.count == 2:
+                stats.caller = _caller()
+
+    def repeated(self, threshold=None):
+        """threshold 回以上実行されたテンプレート (N+1 の疑い) を実行回数の多い順に返す。"""
+        if threshold is None:
+            threshold = settings.QUERY_INSPECTION_REPEAT_THRESHOLD
+        return sorted(
+            (stats for stats in self.templates.values() if stats.count >= threshold),
+            key=lambda stats: stats.count, reverse=True,
+        )
+
+    def problems(self, budget=None):
+        """クエリ予算の超過と N+1 の疑いを説明する文字列のリストを返す。"""
+        problems = []
+        counted = self.count - self.excluded
+        if budget is not None and counted > budget:
+            problems.append(f'{counted} queries exceed the budget of {budget}')
+        for stats in self.repeated():
+            where = f' at {stats.caller}' if stats.caller else ''
+            problems.append(f'possible N+1: {stats.count} similar queries ({stats.duration * 1000:.1f} ms){where}: {stats.sql}')
+        return problems
+
+
+@contextmanager
+def inspect_queries():
+    """ブロック内で実行されたすべての接続のクエリを集計する QueryInspector を返すコンテキストマネージャー。"""
+    inspector = QueryInspector()
+    with wrap_queries(inspector):
+        yield inspector
+
+
+def query_budget(budget):
+    """関数ベースのビューにクエリ予算を宣言するデコレーター (ビューセットでは `query_budget` 属性を使用します)。"""
+    def decorator(view):
+        view.query_budget = budget
+        return view
+    return decorator
+
+
+def view_query_budget(view_func, method):
+    """ビュー関数 (ビューセットは as_view() の結果) に宣言されたクエリ予算を返す。宣言が無ければ None を返します。"""
+    budget = getattr(view_func, 'query_budget', None)
+    view_class = getattr(view_func, 'cls', None) or getattr(view_func, 'view_class', None)
+    if budget is None and view_class is not None:
+        budget = getattr(view_class, 'query_budget', None)
+    if isinstance(budget, dict):
+        # ビューセットの as_view() はHTTPメソッドとアクションの対応を actions に保持している
+        action = (getattr(view_func, 'actions', None) or {}).get(method.lower())
+        budget = budget.get(action)
+    return budget
+
+
+def report(request, problems):
+    """検出された問題を、テスト (QUERY_INSPECTION_STRICT) では例外として送出し、それ以外ではログに出力する。"""
+    if not problems:
+        return
+    match = getattr(request, 'resolver_match', None)
+    target = f'{request.method} {request.path} ({match.view_name if match else "unresolved"})'
+    if settings.QUERY_INSPECTION_STRICT:
+        raise QueryInspectionError(f'{target}: ' + '; '.join(problems))
+    for problem in problems:
+        logger.warning('%s: %s', target, problem)
@@ -0,0 +1,34 @@
+"""
+部分一致検索 (icontains) のための検索ヘルパー。
+
+Django の icontains は PostgreSQL では `UPPER(col::text) LIKE UPPER(...)` となり、
+pg_trgm の GIN インデックス (`gin_trgm_ops`) が使用されません。
+ここで登録する `trgm_icontains` ルックアップは PostgreSQL では `col ILIKE ...` を生成して
+トライグラムインデックスを利用し、それ以外のデータベース (テスト用の SQLite など) では
+通常の icontains と同じSQLを生成します。
+"""
+from django.db.models import CharField, Q, TextField
+from django.db.models.lookups import IContains
+
+TRIGRAM_CONTAINS = 'trgm_icontains'
+
+
+@CharField.register_lookup
+@TextField.register_lookup
+class TrigramContains(IContains):
+    lookup_name = TRIGRAM_CONTAINS
+
+    def as_sql(self, compiler, connection):
+        # PostgreSQL 以外では通常の icontains として扱う
+        return IContains(self.lhs, self.rhs).as_sql(compiler, connection)
+
+    def as_postgresql(self, compiler, connection):
+        # 列をキャスト・UPPER で包まずに ILIKE で比較し、gin_trgm_ops インデックスを使用できるようにする
+        lhs_sql, lhs_params = self.process_lhs(compiler, connection)
+        rhs_sql, rhs_params = self.process_rhs(compiler, connection)
+        return f'{lhs_sql} ILIKE {rhs_sql}', (*lhs_params, *rhs_params)
+
+
+def contains_q(value, *fields):
+    """いずれかのフィールドが value を部分一致 (大文字小文字を区別しない) で含む条件の Q を返す。"""
+    return Q(*[Q(**{f'{field}__{TRIGRAM_CONTAINS}': value}) for field in fields], _connector=Q.OR)
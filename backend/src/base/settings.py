@@ -15,6 +15,7 @@ from datetime import timedelta
 
 import os
 import environ
+from celery.schedules import crontab
 
 VERSION = '0.0.0'
 
@@ -97,6 +98,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'base.middleware.MetricsMiddleware', # ビューごとの性能メトリクス (/api/base/metrics/)
+    'base.middleware.QueryInspectionMiddleware', # N+1 の検出とクエリ予算の確認
     'django.middleware.security.SecurityMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
@@ -110,6 +113,13 @@ MIDDLEWARE = [
     'debug_toolbar.middleware.DebugToolbarMiddleware',
 ]
 
+# ASGI (GUNICORN_WORKER_MODE=asgi) では、同期専用の WhiteNoise があるとその内側のミドルウェアとビューが
+# リクエストの間ずっとスレッドで実行されるため外します。静的ファイルは base.asgi (ASGIStaticFilesHandler) か
+# リバースプロキシ (compose.prod.yml など) で配信されます。
+ASGI_MODE = env('GUNICORN_WORKER_MODE', default='sync').lower() == 'asgi'
+if ASGI_MODE:
+    MIDDLEWARE.remove('whitenoise.middleware.WhiteNoiseMiddleware')
+
 ROOT_URLCONF = 'base.urls'
 
 TEMPLATES = [
@@ -146,6 +156,30 @@ DATABASES = {
 
 }
 
+# 永続接続: リクエスト (Celery ではタスク) ごとに接続を張り直さず、DB_CONN_MAX_AGE 秒まで再利用する。
+# 再利用する前に接続が生きているかを確認し (CONN_HEALTH_CHECKS)、切断されていれば張り直す。
+# ASGI (GUNICORN_WORKER_MODE=asgi) ではスレッドごとの接続が残り続けるため既定で無効とし、DB_POOL を使用してください。
+DATABASES['default']['CONN_MAX_AGE'] = env.int('DB_CONN_MAX_AGE', default=0 if ASGI_MODE else 60)
+DATABASES['default']['CONN_HEALTH_CHECKS'] = env.bool('DB_CONN_HEALTH_CHECKS', default=True)
+
+# コネクションプール (PostgreSQL + psycopg 3 のみ): プロセスごとに接続をプールし、リクエストの間で貸し出す。
+# 永続接続とは併用できないため、有効にした場合は CONN_MAX_AGE を 0 にする。
+if env.bool('DB_POOL', default=False) and DATABASES['default']['ENGINE'] == 'django.db.backends.postgresql':
+    DATABASES['default'].setdefault('OPTIONS', {})['pool'] = {
+        'min_size': env.int('DB_POOL_MIN_SIZE', default=2),
+        'max_size': env.int('DB_POOL_MAX_SIZE', default=10),
+        'timeout': env.int('DB_POOL_TIMEOUT', default=10),  # 空きが無い場合に接続を待つ秒数
+    }
+    DATABASES['default']['CONN_MAX_AGE'] = 0
+
+# Cache
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+# 複数のプロセス (gunicornワーカー、Celeryワーカー) で共有するため、本番環境では
+# CACHE_URL に Redis を指定してください (例: rediscache://redis:6379/1)。
+CACHES = {
+    'default': env.cache('CACHE_URL', default='locmemcache://'),
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -216,7 +250,8 @@ SILENCED_SYSTEM_CHECKS = ['django_vite.W001']
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
         # 'rest_framework.authentication.SessionAuthentication', # APIではJWT認証を主とするため無効化
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        # ユーザーを短時間キャッシュし、リクエストごとのユーザー取得クエリを省略する
+        'users.authentication.CachedJWTAuthentication',
     ]
 }
 
@@ -233,6 +268,12 @@ SIMPLE_JWT = {
     'AUTH_HEADER_TYPES': ('Bearer',),
 }
 
+# JWT 認証で読み込んだユーザーをキャッシュする秒数。ユーザーの保存・削除時には即座に削除されます。
+# 削除を全プロセスに伝えるには共有キャッシュ (CACHE_URL) が必要なため、既定では CACHE_URL を設定した場合のみ有効です
+# (CACHE_URL 無しで JWT_USER_CACHE_ENABLED=True にすると起動時にエラーになります)。
+JWT_USER_CACHE_ENABLED = env.bool('JWT_USER_CACHE_ENABLED', default=bool(env('CACHE_URL', default='')))
+JWT_USER_CACHE_TIMEOUT = env.int('JWT_USER_CACHE_TIMEOUT', default=60)
+
 # 本番環境ではWhiteNoiseが圧縮ファイルを配信できるように設定
 if not DEBUG:
     STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
@@ -297,3 +338,71 @@ CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = 'Asia/Tokyo'
 CELERY_TASK_TRACK_STARTED = True
+# 定期実行タスク (celery beat)
+CELERY_BEAT_SCHEDULE = {
+    # 入出庫履歴の将来月パーティションの作成と、保持期間を過ぎたパーティションのアーカイブ
+    'maintain-stock-movement-partitions': {
+        'task': 'inventory.tasks.maintain_stock_movement_partitions',
+        'schedule': crontab(hour=3, minute=0),
+    },
+    # 時点在庫の照会に使用する在庫スナップショットの作成と、保持期間を過ぎたスナップショットの削除
+    'create-inventory-checkpoint': {
+        'task': 'inventory.tasks.create_inventory_checkpoint',
+        'schedule': crontab(hour=0, minute=0),
+    },
+}
+
+# CSVインポート設定
+# 1バッチあたりの行数。既存レコードの取得と bulk_create / bulk_update をこの単位でまとめて実行します。
+CSV_IMPORT_BATCH_SIZE = env.int('CSV_IMPORT_BATCH_SIZE', default=2000)
+# 進捗 (AsyncTask.progress) を保存する間隔。秒数と行数のどちらかに達した時点で保存します。
+CSV_IMPORT_PROGRESS_INTERVAL_SECONDS = env.float('CSV_IMPORT_PROGRESS_INTERVAL_SECONDS', default=2.0)
+CSV_IMPORT_PROGRESS_INTERVAL_ROWS = env.int('CSV_IMPORT_PROGRESS_INTERVAL_ROWS', default=10000)
+# 分割インポート (import-csv の mode=sharded) で並列に処理するシャード数
+CSV_IMPORT_SHARD_COUNT = env.int('CSV_IMPORT_SHARD_COUNT', default=4)
+
+# 一覧APIのページネーション設定
+# ?count=estimate のとき、PostgreSQL の推定行数がこの件数以上であれば COUNT(*) を行わず推定値を返します。
+PAGINATION_COUNT_ESTIMATE_THRESHOLD = env.int('PAGINATION_COUNT_ESTIMATE_THRESHOLD', default=100000)
+
+# CSVエクスポート (export-csv) でサーバーサイドカーソルから1度に読み出す行数
+CSV_EXPORT_CHUNK_SIZE = env.int('CSV_EXPORT_CHUNK_SIZE', default=2000)
+
+# 入出庫履歴 (StockMovement) の月別パーティション (PostgreSQL のみ)
+# 当月から何か月先までのパーティションを事前に作成するか
+STOCK_MOVEMENT_PARTITION_MONTHS_AHEAD = env.int('STOCK_MOVEMENT_PARTITION_MONTHS_AHEAD', default=3)
+# 何か月分の履歴を本テーブルに残すか。これより古い月のパーティションはアーカイブテーブルへ移します。
+STOCK_MOVEMENT_RETENTION_MONTHS = env.int('STOCK_MOVEMENT_RETENTION_MONTHS', default=24)
+
+# 時点在庫 (inventory/as-of) の照会に使用する在庫スナップショットの保持日数
+INVENTORY_CHECKPOINT_RETENTION_DAYS = env.int('INVENTORY_CHECKPOINT_RETENTION_DAYS', default=400)
+# スナップショットの基準日時を作成時刻からさかのぼらせる秒数。作成時点でまだコミットされていない入出庫
+# (移動日時は作成時刻より前) をスナップショットに含め損ねないよう、この秒数前の時点の在庫として記録します。
+INVENTORY_CHECKPOINT_SAFETY_MARGIN_SECONDS = env.int('INVENTORY_CHECKPOINT_SAFETY_MARGIN_SECONDS', default=600)
+
+# 一覧の facets (絞り込み候補の値と件数) をキャッシュする秒数。入庫処理・CSVインポートなどの更新時にも無効化されます。
+FACET_CACHE_TIMEOUT = env.int('FACET_CACHE_TIMEOUT', default=60)
+
+# 表示設定・CSV列マッピングを共有キャッシュに保持する秒数。設定の保存時には即座に無効化されます。
+# 無効化を全プロセスに伝えるには共有キャッシュ (CACHE_URL) が必要なため、既定では CACHE_URL を設定した場合のみ有効です
+# (CACHE_URL 無しで METADATA_CACHE_ENABLED=True にすると起動時にエラーになります)。
+METADATA_CACHE_ENABLED = env.bool('METADATA_CACHE_ENABLED', default=bool(env('CACHE_URL', default='')))
+METADATA_CACHE_TIMEOUT = env.int('METADATA_CACHE_TIMEOUT', default=3600)
+
+# 性能メトリクス (Prometheus 形式、/api/base/metrics/)。
+# 計測値はプロセス内で集計し、METRICS_FLUSH_INTERVAL 秒ごとに共有キャッシュへ加算します。
+# 全プロセスの値を集計するには共有キャッシュ (CACHE_URL) が必要なため、既定では CACHE_URL を設定した場合のみ有効です
+# (CACHE_URL 無しで METRICS_ENABLED=True にすると起動時にエラーになります)。
+# 取得には METRICS_TOKEN を設定した場合は Authorization: Bearer <METRICS_TOKEN>、未設定の場合はスタッフユーザーの認証が必要です。
+METRICS_ENABLED = env.bool('METRICS_ENABLED', default=bool(env('CACHE_URL', default='')))
+METRICS_FLUSH_INTERVAL = env.int('METRICS_FLUSH_INTERVAL', default=5)
+METRICS_TOKEN = env('METRICS_TOKEN', default='')
+
+# リクエスト単位のクエリ検査 (N+1 の検出とビューに宣言されたクエリ予算の確認、base/query_inspection.py)。
+# 本番では QUERY_INSPECTION_SAMPLE_RATE (0.0〜1.0) の割合のリクエストだけを検査し、問題を警告としてログに出力します。
+# テストランナー (base.test_runner.QueryInspectionTestRunner) はすべてのリクエストを検査し、問題があればテストを失敗させます。
+QUERY_INSPECTION_SAMPLE_RATE = env.float('QUERY_INSPECTION_SAMPLE_RATE', default=0.01)
+# 同じ形のクエリが1リクエストでこの回数以上実行された場合に N+1 の疑いとして報告します
+QUERY_INSPECTION_REPEAT_THRESHOLD = env.int('QUERY_INSPECTION_REPEAT_THRESHOLD', default=5)
+QUERY_INSPECTION_STRICT = False
+TEST_RUNNER = 'base.test_runner.QueryInspectionTestRunner'
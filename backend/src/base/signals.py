@@ -0,0 +1,8 @@
+from django.dispatch import Signal
+
+# CSVインポートで1バッチ分を bulk_create / bulk_update で保存した直後に送信されるシグナル。
+# 一括保存では post_save が発火しないため、保存内容に依存する集計などはこのシグナルで更新します。
+# 受信側はバッチと同じトランザクション内で呼び出されます。
+#   sender: 保存したモデルクラス
+#   objs:   保存したモデルインスタンスのリスト
+csv_batch_imported = Signal()
@@ -1,15 +1,36 @@
-from celery import shared_task
+from celery import chord, shared_task
 from celery.exceptions import SoftTimeLimitExceeded
-from celery.result import AsyncResult
 from django.apps import apps
-from django.db import transaction, IntegrityError, models
 from django.utils import timezone
-import csv
-import io
 import os
-from datetime import datetime
 
-from .models import CsvColumnMapping, AsyncTask, DATA_TYPE_MODEL_MAPPING
+from .csv_import import (
+    CsvImportPlan, CsvImportWriter, ProgressReporter, ShardProgressReporter,
+    count_csv_rows, import_rows, iter_csv_rows, iter_shard_rows, split_csv_into_shards
+)
+from .metadata import active_csv_mappings
+from .metrics import record_task_rows
+from .models import AsyncTask, DATA_TYPE_MODEL_MAPPING
+
+
+def build_import_plan(data_type):
+    """
+    データ種別のCSVマッピング設定からモデルと変換計画を組み立てる。
+    """
+    mappings = active_csv_mappings(data_type)
+    if not mappings:
+        raise Exception(f'"{data_type}" に有効なCSVマッピング設定がありません。')
+
+    model_string = DATA_TYPE_MODEL_MAPPING.get(data_type)
+    app_label, model_name = model_string.split('.')
+    model = apps.get_model(app_label=app_label, model_name=model_name)
+
+    # マッピングとモデル定義から変換計画を1度だけ組み立てる
+    plan = CsvImportPlan(model, mappings)
+    if not plan.update_keys:
+        raise Exception('CSVインポートのための上書きキーがCSVマッピング設定で指定されていません。')
+    return model, plan
+
 
 @shared_task(bind=True)
 def import_csv_task(self, data_type, file_path):
@@ -17,97 +38,33 @@ def import_csv_task(self, data_type, file_path):
     try:
         task = AsyncTask.objects.get(task_id=task_id)
         task.status = 'STARTED'
-        task.save()
-
-        mappings = CsvColumnMapping.objects.filter(data_type=data_type, is_active=True).order_by('order')
-        if not mappings.exists():
-            raise Exception(f'"{data_type}" に有効なCSVマッピング設定がありません。')
-
-        model_string = DATA_TYPE_MODEL_MAPPING.get(data_type)
-        app_label, model_name = model_string.split('.')
-        model = apps.get_model(app_label=app_label, model_name=model_name)
+        task.save(update_fields=['status', 'updated_at'])
 
-        expected_headers = [m.csv_header for m in mappings]
-        header_to_model_map = {m.csv_header: m.model_field_name for m in mappings}
-        update_keys_model = [m.model_field_name for m in mappings if m.is_update_key]
+        model, plan = build_import_plan(data_type)
 
-        if not update_keys_model:
-            raise Exception('CSVインポートのための上書きキーがCSVマッピング設定で指定されていません。')
-
-        with open(file_path, 'r', encoding='utf-8-sig') as f:
-            content = f.read()
-        
-        # ファイルの行数をカウントしてtotalを設定
-        total_rows = len(content.splitlines()) - 1 # ヘッダーを除く
+        # ファイル全体を読み込まずに行数を見積もってtotalを設定
+        total_rows = count_csv_rows(file_path)
         task.total = total_rows
-        task.save()
-
-        io_string = io.StringIO(content)
-        reader = csv.DictReader(io_string)
-
-        created_count = 0
-        updated_count = 0
-        errors_list = []
-
-        with transaction.atomic():
-            for i, row in enumerate(reader, start=1):
-                if AsyncResult(self.request.id).state == 'REVOKED':
-                    task.status = 'REVOKED'
-                    task.save()
-                    os.remove(file_path)
-                    return {'status': 'REVOKED', 'message': 'タスクがキャンセルされました。'}
-
-                model_data = {}
-                row_specific_errors = []
-
-                for csv_header, model_field_name in header_to_model_map.items():
-                    value = row.get(csv_header, '').strip()
-                    if not value:
-                        model_data[model_field_name] = None
-                        continue
-                    try:
-                        field_obj = model._meta.get_field(model_field_name)
-                        if isinstance(field_obj, (models.DateTimeField, models.DateField)):
-                            parsed_date = None
-                            for fmt in ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y/%m/%d %H:%M:%S', '%Y/%m/%d %H:%M', '%Y-%m-%d', '%Y/%m/%d'):
-                                try:
-                                    parsed_date = datetime.strptime(value, fmt)
-                                    break
-                                except ValueError: continue
-                            if parsed_date is None: raise ValueError("対応する日付形式ではありません。")
-                            model_data[model_field_name] = parsed_date.date() if isinstance(field_obj, models.DateField) else parsed_date
-                        elif isinstance(field_obj, (models.IntegerField, models.PositiveIntegerField)):
-                            model_data[model_field_name] = int(float(value))
-                        elif isinstance(field_obj, models.BooleanField):
-                            model_data[model_field_name] = value.lower() in ['true', '1', 'yes', 't', 'はい']
-                        else:
-                            model_data[model_field_name] = value
-                    except (ValueError, TypeError) as e:
-                        row_specific_errors.append(f"フィールド '{csv_header}' の値 '{value}' は型が不正です: {e}")
-                
-                if row_specific_errors:
-                    errors_list.append(f"行 {i+1}: {'; '.join(row_specific_errors)}")
-                    continue
-
-                update_kwargs = {key: model_data.pop(key) for key in update_keys_model if key in model_data and model_data[key] is not None}
-                if len(update_kwargs) != len(update_keys_model):
-                    errors_list.append(f"行 {i+1}: 上書きキー ({', '.join(update_keys_model)}) の値が空、または見つかりません。")
-                    continue
-
-                try:
-                    defaults_data = {k: v for k, v in model_data.items() if v is not None}
-                    _, created = model.objects.update_or_create(**update_kwargs, defaults=defaults_data)
-                    if created: created_count += 1
-                    else: updated_count += 1
-                except (IntegrityError, Exception) as e:
-                    errors_list.append(f"行 {i+1} ({update_kwargs}): データベース保存エラー - {e}")
-                
-                task.progress = i
-                task.save(update_fields=['progress', 'updated_at'])
-
+        task.save(update_fields=['total', 'updated_at'])
+
+        rows = iter_csv_rows(file_path)
+        _, header_row = next(rows, (1, []))
+        plan.bind_header(header_row)
+
+        writer = CsvImportWriter(model, plan.update_keys)
+        processed, cancelled = import_rows(plan, writer, rows, ProgressReporter(task), task_id)
+        record_task_rows(self.name, processed)
+        if cancelled:
+            task.status = 'REVOKED'
+            task.progress = processed
+            task.save()
+            return {'status': 'REVOKED', 'message': 'タスクがキャンセルされました。'}
+
+        errors_list = writer.errors
         task.status = 'SUCCESS' if not errors_list else 'FAILURE'
-        task.result = {'created': created_count, 'updated': updated_count, 'errors': errors_list}
-        task.progress = total_rows
+        task.result = {'created': writer.created_count, 'updated': writer.updated_count, 'errors': errors_list}
+        task.total = max(total_rows, processed)
+        task.progress = task.total
         task.save()
 
     except SoftTimeLimitExceeded:
@@ -121,3 +78,100 @@ def import_csv_task(self, data_type, file_path):
     finally:
         if os.path.exists(file_path):
             os.remove(file_path)
+
+
+@shared_task(bind=True)
+def import_csv_sharded_task(self, data_type, file_path, shard_count):
+    """
+    大きなCSVを複数のワーカーで並列に取り込むためのコーディネータータスク。
+
+    行を上書きキーのハッシュでシャードファイルに振り分け、シャードごとの
+    `import_csv_shard_task` をchordで並列実行します。集計は `finalize_csv_import_task` が
+    このタスクの AsyncTask に書き込むため、進捗の確認は従来どおりこのタスクIDで行えます。
+    シャードファイルはアップロードと同じディレクトリに作成されるため、
+    ワーカー間で共有されたストレージである必要があります。
+    """
+    task_id = self.request.id
+    shard_paths = []
+    try:
+        task = AsyncTask.objects.get(task_id=task_id)
+        task.status = 'STARTED'
+        task.save(update_fields=['status', 'updated_at'])
+
+        _, plan = build_import_plan(data_type)
+
+        task.total = count_csv_rows(file_path)
+        task.save(update_fields=['total', 'updated_at'])
+
+        rows = iter_csv_rows(file_path)
+        _, header_row = next(rows, (1, []))
+        plan.bind_header(header_row)
+
+        base_path, _ = os.path.splitext(file_path)
+        shard_paths = [f'{base_path}.shard{index}.csv' for index in range(max(shard_count, 1))]
+        split_csv_into_shards(plan, rows, shard_paths)
+
+        chord(
+            import_csv_shard_task.s(data_type, shard_path, task_id) for shard_path in shard_paths
+        )(finalize_csv_import_task.s(task_id))
+
+    except Exception as e:
+        task.status = 'FAILURE'
+        task.result = {'error': str(e)}
+        task.save()
+        for shard_path in shard_paths:
+            if os.path.exists(shard_path):
+                os.remove(shard_path)
+    finally:
+        if os.path.exists(file_path):
+            os.remove(file_path)
+
+
+@shared_task
+def import_csv_shard_task(data_type, shard_path, parent_task_id):
+    """
+    分割インポートの1シャードを取り込み、件数とエラーを返す。
+    例外もエラーとして返し、chordの集計タスクが必ず実行されるようにします。
+    """
+    try:
+        model, plan = build_import_plan(data_type)
+        header_row, rows = iter_shard_rows(shard_path)
+        plan.bind_header(header_row)
+
+        parent_task = AsyncTask.objects.get(task_id=parent_task_id)
+        reporter = ShardProgressReporter(parent_task)
+        writer = CsvImportWriter(model, plan.update_keys)
+        processed, cancelled = import_rows(plan, writer, rows, reporter, parent_task_id)
+        reporter.save(processed)
+        record_task_rows(import_csv_shard_task.name, processed)
+        return {
+            'created': writer.created_count,
+            'updated': writer.updated_count,
+            'errors': writer.errors,
+            'cancelled': cancelled,
+        }
+    except Exception as e:
+        return {'created': 0, 'updated': 0, 'errors': [f'シャード {os.path.basename(shard_path)}: {e}'], 'cancelled': False}
+    finally:
+        if os.path.exists(shard_path):
+            os.remove(shard_path)
+
+
+@shared_task
+def finalize_csv_import_task(shard_results, parent_task_id):
+    """
+    シャードごとの結果を合算し、親タスクの AsyncTask に書き込む。
+    """
+    task = AsyncTask.objects.get(task_id=parent_task_id)
+    errors_list = [error for result in shard_results for error in result['errors']]
+    if any(result['cancelled'] for result in shard_results):
+        task.status = 'REVOKED'
+    else:
+        task.status = 'SUCCESS' if not errors_list else 'FAILURE'
+        task.progress = task.total
+    task.result = {
+        'created': sum(result['created'] for result in shard_results),
+        'updated': sum(result['updated'] for result in shard_results),
+        'errors': errors_list,
+    }
+    task.save()
@@ -0,0 +1,19 @@
+from django.conf import settings
+from django.test.runner import DiscoverRunner
+
+
+class QueryInspectionTestRunner(DiscoverRunner):
+    """
+    すべてのリクエストのクエリを検査するテストランナー。
+    N+1 の疑いやクエリ予算の超過があれば、そのリクエストを行ったテストが QueryInspectionError で失敗します。
+    """
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self._saved_query_inspection = (settings.QUERY_INSPECTION_SAMPLE_RATE, settings.QUERY_INSPECTION_STRICT)
+        settings.QUERY_INSPECTION_SAMPLE_RATE = 1.0
+        settings.QUERY_INSPECTION_STRICT = True
+
+    def teardown_test_environment(self, **kwargs):
+        settings.QUERY_INSPECTION_SAMPLE_RATE, settings.QUERY_INSPECTION_STRICT = self._saved_query_inspection
+        super().teardown_test_environment(**kwargs)
@@ -0,0 +1,648 @@
+import copy
+import json
+import os
+import tempfile
+import threading
+from datetime import date, datetime
+from unittest import mock
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.cache.backends.redis import RedisCache
+from django.core.exceptions import ImproperlyConfigured
+from django.db.backends.postgresql.base import DatabaseWrapper
+from asgiref.testing import ApplicationCommunicator
+from django.core.handlers.asgi import ASGIHandler
+from django.db import connection
+from django.http import JsonResponse
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import path
+from rest_framework.test import APITestCase
+from rest_framework_simplejwt.tokens import AccessToken
+from django.utils import timezone
+from inventory.models import PurchaseOrder
+from .cache import check_shared_cache
+from .celery import app as celery_app
+from .csv_import import (
+    CsvImportPlan, CsvImportWriter, DateParser, ProgressReporter,
+    count_csv_rows, is_cancel_requested, iter_csv_rows, iter_shard_rows, request_cancel, split_csv_into_shards
+)
+from .admin import CsvColumnMappingAdmin
+from .metrics import _incr_many, recorder, render as render_metrics
+from .api import QrCodeActionViewSet
+from .models import AsyncTask, CsvColumnMapping, ModelDisplaySetting, QrCodeAction
+from .pagination import CountModePaginator
+from .qr_dispatch import QrActionDispatcher, QrActionError
+from .query_inspection import inspect_queries, normalize_sql, view_query_budget
+from .search import contains_q
+from .tasks import build_import_plan, import_csv_sharded_task, import_csv_task
+
+
+class CsvReaderTests(TestCase):
+    def setUp(self):
+        fd, self.file_path = tempfile.mkstemp(suffix='.csv')
+        with os.fdopen(fd, 'wb') as f:
+            f.write('\ufeff発注番号,数量\nPO-001,1\nPO-002,2\nPO-003,3'.encode('utf-8'))
+
+    def tearDown(self):
+        os.remove(self.file_path)
+
+    def test_count_csv_rows(self):
+        """ヘッダーを除いた行数が数えられることを確認（末尾改行なし）"""
+        self.assertEqual(count_csv_rows(self.file_path), 3)
+
+    def test_iter_csv_rows(self):
+        """BOMを除去し、ヘッダーを1行目とした行番号付きで行が返されることを確認"""
+        rows = list(iter_csv_rows(self.file_path))
+        self.assertEqual(rows[0], (1, ['発注番号', '数量']))
+        self.assertEqual(rows[1], (2, ['PO-001', '1']))
+        self.assertEqual(rows[-1][0], 4)
+
+
+class CsvImportPlanTests(TestCase):
+    def setUp(self):
+        mappings = [
+            CsvColumnMapping(csv_header='発注番号', model_field_name='order_number', is_update_key=True),
+            CsvColumnMapping(csv_header='数量', model_field_name='quantity'),
+            CsvColumnMapping(csv_header='入荷予定日時', model_field_name='expected_arrival'),
+            CsvColumnMapping(csv_header='初回', model_field_name='is_first_time'),
+        ]
+        self.plan = CsvImportPlan(PurchaseOrder, mappings)
+        self.plan.bind_header(['入荷予定日時', '発注番号', '数量', '初回'])
+
+    def test_convert_row(self):
+        """列の並び順に関わらず、フィールドの型に応じて変換されることを確認"""
+        lookup, defaults, errors = self.plan.convert_row(['2025/04/01 09:30', 'PO-001', '10.0', 'はい'])
+        self.assertEqual(errors, [])
+        self.assertEqual(lookup, {'order_number': 'PO-001'})
+        self.assertEqual(defaults, {'expected_arrival': timezone.make_aware(datetime(2025, 4, 1, 9, 30)), 'quantity': 10, 'is_first_time': True})
+
+    def test_convert_row_errors(self):
+        """型が不正な値と上書きキーの欠落がエラーになることを確認"""
+        _, _, errors = self.plan.convert_row(['', 'PO-001', 'abc', ''])
+        self.assertEqual(len(errors), 1)
+        self.assertIn("'数量'", errors[0])
+        _, _, errors = self.plan.convert_row(['', '', '1', ''])
+        self.assertIn('上書きキー', errors[0])
+
+    def test_date_parser_prefers_last_matched_format(self):
+        """最後に成功した日付書式が先頭に移動することを確認"""
+        parser = DateParser(as_date=True)
+        self.assertEqual(parser('2025/04/01'), date(2025, 4, 1))
+        self.assertEqual(parser.formats[0], '%Y/%m/%d')
+
+
+class CsvImportWriterTests(TestCase):
+    def test_creates_and_updates_in_batch(self):
+        """既存レコードは更新、存在しないキーは新規作成されることを確認"""
+        PurchaseOrder.objects.create(order_number='PO-001', item='Old', quantity=1)
+        writer = CsvImportWriter(PurchaseOrder, ['order_number'])
+
+        with self.assertNumQueries(5):  # 既存取得 + savepoint + bulk_create + bulk_update + release
+            writer.write_batch([
+                (2, {'order_number': 'PO-001'}, {'item': 'New', 'quantity': 5}),
+                (3, {'order_number': 'PO-002'}, {'item': 'Item B', 'quantity': 7}),
+            ])
+
+        self.assertEqual(writer.created_count, 1)
+        self.assertEqual(writer.updated_count, 1)
+        self.assertEqual(writer.errors, [])
+        self.assertEqual(PurchaseOrder.objects.get(order_number='PO-001').quantity, 5)
+        self.assertEqual(PurchaseOrder.objects.get(order_number='PO-002').item, 'Item B')
+
+    def test_duplicate_key_in_batch_counts_as_update(self):
+        """同一バッチ内で同じキーが2回現れた場合、後の行の値で更新されることを確認"""
+        writer = CsvImportWriter(PurchaseOrder, ['order_number'])
+        writer.write_batch([
+            (2, {'order_number': 'PO-001'}, {'quantity': 1}),
+            (3, {'order_number': 'PO-001'}, {'quantity': 9}),
+        ])
+
+        self.assertEqual(writer.created_count, 1)
+        self.assertEqual(writer.updated_count, 1)
+        self.assertEqual(PurchaseOrder.objects.get(order_number='PO-001').quantity, 9)
+
+    def test_row_errors_are_reported_per_row(self):
+        """一括保存に失敗した場合も、失敗した行だけがエラーとして報告されることを確認"""
+        writer = CsvImportWriter(PurchaseOrder, ['order_number'])
+        writer.write_batch([
+            (2, {'order_number': 'PO-001'}, {'quantity': 3}),
+            (3, {'order_number': 'PO-TOO-LONG-ORDER-NUMBER-0001'}, {'quantity': 'abc'}),
+        ])
+
+        self.assertEqual(writer.created_count, 1)
+        self.assertEqual(len(writer.errors), 1)
+        self.assertTrue(writer.errors[0].startswith('行 3'))
+        self.assertTrue(PurchaseOrder.objects.filter(order_number='PO-001').exists())
+
+
+class ImportCsvTaskTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        CsvColumnMapping.objects.create(data_type='purchase_order', csv_header='発注番号', model_field_name='order_number', order=1, is_update_key=True)
+        CsvColumnMapping.objects.create(data_type='purchase_order', csv_header='数量', model_field_name='quantity', order=2)
+        fd, self.file_path = tempfile.mkstemp(suffix='.csv')
+        with os.fdopen(fd, 'w', encoding='utf-8-sig', newline='') as f:
+            f.write('発注番号,数量\n' + ''.join(f'PO-{i:03d},{i}\n' for i in range(1, 6)) + 'PO-006,abc\n')
+
+    def tearDown(self):
+        if os.path.exists(self.file_path):
+            os.remove(self.file_path)
+
+    def run_task(self, task_id, cancel=False):
+        AsyncTask.objects.create(task_id=task_id, task_name='CSV Import: purchase_order')
+        if cancel:
+            request_cancel(task_id)
+        import_csv_task.apply(args=('purchase_order', self.file_path), task_id=task_id)
+        return AsyncTask.objects.get(task_id=task_id)
+
+    @override_settings(CSV_IMPORT_BATCH_SIZE=2)
+    def test_import(self):
+        """バッチに分けて取り込まれ、型エラーの行が報告されることを確認"""
+        task = self.run_task('task-import')
+        self.assertEqual(task.status, 'FAILURE')
+        self.assertEqual(task.result['created'], 5)
+        self.assertEqual(len(task.result['errors']), 1)
+        self.assertTrue(task.result['errors'][0].startswith('行 7'))
+        self.assertEqual((task.progress, task.total), (6, 6))
+        self.assertEqual(PurchaseOrder.objects.count(), 5)
+        self.assertFalse(os.path.exists(self.file_path))
+
+    @override_settings(CSV_IMPORT_BATCH_SIZE=2)
+    def test_cancel(self):
+        """キャンセルフラグが立っている場合、最初のバッチの後で停止することを確認"""
+        task = self.run_task('task-cancel', cancel=True)
+        self.assertEqual(task.status, 'REVOKED')
+        self.assertEqual(PurchaseOrder.objects.count(), 2)
+
+    @override_settings(CSV_IMPORT_BATCH_SIZE=1000, CSV_IMPORT_PROGRESS_INTERVAL_ROWS=1)
+    def test_cancel_before_batch_fills(self):
+        """バッチが埋まらなくても、進捗の保存の間隔でキャンセルフラグを確認して停止することを確認"""
+        task = self.run_task('task-cancel-early', cancel=True)
+        self.assertEqual((task.status, task.progress), ('REVOKED', 1))
+        self.assertEqual(PurchaseOrder.objects.count(), 1)
+
+    @override_settings(METRICS_ENABLED=True)
+    def test_metrics(self):
+        """タスクの実行時間と処理行数がメトリクスに記録されることを確認"""
+        self.run_task('task-metrics')
+        text = render_metrics()
+        self.assertIn('celery_task_rows_total{task="base.tasks.import_csv_task"} 6\n', text)
+        self.assertIn('celery_task_duration_seconds_count{state="SUCCESS",task="base.tasks.import_csv_task"} 1\n', text)
+
+
+class ProgressReporterTests(TestCase):
+    def test_saves_by_row_interval(self):
+        """行数の間隔に達したときだけ進捗が保存されることを確認"""
+        task = AsyncTask.objects.create(task_id='task-progress')
+        reporter = ProgressReporter(task, interval_seconds=3600, interval_rows=100)
+        with self.assertNumQueries(1):
+            for progress in range(1, 150):
+                reporter.update(progress)
+        self.assertEqual(AsyncTask.objects.get(pk=task.pk).progress, 100)
+
+
+class CsvImportCancelAPITests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.client.force_authenticate(user=get_user_model()(custom_id='cancel-user', username='canceluser'))
+
+    def cancel(self, task):
+        return self.client.post(f'/api/base/csv-import-cancel/{task.task_id}/')
+
+    def test_running_task_records_its_own_cancellation(self):
+        """実行中のタスクはフラグだけを立て、ステータスはタスク自身が停止時に記録することを確認"""
+        task = AsyncTask.objects.create(task_id='task-running', status='STARTED')
+        with mock.patch.object(import_csv_task, 'AsyncResult'):
+            self.assertEqual(self.cancel(task).status_code, 200)
+        self.assertEqual(AsyncTask.objects.get(pk=task.pk).status, 'STARTED')
+        self.assertTrue(is_cancel_requested('task-running'))
+
+    def test_cancel_flag_does_not_depend_on_cache(self):
+        """キャンセル要求はキャッシュではなくDBに記録され、プロセスごとのキャッシュでもワーカーに伝わることを確認"""
+        task = AsyncTask.objects.create(task_id='task-running-no-cache', status='STARTED')
+        with mock.patch.object(import_csv_task, 'AsyncResult'):
+            self.assertEqual(self.cancel(task).status_code, 200)
+        cache.clear()  # ワーカー側のプロセスにはWebプロセスのキャッシュが見えない状態
+        self.assertTrue(AsyncTask.objects.get(pk=task.pk).cancel_requested)
+        self.assertTrue(is_cancel_requested('task-running-no-cache'))
+
+    def test_pending_task_is_revoked(self):
+        """開始前のタスクはワーカーが破棄するため、キャンセル済みとして記録することを確認"""
+        task = AsyncTask.objects.create(task_id='task-pending')
+        with mock.patch.object(import_csv_task, 'AsyncResult'):
+            self.assertEqual(self.cancel(task).status_code, 200)
+        self.assertEqual(AsyncTask.objects.get(pk=task.pk).status, 'REVOKED')
+        self.assertEqual(self.cancel(task).status_code, 400)
+
+
+class ImportCsvShardedTaskTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        CsvColumnMapping.objects.create(data_type='purchase_order', csv_header='発注番号', model_field_name='order_number', order=1, is_update_key=True)
+        CsvColumnMapping.objects.create(data_type='purchase_order', csv_header='数量', model_field_name='quantity', order=2)
+        fd, self.file_path = tempfile.mkstemp(suffix='.csv')
+        with os.fdopen(fd, 'w', encoding='utf-8-sig', newline='') as f:
+            rows = [f'PO-{i % 20:03d},{i}\n' for i in range(40)]  # 同じ発注番号が2回ずつ現れる
+            f.write('数量,発注番号\n' + ''.join(','.join(reversed(r.strip().split(','))) + '\n' for r in rows) + 'abc,PO-999\n')
+        celery_app.conf.task_always_eager = True
+
+    def tearDown(self):
+        celery_app.conf.task_always_eager = False
+        if os.path.exists(self.file_path):
+            os.remove(self.file_path)
+
+    def test_split_keeps_same_key_in_same_shard(self):
+        """同じ上書きキーの行が同じシャードに振り分けられ、元の行番号が保持されることを確認"""
+        _, plan = build_import_plan('purchase_order')
+        rows = iter_csv_rows(self.file_path)
+        plan.bind_header(next(rows)[1])
+        shard_paths = [f'{self.file_path}.{i}' for i in range(3)]
+        split_csv_into_shards(plan, rows, shard_paths)
+
+        seen = {}
+        for index, shard_path in enumerate(shard_paths):
+            header_row, shard_rows = iter_shard_rows(shard_path)
+            self.assertEqual(header_row, ['発注番号', '数量'])
+            for row_number, values in shard_rows:
+                self.assertEqual(seen.setdefault(values[0], index), index)
+                if values[0] == 'PO-005':
+                    self.assertIn(row_number, (7, 27))
+            os.remove(shard_path)
+        self.assertEqual(len(seen), 21)
+
+    @override_settings(CSV_IMPORT_BATCH_SIZE=3)
+    def test_sharded_import(self):
+        """シャードの結果が親タスクに集計されることを確認"""
+        AsyncTask.objects.create(task_id='task-sharded', task_name='CSV Import: purchase_order')
+        import_csv_sharded_task.apply(args=('purchase_order', self.file_path, 3), task_id='task-sharded')
+
+        task = AsyncTask.objects.get(task_id='task-sharded')
+        self.assertEqual(task.status, 'FAILURE')
+        self.assertEqual((task.result['created'], task.result['updated']), (20, 20))
+        self.assertEqual(len(task.result['errors']), 1)
+        self.assertEqual((task.progress, task.total), (41, 41))
+        self.assertEqual(PurchaseOrder.objects.get(order_number='PO-005').quantity, 25)
+        self.assertFalse(os.path.exists(self.file_path))
+
+
+class SearchTests(TestCase):
+    def test_contains_q_matches_case_insensitively(self):
+        """いずれかのフィールドへの大文字小文字を区別しない部分一致で絞り込まれることを確認"""
+        PurchaseOrder.objects.create(order_number='PO-ABC', product_name='Bolt')
+        PurchaseOrder.objects.create(order_number='PO-XYZ', supplier='abc Trading')
+        PurchaseOrder.objects.create(order_number='PO-999', item='100%')
+        self.assertEqual(PurchaseOrder.objects.filter(contains_q('abc', 'order_number', 'supplier')).count(), 2)
+        self.assertEqual(PurchaseOrder.objects.filter(contains_q('0%', 'item')).count(), 1)
+        self.assertEqual(PurchaseOrder.objects.filter(contains_q('_', 'order_number')).count(), 0)
+
+    def test_postgresql_uses_ilike(self):
+        """PostgreSQL ではトライグラムインデックスを使用できる ILIKE が生成されることを確認"""
+        config = copy.deepcopy(settings.DATABASES['default'])
+        config.update(ENGINE='django.db.backends.postgresql', NAME='search_test')
+        connection = DatabaseWrapper(config, alias='search_test')
+        sql, params = PurchaseOrder.objects.filter(contains_q('a_b', 'order_number')).query.get_compiler(connection=connection).as_sql()
+        self.assertIn('"inventory_purchaseorder"."order_number" ILIKE %s', sql)
+        self.assertNotIn('UPPER', sql)
+        self.assertEqual(params, ('%a\\_b%',))
+
+
+class CountModePaginatorTests(TestCase):
+    def setUp(self):
+        PurchaseOrder.objects.bulk_create([PurchaseOrder(order_number=f'PO-{i:03d}') for i in range(7)])
+        self.queryset = PurchaseOrder.objects.order_by('order_number')
+
+    def test_none_mode_skips_count(self):
+        """none では COUNT を行わず、1件多く取得して次ページの有無を判定することを確認"""
+        paginator = CountModePaginator(self.queryset, 3, count_mode='none')
+        with self.assertNumQueries(1):
+            page = paginator.page(2)
+        self.assertTrue(page.has_next())
+        self.assertEqual([po.order_number for po in page], ['PO-003', 'PO-004', 'PO-005'])
+        self.assertFalse(paginator.page(3).has_next())
+        self.assertIsNone(paginator.count)
+        self.assertEqual(paginator.num_pages, 3)
+        self.assertFalse(paginator.count_is_exact)
+
+    def test_estimate_below_threshold_counts_exactly(self):
+        """推定値が閾値未満 (または PostgreSQL 以外) の場合は正確に数えることを確認"""
+        paginator = CountModePaginator(self.queryset, 3, count_mode='estimate', estimate_threshold=100)
+        self.assertEqual(paginator.page(1).paginator.count, 7)
+        self.assertTrue(paginator.count_is_exact)
+
+    def test_estimate_above_threshold(self):
+        """推定値が閾値以上の場合は推定値を返し、推定値を超えるページも取得できることを確認"""
+        with mock.patch('base.pagination.estimate_count', return_value=5):
+            paginator = CountModePaginator(self.queryset, 3, count_mode='estimate', estimate_threshold=5)
+            page = paginator.page(3)
+        self.assertEqual((paginator.count, paginator.num_pages), (5, 2))
+        self.assertFalse(paginator.count_is_exact)
+        self.assertEqual([po.order_number for po in page], ['PO-006'])
+
+
+class QrActionDispatcherTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.regex_action = QrCodeAction.objects.create(
+            name='item', action_type='regex', qr_code_pattern=r'ITEM-(\d+)', script="return {'type': 'item'}"
+        )
+        self.dispatcher = QrActionDispatcher()
+
+    def test_script_evaluated_before_regex(self):
+        """スクリプト判定が正規表現判定より先に評価され、None を返したスクリプトは読み飛ばされることを確認"""
+        QrCodeAction.objects.create(name='none', action_type='script', script='return None')
+        QrCodeAction.objects.create(
+            name='special', action_type='script', script="if qr_data == 'ITEM-9':\n    return {'type': 'special'}"
+        )
+        self.assertEqual(self.dispatcher.dispatch('ITEM-9'), ('special', {'type': 'special'}))
+        self.assertEqual(self.dispatcher.dispatch('ITEM-1'), ('item', {'type': 'item'}))
+        self.assertIsNone(self.dispatcher.dispatch('OTHER'))
+
+    def test_compiled_once_and_reloaded_on_change(self):
+        """2回目以降はクエリを発行せず、保存後は変更されたアクションだけコンパイルし直すことを確認"""
+        QrCodeAction.objects.create(name='other', action_type='script', script='return None')
+        self.dispatcher.dispatch('ITEM-1')
+        compiled_item = self.dispatcher.actions()[1]
+        with self.assertNumQueries(0):
+            self.dispatcher.dispatch('ITEM-1')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            QrCodeAction.objects.filter(name='other').update(script="return 'changed'")
+            QrCodeAction.objects.get(name='other').save()
+        self.assertEqual(self.dispatcher.dispatch('ITEM-1'), ('other', 'changed'))
+        self.assertIs(self.dispatcher.actions()[1], compiled_item)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            QrCodeAction.objects.get(name='other').delete()
+        self.assertEqual(self.dispatcher.dispatch('ITEM-1'), ('item', {'type': 'item'}))
+
+    def test_invalid_pattern_skipped_and_script_error_raised(self):
+        """無効な正規表現のアクションは読み飛ばし、スクリプトのエラーはアクション名付きで送出することを確認"""
+        QrCodeAction.objects.create(name='invalid', action_type='regex', qr_code_pattern='(', script='return 1')
+        QrCodeAction.objects.create(name='broken', action_type='script', script="if qr_data == 'X':\n    return 1 / 0")
+        self.assertEqual(self.dispatcher.dispatch('ITEM-1')[0], 'item')
+        with self.assertRaises(QrActionError) as raised:
+            self.dispatcher.dispatch('X')
+        self.assertEqual(raised.exception.action_name, 'broken')
+
+
+class QrActionExecuteAPITests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.client.force_authenticate(user=get_user_model()(custom_id='qr-user', username='qruser'))
+        QrCodeAction.objects.create(name='item', action_type='regex', qr_code_pattern=r'ITEM-', script='return qr_data[5:]')
+
+    def test_execute(self):
+        url = '/api/base/qr-code-actions/execute/'
+        response = self.client.post(url, {'qr_data': 'ITEM-42'}, format='json')
+        self.assertEqual(response.data, {'status': 'success', 'action_name': 'item', 'result': '42'})
+        response = self.client.post(url, {'qr_data': 'OTHER'}, format='json')
+        self.assertEqual(response.status_code, 404)
+
+
+@override_settings(METADATA_CACHE_ENABLED=True)
+class MetadataCacheTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.client.force_authenticate(user=get_user_model()(custom_id='meta-user', username='metauser', is_staff=True))
+        ModelDisplaySetting.objects.bulk_create([
+            ModelDisplaySetting(data_type='csv_column_mapping', model_field_name='csv_header', display_order=1, is_search_field=True),
+            ModelDisplaySetting(data_type='csv_column_mapping', model_field_name='data_type', display_order=2, is_list_filter=True),
+        ])
+
+    def test_admin_settings_cached_until_bulk_save(self):
+        """管理画面の動的設定は2回目以降クエリを発行せず、一括保存後は新しい設定になることを確認"""
+        model_admin = CsvColumnMappingAdmin(CsvColumnMapping, None)
+        self.assertEqual(model_admin.get_dynamic_settings('is_search_field'), ['csv_header'])
+        with self.assertNumQueries(0):
+            self.assertEqual(model_admin.get_dynamic_settings('is_list_filter'), ['data_type'])
+            self.assertEqual(model_admin.get_dynamic_settings('is_list_display'), ['csv_header', 'data_type'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                '/api/base/model-display-settings/bulk-save/?data_type=csv_column_mapping',
+                [{'model_field_name': 'order', 'display_order': 1, 'is_list_display': False}], format='json'
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(model_admin.get_dynamic_settings('is_list_display'))
+
+    def test_list_served_with_etag(self):
+        """一覧は ETag 付きで返り、変更が無ければ 304、保存後は新しい ETag になることを確認"""
+        url = '/api/base/model-display-settings/?data_type=csv_column_mapping'
+        response = self.client.get(url)
+        self.assertEqual([row['model_field_name'] for row in response.data], ['csv_header', 'data_type'])
+        etag = response['ETag']
+
+        with self.assertNumQueries(0):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            ModelDisplaySetting.objects.filter(model_field_name='data_type').first().delete()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual([row['model_field_name'] for row in response.data], ['csv_header'])
+
+        response = self.client.get('/api/base/model-display-settings/?data_type=unknown')
+        self.assertEqual(response.status_code, 400)
+
+    @override_settings(METADATA_CACHE_ENABLED=False)
+    def test_disabled_without_shared_cache(self):
+        """無効な場合は毎回データベースから読み込み、ETag を返さないことを確認"""
+        model_admin = CsvColumnMappingAdmin(CsvColumnMapping, None)
+        model_admin.get_dynamic_settings('is_search_field')
+        with self.assertNumQueries(1):
+            self.assertEqual(model_admin.get_dynamic_settings('is_list_filter'), ['data_type'])
+        response = self.client.get('/api/base/model-display-settings/?data_type=csv_column_mapping')
+        self.assertEqual([row['model_field_name'] for row in response.data], ['csv_header', 'data_type'])
+        self.assertNotIn('ETag', response)
+
+
+class AsyncApiViewTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        user = get_user_model()(custom_id='async-user', username='asyncuser')
+        get_user_model().objects.bulk_create([user])
+        self.auth = {'HTTP_AUTHORIZATION': f'Bearer {AccessToken.for_user(user)}'}
+
+    def test_health_check(self):
+        response = self.client.get('/api/base/health/')
+        self.assertEqual(response.json(), {'status': 'ok'})
+        self.assertEqual(self.client.post('/api/base/health/').status_code, 405)
+
+    def test_csv_import_status(self):
+        """認証済みの場合のみタスクの状態を返し、未認証・不正なトークンは DRF と同じ 401 になることを確認"""
+        AsyncTask.objects.create(task_id='task-1', task_name='CSV Import', status='STARTED', progress=3, total=10)
+        response = self.client.get('/api/base/csv-import-status/task-1/', **self.auth)
+        self.assertEqual(response.json(), {'task_id': 'task-1', 'status': 'STARTED', 'progress': 3, 'total': 10, 'result': None})
+        self.assertEqual(self.client.get('/api/base/csv-import-status/unknown/', **self.auth).status_code, 404)
+
+        response = self.client.get('/api/base/csv-import-status/task-1/')
+        self.assertEqual(response.status_code, 401)
+        self.assertIn('Bearer', response['WWW-Authenticate'])
+        response = self.client.get('/api/base/csv-import-status/task-1/', HTTP_AUTHORIZATION='Bearer invalid')
+        self.assertEqual((response.status_code, response.json()['code']), (401, 'token_not_valid'))
+
+
+@override_settings(METRICS_ENABLED=True, METRICS_TOKEN='')
+class MetricsTests(TestCase):
+    def setUp(self):
+        recorder.flush()
+        cache.clear()
+        User = get_user_model()
+        User.objects.bulk_create([
+            User(custom_id='metrics-staff', username='metrics-staff', is_staff=True),
+            User(custom_id='metrics-user', username='metrics-user'),
+        ])
+        self.staff_auth = f'Bearer {AccessToken.for_user(User.objects.get(custom_id="metrics-staff"))}'
+        self.user_auth = f'Bearer {AccessToken.for_user(User.objects.get(custom_id="metrics-user"))}'
+
+    def test_request_metrics(self):
+        """ビューごとのリクエスト数・応答時間・クエリ件数・レスポンスサイズが Prometheus 形式で出力されることを確認"""
+        self.client.get('/api/base/health/')
+        self.client.get('/api/base/health/')
+        self.client.post('/api/base/health/')
+
+        response = self.client.get('/api/base/metrics/', HTTP_AUTHORIZATION=self.staff_auth)
+        self.assertEqual(response['Content-Type'], 'text/plain; version=0.0.4; charset=utf-8')
+        text = response.content.decode()
+        view = 'view="base_api:health-check"'
+        self.assertIn(f'http_requests_total{{method="GET",status="200",{view}}} 2\n', text)
+        self.assertIn(f'http_requests_total{{method="POST",status="405",{view}}} 1\n', text)
+        self.assertIn(f'http_request_duration_seconds_bucket{{{view},le="+Inf"}} 3\n', text)
+        self.assertIn(f'http_request_db_queries_bucket{{{view},le="0"}} 3\n', text)
+        self.assertIn(f'http_response_size_bytes_count{{{view}}} 3\n', text)
+        self.assertIn('# TYPE http_request_duration_seconds histogram\n', text)
+
+    def test_requires_staff(self):
+        """METRICS_TOKEN が未設定の場合、スタッフユーザー以外は取得できないことを確認"""
+        self.assertEqual(self.client.get('/api/base/metrics/').status_code, 401)
+        self.assertEqual(self.client.get('/api/base/metrics/', HTTP_AUTHORIZATION=self.user_auth).status_code, 401)
+        self.assertEqual(self.client.get('/api/base/metrics/', HTTP_AUTHORIZATION='Bearer invalid').status_code, 401)
+        self.assertEqual(self.client.get('/api/base/metrics/', HTTP_AUTHORIZATION=self.staff_auth).status_code, 200)
+
+    @override_settings(METRICS_TOKEN='secret')
+    def test_token(self):
+        self.assertEqual(self.client.get('/api/base/metrics/', HTTP_AUTHORIZATION=self.staff_auth).status_code, 401)
+        self.assertEqual(self.client.get('/api/base/metrics/', HTTP_AUTHORIZATION='Bearer secret').status_code, 200)
+
+    @override_settings(METRICS_ENABLED=False)
+    def test_disabled(self):
+        self.assertEqual(self.client.get('/api/base/metrics/', HTTP_AUTHORIZATION=self.staff_auth).status_code, 404)
+
+    def test_requires_shared_cache(self):
+        """メトリクスが有効な場合、プロセスごとのキャッシュ (locmem) では起動時にエラーになることを確認"""
+        with self.assertRaisesMessage(ImproperlyConfigured, 'CACHE_URL'):
+            check_shared_cache()
+        with override_settings(METRICS_ENABLED=False):
+            check_shared_cache()
+        with override_settings(METRICS_ENABLED=False, METADATA_CACHE_ENABLED=True, JWT_USER_CACHE_ENABLED=True):
+            with self.assertRaisesMessage(ImproperlyConfigured, 'METADATA_CACHE_ENABLED, JWT_USER_CACHE_ENABLED requires'):
+                check_shared_cache()
+
+    def test_redis_flush_is_pipelined(self):
+        """Redis では、全系列のカウンターをパイプラインの1往復で加算することを確認"""
+        backend = RedisCache('redis://redis:6379/1', {})
+        backend._cache = mock.Mock()
+        pipeline = backend._cache.get_client.return_value.pipeline.return_value
+        pipeline.execute.return_value = [5, 1]  # 既存のカウンター (3 + 2) と、新しく作成されたカウンター
+        with mock.patch('base.metrics.caches', {'default': backend}):
+            self.assertEqual(_incr_many({'a': 2, 'b': 1}), [False, True])
+        self.assertEqual(pipeline.incrby.call_count, 2)
+        pipeline.execute.assert_called_once_with()
+
+
+class QueryInspectionTests(TestCase):
+    def test_normalize_sql(self):
+        """値だけが異なるクエリが同じテンプレートになることを確認"""
+        self.assertEqual(
+            normalize_sql('SELECT * FROM "t" WHERE "t"."id" IN (%s, %s, %s) AND "t"."code" = \'A\' LIMIT 21'),
+            normalize_sql('SELECT * FROM "t" WHERE "t"."id" IN (%s, %s) AND "t"."code" = \'B\' LIMIT 5'),
+        )
+
+    @override_settings(QUERY_INSPECTION_REPEAT_THRESHOLD=3)
+    def test_repeated_queries(self):
+        """同じ形のクエリの繰り返しが、発行元の位置とともに N+1 の疑いとして報告されることを確認"""
+        QrCodeAction.objects.bulk_create([QrCodeAction(name=f'action-{i}', script='return None') for i in range(3)])
+        with inspect_queries() as inspector:
+            for pk in QrCodeAction.objects.values_list('pk', flat=True):
+                QrCodeAction.objects.get(pk=pk)
+        self.assertEqual(inspector.count, 4)
+        self.assertEqual([stats.count for stats in inspector.repeated()], [3])
+        problems = inspector.problems(budget=2)
+        self.assertEqual(problems[0], '4 queries exceed the budget of 2')
+        self.assertIn('possible N+1: 3 similar queries', problems[1])
+        self.assertIn('base/tests.py', problems[1])
+
+    def test_view_query_budget(self):
+        """ビューセットのアクションごとのクエリ予算が解決されることを確認"""
+        view = QrCodeActionViewSet.as_view({'get': 'list', 'post': 'create'})
+        with mock.patch.object(QrCodeActionViewSet, 'query_budget', {'list': 1}, create=True):
+            self.assertEqual(view_query_budget(view, 'GET'), 1)
+            self.assertIsNone(view_query_budget(view, 'POST'))
+        with mock.patch.object(QrCodeActionViewSet, 'query_budget', 3, create=True):
+            self.assertEqual(view_query_budget(view, 'POST'), 3)
+
+
+# AsgiMiddlewareTests 用の URL (ROOT_URLCONF='base.tests')
+async def _async_view(request):
+    return JsonResponse({'status': 'ok'})
+
+
+def _sync_queries_view(request):
+    # 同じ形のクエリを繰り返す (N+1)。ASGI では sync_to_async によりイベントループとは別のスレッドで実行される
+    return JsonResponse({'count': sum(AsyncTask.objects.filter(task_id=f'task-{i}').count() for i in range(6))})
+
+
+urlpatterns = [path('async/', _async_view), path('sync-queries/', _sync_queries_view)]
+
+
+@override_settings(
+    ROOT_URLCONF='base.tests',
+    MIDDLEWARE=[m for m in settings.MIDDLEWARE if m != 'whitenoise.middleware.WhiteNoiseMiddleware'],
+    METRICS_ENABLED=True,
+    QUERY_INSPECTION_SAMPLE_RATE=1.0,
+)
+class AsgiMiddlewareTests(TransactionTestCase):
+    """ASGI モード (WhiteNoise を外したミドルウェア構成) で ASGI アプリケーションにリクエストを送る。"""
+
+    def setUp(self):
+        # ASGI モードと同じく、リクエストを処理したスレッドの接続をリクエストの終了時に閉じる
+        patcher = mock.patch.dict(connection.settings_dict, {'CONN_MAX_AGE': 0})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def request(self, path):
+        communicator = ApplicationCommunicator(ASGIHandler(), {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+            'scheme': 'http', 'path': path, 'raw_path': path.encode(), 'query_string': b'',
+            'headers': [(b'host', b'testserver')], 'server': ('testserver', 80), 'client': ('127.0.0.1', 12345),
+        })
+        await communicator.send_input({'type': 'http.request', 'body': b''})
+        start = await communicator.receive_output(timeout=5)
+        body = await communicator.receive_output(timeout=5)
+        # レスポンスを閉じる (request_finished で接続を閉じる) までアプリケーションの終了を待つ
+        await communicator.wait(timeout=5)
+        return start['status'], json.loads(body['body'])
+
+    async def test_middleware_runs_on_event_loop(self):
+        """計測・クエリ検査のミドルウェアが、リクエストをスレッドに移さずイベントループ上で処理することを確認"""
+        loop_thread = threading.get_ident()
+        threads = []
+        record_thread = lambda *args, **kwargs: threads.append(threading.get_ident())
+        with mock.patch.object(recorder, 'inc', side_effect=record_thread) as inc, \
+                mock.patch('base.middleware.report', side_effect=record_thread):
+            self.assertEqual(await self.request('/async/'), (200, {'status': 'ok'}))
+        inc.assert_any_call('http_requests_total', {'view': 'base.tests._async_view', 'method': 'GET', 'status': '200'})
+        self.assertEqual(len(threads), 3)
+        self.assertEqual(set(threads), {loop_thread})
+
+    @override_settings(QUERY_INSPECTION_STRICT=False)
+    async def test_queries_on_sync_threads_are_counted(self):
+        """同期ビューのクエリ (イベントループとは別のスレッドの接続) も計測・N+1 の検査の対象になることを確認"""
+        with mock.patch.object(recorder, 'observe') as observe, \
+                self.assertLogs('base.query_inspection', 'WARNING') as logs:
+            self.assertEqual(await self.request('/sync-queries/'), (200, {'count': 0}))
+        observe.assert_any_call('http_request_db_queries', {'view': 'base.tests._sync_queries_view'}, 6)
+        self.assertIn('possible N+1: 6 similar queries', logs.output[0])
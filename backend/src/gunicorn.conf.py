@@ -0,0 +1,23 @@
+"""
+gunicorn の設定 (`gunicorn --config gunicorn.conf.py` で起動します)。
+
+環境変数 GUNICORN_WORKER_MODE で配信方式を切り替えます。
+- sync (既定): 同期ワーカーで WSGI アプリケーション (base.wsgi) を配信します。
+- asgi: uvicorn のワーカーで ASGI アプリケーション (base.asgi) を配信します。
+  非同期ビュー (棚番照会・CSVインポートの状態確認・ヘルスチェック・セッション情報) は
+  イベントループ上で処理され、待ち時間の長いリクエストがワーカーを占有しません。
+  同期ビューは Django によりスレッドで実行されます。
+"""
+import os
+
+worker_mode = os.environ.get('GUNICORN_WORKER_MODE', 'sync').lower()
+if worker_mode == 'asgi':
+    wsgi_app = 'base.asgi:application'
+    worker_class = 'uvicorn.workers.UvicornWorker'
+else:
+    wsgi_app = 'base.wsgi:application'
+    worker_class = 'sync'
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:8000')
+workers = int(os.environ.get('GUNICORN_WORKERS', 1))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import PurchaseOrder, Inventory, StockMovement, SalesOrder, Receipt
+from .models import PurchaseOrder, Inventory, StockMovement, SalesOrder, Receipt, StockSummary, InventoryCheckpoint
 
 # Register your models here.
 
@@ -24,3 +24,18 @@ class ReceiptAdmin(admin.ModelAdmin):
     list_filter = ('received_date', 'warehouse')
     search_fields = ('purchase_order__order_number', 'warehouse')
     date_hierarchy = 'received_date'
+
+
+@admin.register(StockSummary)
+class StockSummaryAdmin(admin.ModelAdmin):
+    list_display = ('part_number', 'warehouse', 'quantity', 'reserved', 'available', 'last_updated')
+    search_fields = ('part_number', 'warehouse')
+    readonly_fields = ('part_number', 'warehouse', 'quantity', 'reserved', 'available', 'last_updated')
+
+
+@admin.register(InventoryCheckpoint)
+class InventoryCheckpointAdmin(admin.ModelAdmin):
+    list_display = ('checkpoint_at', 'part_number', 'warehouse', 'location', 'quantity')
+    list_filter = ('checkpoint_at',)
+    search_fields = ('part_number', 'warehouse', 'location')
+    readonly_fields = ('checkpoint_at', 'part_number', 'warehouse', 'location', 'quantity')
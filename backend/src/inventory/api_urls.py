@@ -10,8 +10,11 @@ router.register(r'purchase-orders', rest_views.PurchaseOrderViewSet, basename='p
 router.register(r'sales-orders', rest_views.SalesOrderViewSet, basename='salesorder')
 router.register(r'receipts', rest_views.ReceiptViewSet, basename='receipt')
 router.register(r'stock-movements', rest_views.StockMovementViewSet, basename='stockmovement')
+router.register(r'stock-summaries', rest_views.StockSummaryViewSet, basename='stocksummary')
 
 
 urlpatterns = [
+    # 非同期ビュー (ルーターの在庫詳細 inventories/<pk>/ より先に解決させる)
+    path('inventories/by-location/', rest_views.inventory_by_location, name='inventory-by-location'),
     path('', include(router.urls)),
 ]
\ No newline at end of file
@@ -0,0 +1,192 @@
+"""
+時点在庫 (as-of) の照会。
+
+`InventoryCheckpoint` は品番・倉庫・棚番ごとの在庫数量のスナップショットで、
+`create_checkpoint` により毎晩作成されます (celery beat)。
+過去の時点の在庫は、その時点に最も近い基準 (前後のスナップショット、または現在の在庫) から
+間の入出庫履歴だけを加減して求めます。全履歴を再生しないため、照会のコストは
+基準から照会時点までの入出庫件数に比例します。
+
+スナップショットは作成時刻から INVENTORY_CHECKPOINT_SAFETY_MARGIN_SECONDS さかのぼった時点の在庫として、
+現在の在庫からその時点以降の入出庫を取り消して作成します。作成時にまだコミットされていない入出庫は
+在庫にも取り消す履歴にも含まれず、後の照会でスナップショット以降の入出庫として加算されます。
+保持期間を過ぎてアーカイブされた入出庫履歴は参照できないため、基準から照会時点までの間が
+アーカイブ済みの期間にかかる場合はその基準を使用しません。
+"""
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Case, F, IntegerField, Sum, Value, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import Inventory, InventoryCheckpoint, StockMovement
+from .partitions import archived_before
+
+# 在庫を増やす・減らす移動タイプ (数量は常に正の値で記録されるため、向きは移動タイプで決まる)
+# 在庫調整 (adjustment) は数量の増加として記録されている前提で加算します。
+INBOUND_MOVEMENT_TYPES = ('incoming', 'PRODUCTION_OUTPUT', 'adjustment')
+OUTBOUND_MOVEMENT_TYPES = ('outgoing', 'used', 'PRODUCTION_REVERSAL')
+
+# スナップショットを作成する際に1度に保存する件数
+CHECKPOINT_BATCH_SIZE = 5000
+
+
+class StockHistoryUnavailable(ValueError):
+    """照会時点の在庫を求めるのに必要な入出庫履歴がアーカイブ済みの場合に送出されます。"""
+
+
+def _with_keys(queryset, part_number=None, warehouse=None, location=None):
+    """品番・倉庫・棚番のキー (未設定は空文字) を付与し、指定されたキーで絞り込む。"""
+    queryset = queryset.filter(part_number__isnull=False).exclude(part_number='').annotate(
+        key_warehouse=Coalesce('warehouse', Value('')),
+        key_location=Coalesce('location', Value('')),
+    )
+    if part_number:
+        queryset = queryset.filter(part_number=part_number)
+    if warehouse is not None:
+        queryset = queryset.filter(key_warehouse=warehouse)
+    if location is not None:
+        queryset = queryset.filter(key_location=location)
+    return queryset
+
+
+def _inventory_totals(part_number=None, warehouse=None, location=None):
+    """現在の在庫数量を品番・倉庫・棚番ごとに集計した (品番, 倉庫, 棚番, 数量) のクエリセット。"""
+    return (
+        _with_keys(Inventory.objects.all(), part_number, warehouse, location)
+        .values('part_number', 'key_warehouse', 'key_location')
+        .annotate(total_quantity=Coalesce(Sum('quantity'), 0))
+        .order_by()
+        .values_list('part_number', 'key_warehouse', 'key_location', 'total_quantity')
+    )
+
+
+def _movement_deltas(direction, part_number=None, warehouse=None, location=None, **movement_range):
+    """
+    期間内の入出庫による在庫数量の増減を品番・倉庫・棚番ごとに集計した (品番, 倉庫, 棚番, 増減) のクエリセット。
+    direction が -1 の場合は入出庫を取り消す向き (入庫を減算、出庫を加算) で集計します。
+    """
+    signed_quantity = Case(
+        When(movement_type__in=INBOUND_MOVEMENT_TYPES, then=F('quantity') * direction),
+        When(movement_type__in=OUTBOUND_MOVEMENT_TYPES, then=F('quantity') * -direction),
+        default=Value(0),
+        output_field=IntegerField(),
+    )
+    return (
+        _with_keys(StockMovement.objects.filter(**movement_range), part_number, warehouse, location)
+        .values('part_number', 'key_warehouse', 'key_location')
+        .annotate(delta=Coalesce(Sum(signed_quantity), 0))
+        .order_by()
+        .values_list('part_number', 'key_warehouse', 'key_location', 'delta')
+    )
+
+
+def create_checkpoint(checkpoint_at=None, now=None):
+    """
+    checkpoint_at 時点 (省略時は現在から INVENTORY_CHECKPOINT_SAFETY_MARGIN_SECONDS 前) の在庫数量を
+    品番・倉庫・棚番ごとに集計してスナップショットを作成し、作成件数を返す。
+    """
+    now = now or timezone.now()
+    if checkpoint_at is None:
+        checkpoint_at = now - timedelta(seconds=settings.INVENTORY_CHECKPOINT_SAFETY_MARGIN_SECONDS)
+
+    # 現在の在庫と、基準日時より後の入出庫の取り消しを1つのクエリで読み込む
+    # (別々のクエリでは間にコミットされた入出庫を片方だけ読み込む場合があるため)
+    rows = _inventory_totals().union(_movement_deltas(-1, movement_date__gt=checkpoint_at), all=True)
+    balances = defaultdict(int)
+    for part, wh, loc, quantity in rows:
+        balances[(part, wh, loc)] += quantity
+
+    checkpoints = []
+    count = 0
+    for (part, wh, loc), quantity in balances.items():
+        checkpoints.append(InventoryCheckpoint(
+            checkpoint_at=checkpoint_at, part_number=part, warehouse=wh, location=loc, quantity=quantity,
+        ))
+        if len(checkpoints) >= CHECKPOINT_BATCH_SIZE:
+            InventoryCheckpoint.objects.bulk_create(checkpoints)
+            count += len(checkpoints)
+            checkpoints = []
+    if checkpoints:
+        InventoryCheckpoint.objects.bulk_create(checkpoints)
+        count += len(checkpoints)
+    return count
+
+
+def prune_checkpoints(retention_days=None):
+    """保持期間 (日数) を過ぎたスナップショットを削除し、削除件数を返す。"""
+    if retention_days is None:
+        retention_days = settings.INVENTORY_CHECKPOINT_RETENTION_DAYS
+    deleted, _ = InventoryCheckpoint.objects.filter(
+        checkpoint_at__lt=timezone.now() - timedelta(days=retention_days)
+    ).delete()
+    return deleted
+
+
+def _choose_basis(as_of, now):
+    """
+    照会時点に最も近い基準を (種類, 基準日時) で返す。
+    種類は 'checkpoint' (スナップショット) または 'inventory' (現在の在庫) です。
+    基準から照会時点までの間がアーカイブ済みの期間にかかる基準は使用せず、
+    使用できる基準が無い場合は StockHistoryUnavailable を送出します。
+    """
+    dates = InventoryCheckpoint.objects.order_by().values_list('checkpoint_at', flat=True)
+    candidates = [('inventory', now)]
+    before = dates.filter(checkpoint_at__lte=as_of).order_by('-checkpoint_at').first()
+    if before is not None:
+        candidates.append(('checkpoint', before))
+    after = dates.filter(checkpoint_at__gt=as_of).order_by('checkpoint_at').first()
+    if after is not None:
+        candidates.append(('checkpoint', after))
+
+    since = archived_before()
+    if since is not None:
+        candidates = [
+            (basis, basis_at) for basis, basis_at in candidates
+            if basis_at == as_of or min(basis_at, as_of) >= since
+        ]
+        if not candidates:
+            raise StockHistoryUnavailable(
+                f'{timezone.localtime(since):%Y-%m-%d} より前の入出庫履歴はアーカイブ済みのため、'
+                f'この時点の在庫は照会できません。'
+            )
+    return min(candidates, key=lambda candidate: abs(candidate[1] - as_of))
+
+
+def stock_as_of(as_of, part_number=None, warehouse=None, location=None, now=None):
+    """
+    as_of 時点 (その日時までの入出庫を含む) の品番・倉庫・棚番ごとの在庫数量を求める。
+    warehouse・location に空文字を指定すると未設定のものに絞り込みます。
+
+    (在庫数量が0以外の行の辞書のリスト, 使用した基準の辞書) を返します。
+    照会に必要な入出庫履歴がアーカイブ済みの場合は StockHistoryUnavailable を送出します。
+    """
+    now = now or timezone.now()
+    basis, basis_at = _choose_basis(as_of, now)
+
+    balances = defaultdict(int)
+    if basis == 'checkpoint':
+        base_rows = _with_keys(
+            InventoryCheckpoint.objects.filter(checkpoint_at=basis_at), part_number, warehouse, location
+        ).values_list('part_number', 'key_warehouse', 'key_location', 'quantity')
+    else:
+        base_rows = _inventory_totals(part_number, warehouse, location)
+    for part, wh, loc, quantity in base_rows:
+        balances[(part, wh, loc)] += quantity
+
+    # 基準が照会時点より前なら間の入出庫を加算し、後なら取り消す
+    if basis_at <= as_of:
+        deltas = _movement_deltas(1, part_number, warehouse, location, movement_date__gt=basis_at, movement_date__lte=as_of)
+    else:
+        deltas = _movement_deltas(-1, part_number, warehouse, location, movement_date__gt=as_of, movement_date__lte=basis_at)
+    for part, wh, loc, delta in deltas:
+        balances[(part, wh, loc)] += delta
+
+    results = [
+        {'part_number': part, 'warehouse': wh, 'location': loc, 'quantity': quantity}
+        for (part, wh, loc), quantity in sorted(balances.items())
+        if quantity
+    ]
+    return results, {'basis': basis, 'basis_at': basis_at}
@@ -0,0 +1,55 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework_simplejwt.tokens import AccessToken
+
+from base.http_benchmark import format_result, run_load, running_gunicorn
+
+INVENTORY_LIST_PATH = '/api/inventory/inventories/'
+
+# 比較するDB接続の設定 (名前, gunicorn に渡す環境変数)
+SCENARIOS = [
+    ('接続なし (CONN_MAX_AGE=0)', {'DB_CONN_MAX_AGE': '0', 'DB_POOL': 'false'}),
+    ('永続接続 (CONN_MAX_AGE=60)', {'DB_CONN_MAX_AGE': '60', 'DB_POOL': 'false'}),
+    ('コネクションプール (psycopg 3)', {'DB_POOL': 'true'}),
+]
+
+
+class Command(BaseCommand):
+    help = (
+        'DB接続の設定 (リクエストごとの接続・永続接続・コネクションプール) ごとに gunicorn を起動し、'
+        '在庫一覧API の応答時間 (p50/p99) を比較します。'
+        'DATABASE_URL に PostgreSQL を指定して実行してください (コネクションプールは PostgreSQL でのみ有効です)。'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', help='アクセストークンを発行するユーザーの専用ID (既定: 最初の有効なスーパーユーザー)')
+        parser.add_argument('--requests', type=int, default=1000, help='設定ごとのリクエスト数 (既定: 1000)')
+        parser.add_argument('--concurrency', type=int, default=10, help='同時リクエスト数 (既定: 10)')
+        parser.add_argument('--workers', type=int, default=2, help='gunicorn のワーカー数 (既定: 2)')
+        parser.add_argument('--page-size', type=int, default=25, help='在庫一覧の1ページの件数 (既定: 25)')
+
+    def handle(self, *args, **options):
+        users = get_user_model().objects.filter(is_active=True)
+        user = users.filter(custom_id=options['user']).first() if options['user'] else users.filter(is_superuser=True).first()
+        if user is None:
+            raise CommandError('アクセストークンを発行するユーザーが見つかりません。--user で専用IDを指定してください。')
+        headers = {'Authorization': f'Bearer {AccessToken.for_user(user)}'}
+        paths = [f'{INVENTORY_LIST_PATH}?page_size={options["page_size"]}']
+
+        results = []
+        for label, env in SCENARIOS:
+            env = dict(env, GUNICORN_WORKER_MODE='sync', GUNICORN_WORKERS=str(options['workers']))
+            with running_gunicorn(env) as base_url:
+                # 接続の確立・プールの初期化を計測に含めないよう、先に数件送信しておく
+                run_load(base_url, paths, headers, options['workers'] * 2, options['workers'])
+                result = run_load(base_url, paths, headers, options['requests'], options['concurrency'])
+            results.append((label, result))
+            self.stdout.write(format_result(label, result))
+
+        baseline = results[0][1]
+        for label, result in results[1:]:
+            if baseline['p50'] and baseline['p99']:
+                self.stdout.write(self.style.SUCCESS(
+                    f'{label}: p50 {result["p50"] / baseline["p50"]:.2f} 倍, p99 {result["p99"] / baseline["p99"]:.2f} 倍 '
+                    f'({results[0][0]} との比較)'
+                ))
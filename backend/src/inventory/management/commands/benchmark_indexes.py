@@ -0,0 +1,154 @@
+import statistics
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Sum
+from django.utils import timezone
+
+from inventory.models import Inventory, PurchaseOrder, StockMovement
+from production.models import MaterialAllocation, PartsUsed, ProductionPlan
+
+# 比較対象のインデックス (モデル, インデックス名)
+BENCHMARK_INDEXES = [
+    (Inventory, 'inv_part_wh_loc_idx'),
+    (Inventory, 'inv_wh_loc_idx'),
+    (PurchaseOrder, 'po_part_idx'),
+    (StockMovement, 'stockmove_date_idx'),
+    (StockMovement, 'stockmove_part_date_idx'),
+    (ProductionPlan, 'plan_status_start_idx'),
+    (ProductionPlan, 'plan_start_idx'),
+    (PartsUsed, 'partsused_plan_part_idx'),
+    (MaterialAllocation, 'matalloc_plan_material_idx'),
+    (MaterialAllocation, 'matalloc_material_idx'),
+]
+
+SEED_BATCH_SIZE = 5000
+WAREHOUSES = ['WH-A', 'WH-B', 'WH-C', 'WH-D']
+
+
+class Command(BaseCommand):
+    help = (
+        '在庫・生産の検索キーとなる文字列列のインデックス有無による実行計画と実行時間を比較します。'
+        '指定件数のデータを投入し、インデックスを削除した状態と存在する状態で同じクエリを EXPLAIN・計測します。'
+        '投入したデータとインデックスの削除は最後にロールバックされます。'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1000000, help='投入する在庫・入出庫履歴の件数 (各テーブル)。使用部品・引当・入庫予定はこの1/10件。')
+        parser.add_argument('--parts', type=int, default=50000, help='品番の種類数')
+        parser.add_argument('--repeat', type=int, default=5, help='各クエリの計測回数')
+
+    def handle(self, *args, **options):
+        rows = options['rows']
+        parts = max(options['parts'], 1)
+        self.repeat = max(options['repeat'], 1)
+
+        with transaction.atomic():
+            plans = self.seed(rows, parts)
+            self.analyze()
+            queries = self.build_queries(parts, plans)
+
+            # インデックスを削除した状態で計測し、セーブポイントを戻してインデックスを復元する
+            sid = transaction.savepoint()
+            self.drop_indexes()
+            before = self.measure(queries)
+            transaction.savepoint_rollback(sid)
+
+            after = self.measure(queries)
+            transaction.set_rollback(True)
+
+        for label, _ in queries:
+            self.stdout.write(self.style.MIGRATE_HEADING(f'== {label}'))
+            for title, results in (('インデックスなし', before), ('インデックスあり', after)):
+                plan, elapsed = results[label]
+                self.stdout.write(f'-- {title}: {elapsed:.3f} ms (中央値)')
+                self.stdout.write(plan)
+        self.stdout.write(self.style.SUCCESS('計測が完了しました (投入データはロールバック済み)。'))
+
+    def seed(self, rows, parts):
+        self.stdout.write(f'データを投入しています (在庫・入出庫履歴 各 {rows} 件)...')
+        now = timezone.now()
+        plan_count = max(rows // 1000, 1)
+        plans = [
+            ProductionPlan(
+                plan_name=f'BENCH-PLAN-{i}', product_code=f'PRD-{i % 100}', production_plan=f'BENCH-BOM-{i}',
+                planned_quantity=10, planned_start_datetime=now + timedelta(hours=i),
+                planned_end_datetime=now + timedelta(hours=i + 8),
+                status=('PENDING', 'IN_PROGRESS', 'COMPLETED')[i % 3],
+            )
+            for i in range(plan_count)
+        ]
+        ProductionPlan.objects.bulk_create(plans, batch_size=SEED_BATCH_SIZE)
+
+        self.bulk_seed(Inventory, rows, lambda i: Inventory(
+            part_number=f'P-{i % parts:06d}', warehouse=WAREHOUSES[i % len(WAREHOUSES)],
+            location=f'L-{i // parts:04d}', quantity=100, reserved=i % 10,
+        ))
+        self.bulk_seed(StockMovement, rows, lambda i: StockMovement(
+            part_number=f'P-{i % parts:06d}', warehouse=WAREHOUSES[i % len(WAREHOUSES)],
+            movement_type='incoming', quantity=1, movement_date=now - timedelta(minutes=i),
+        ))
+        self.bulk_seed(PurchaseOrder, rows // 10, lambda i: PurchaseOrder(
+            order_number=f'BPO-{i:09d}', part_number=f'P-{i % parts:06d}', quantity=10,
+        ))
+        self.bulk_seed(PartsUsed, rows // 10, lambda i: PartsUsed(
+            production_plan=f'BENCH-BOM-{i % plan_count}', part_code=f'P-{i % parts:06d}', quantity_used=1,
+        ))
+        self.bulk_seed(MaterialAllocation, rows // 10, lambda i: MaterialAllocation(
+            production_plan=plans[i % plan_count], material_code=f'P-{i % parts:06d}', allocated_quantity=1,
+        ))
+        return plans
+
+    def bulk_seed(self, model, count, factory):
+        for start in range(0, count, SEED_BATCH_SIZE):
+            model.objects.bulk_create([factory(i) for i in range(start, min(start + SEED_BATCH_SIZE, count))])
+
+    def analyze(self):
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                for model in {model for model, _ in BENCHMARK_INDEXES}:
+                    cursor.execute(f'ANALYZE {connection.ops.quote_name(model._meta.db_table)}')
+            else:
+                cursor.execute('ANALYZE')
+
+    def drop_indexes(self):
+        # スキーマエディタは SQLite ではトランザクション内で使用できないため、DROP INDEX を直接実行する
+        with connection.cursor() as cursor:
+            for _, index_name in BENCHMARK_INDEXES:
+                cursor.execute(f'DROP INDEX {connection.ops.quote_name(index_name)}')
+
+    def build_queries(self, parts, plans):
+        part_number = f'P-{parts // 2:06d}'
+        plan = plans[len(plans) // 2]
+        return [
+            ('在庫の品番・倉庫検索 (引当のロック取得)', lambda: Inventory.objects.filter(
+                part_number=part_number, warehouse='WH-A')),
+            ('在庫の品番・倉庫・棚番検索 (入庫・棚移動の get_or_create)', lambda: Inventory.objects.filter(
+                part_number=part_number, warehouse='WH-A', location='L-0000')),
+            ('棚番照会 (by-location)', lambda: Inventory.objects.filter(
+                warehouse='WH-B', location='L-0001', quantity__gt=0).order_by('part_number')),
+            ('品番ごとの入出庫履歴', lambda: StockMovement.objects.filter(
+                part_number=part_number).order_by('-movement_date')[:25]),
+            ('入出庫履歴一覧 (先頭ページ)', lambda: StockMovement.objects.order_by('-movement_date')[:25]),
+            ('品番ごとの入庫予定', lambda: PurchaseOrder.objects.filter(part_number=part_number)),
+            ('使用部品 (required_parts)', lambda: PartsUsed.objects.filter(production_plan=plan.production_plan)),
+            ('計画・材料ごとの引当済数量', lambda: MaterialAllocation.objects.filter(
+                production_plan=plan, material_code=part_number
+            ).values('material_code').annotate(total=Sum('allocated_quantity')).order_by()),
+            ('引当実行の対象計画', lambda: ProductionPlan.objects.filter(
+                status='PENDING', planned_start_datetime__gte=plan.planned_start_datetime
+            ).order_by('planned_start_datetime')[:100]),
+        ]
+
+    def measure(self, queries):
+        results = {}
+        for label, query in queries:
+            timings = []
+            for _ in range(self.repeat):
+                started = time.perf_counter()
+                list(query())
+                timings.append((time.perf_counter() - started) * 1000)
+            results[label] = (query().explain(), statistics.median(timings))
+        return results
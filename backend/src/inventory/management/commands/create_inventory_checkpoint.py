@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from inventory.checkpoints import create_checkpoint, prune_checkpoints
+
+
+class Command(BaseCommand):
+    help = '現在の在庫数量のスナップショット (InventoryCheckpoint) を作成し、保持期間を過ぎたスナップショットを削除します。'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--skip-prune', action='store_true', help='古いスナップショットを削除しない')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            created = create_checkpoint()
+        self.stdout.write(self.style.SUCCESS(f'在庫スナップショットを作成しました: {created} 件'))
+        if not options['skip_prune']:
+            self.stdout.write(f'保持期間を過ぎたスナップショットを削除しました: {prune_checkpoints()} 件')
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+
+from inventory.partitions import is_partitioned, maintain_partitions
+
+
+class Command(BaseCommand):
+    help = (
+        '入出庫履歴 (StockMovement) の月別パーティションを管理します。'
+        '当月から指定月数先までのパーティションを作成し、保持期間より古い月のパーティションをアーカイブテーブルへ移します。'
+        'PostgreSQL でのみ動作します。'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--months-ahead', type=int, default=None, help='当月から何か月先までのパーティションを作成するか (既定: STOCK_MOVEMENT_PARTITION_MONTHS_AHEAD)')
+        parser.add_argument('--retention-months', type=int, default=None, help='本テーブルに残す月数 (既定: STOCK_MOVEMENT_RETENTION_MONTHS)')
+        parser.add_argument('--skip-archive', action='store_true', help='パーティションの作成のみ行い、アーカイブは行わない')
+
+    def handle(self, *args, **options):
+        if not is_partitioned():
+            self.stdout.write(self.style.WARNING('入出庫履歴テーブルはパーティション化されていません (PostgreSQL 以外のデータベース)。'))
+            return
+
+        created, archived = maintain_partitions(
+            months_ahead=options['months_ahead'],
+            retention_months=options['retention_months'],
+            archive=not options['skip_archive'],
+        )
+        for name in created:
+            self.stdout.write(f'作成: {name}')
+        for name in archived:
+            self.stdout.write(f'アーカイブ: {name}')
+        self.stdout.write(self.style.SUCCESS(f'パーティションを作成 {len(created)} 件、アーカイブ {len(archived)} 件しました。'))
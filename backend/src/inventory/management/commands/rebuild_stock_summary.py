@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from inventory.services import rebuild_stock_summary
+
+
+class Command(BaseCommand):
+    help = '在庫 (Inventory) から品番・倉庫ごとの在庫集計 (StockSummary) を作り直します。'
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            count = rebuild_stock_summary()
+        self.stdout.write(self.style.SUCCESS(f'在庫集計を再構築しました: {count} 件'))
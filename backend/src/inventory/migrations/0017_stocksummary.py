@@ -0,0 +1,67 @@
+# Generated by Django 5.1.7 on 2026-10-18 19:09
+
+import uuid6
+from django.db import migrations, models
+from django.db.models import Case, F, IntegerField, Q, Sum, Value, When
+from django.db.models.functions import Coalesce
+
+
+def populate_stock_summary(apps, schema_editor):
+    # 既存の在庫から集計行を作成する
+    Inventory = apps.get_model('inventory', 'Inventory')
+    StockSummary = apps.get_model('inventory', 'StockSummary')
+    available = Case(
+        When(Q(is_active=True, is_allocatable=True, quantity__gt=F('reserved')), then=F('quantity') - F('reserved')),
+        default=Value(0),
+        output_field=IntegerField(),
+    )
+    rows = (
+        Inventory.objects.filter(part_number__isnull=False)
+        .exclude(part_number='')
+        .annotate(summary_warehouse=Coalesce('warehouse', Value('')))
+        .values('part_number', 'summary_warehouse')
+        .annotate(total_quantity=Sum('quantity'), total_reserved=Sum('reserved'), total_available=Sum(available))
+        .order_by()
+    )
+    StockSummary.objects.bulk_create(
+        [
+            StockSummary(
+                part_number=row['part_number'],
+                warehouse=row['summary_warehouse'],
+                quantity=row['total_quantity'] or 0,
+                reserved=row['total_reserved'] or 0,
+                available=row['total_available'] or 0,
+            )
+            for row in rows.iterator()
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0016_purchaseorder_received_quantity'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockSummary',
+            fields=[
+                ('id', models.UUIDField(default=uuid6.uuid7, editable=False, primary_key=True, serialize=False, verbose_name='ID')),
+                ('part_number', models.CharField(max_length=255, verbose_name='品番')),
+                ('warehouse', models.CharField(blank=True, default='', max_length=255, verbose_name='倉庫')),
+                ('quantity', models.IntegerField(default=0, verbose_name='在庫数量')),
+                ('reserved', models.IntegerField(default=0, verbose_name='引当済数量')),
+                ('available', models.IntegerField(default=0, verbose_name='利用可能数')),
+                ('last_updated', models.DateTimeField(auto_now=True, verbose_name='最終更新日時')),
+            ],
+            options={
+                'verbose_name': '在庫集計',
+                'verbose_name_plural': '在庫集計',
+                'ordering': ['part_number', 'warehouse'],
+                'unique_together': {('part_number', 'warehouse')},
+            },
+        ),
+        migrations.RunPython(populate_stock_summary, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.1.7 on 2026-10-18 19:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0017_stocksummary'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='inventory',
+            index=models.Index(fields=['part_number', 'warehouse', 'location'], name='inv_part_wh_loc_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='inventory',
+            index=models.Index(fields=['warehouse', 'location'], name='inv_wh_loc_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='purchaseorder',
+            index=models.Index(fields=['part_number'], name='po_part_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stockmovement',
+            index=models.Index(fields=['-movement_date'], name='stockmove_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stockmovement',
+            index=models.Index(fields=['part_number', '-movement_date'], name='stockmove_part_date_idx'),
+        ),
+    ]
@@ -0,0 +1,53 @@
+from django.db import migrations
+
+# 部分一致検索 (base.search の trgm_icontains) で使用する pg_trgm の GIN インデックス (テーブル, 列)
+TRIGRAM_INDEXES = [
+    ('inventory_purchaseorder', 'order_number'),
+    ('inventory_purchaseorder', 'part_number'),
+    ('inventory_purchaseorder', 'product_name'),
+    ('inventory_purchaseorder', 'supplier'),
+    ('inventory_purchaseorder', 'item'),
+    ('inventory_inventory', 'part_number'),
+    ('inventory_inventory', 'warehouse'),
+    ('inventory_inventory', 'location'),
+    ('inventory_stockmovement', 'part_number'),
+    ('inventory_stockmovement', 'warehouse'),
+    ('inventory_stockmovement', 'reference_document'),
+]
+
+
+def index_name(table, column):
+    return f'{table.replace("inventory_", "")}_{column}_trgm'
+
+
+def create_trigram_indexes(apps, schema_editor):
+    # pg_trgm は PostgreSQL 専用のため、それ以外 (テスト用の SQLite など) では何もしない
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    quote = schema_editor.quote_name
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for table, column in TRIGRAM_INDEXES:
+        # 大きなテーブルへの書き込みを止めないよう CONCURRENTLY で作成する (このマイグレーションは非アトミック)
+        schema_editor.execute(
+            f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {quote(index_name(table, column))} '
+            f'ON {quote(table)} USING gin ({quote(column)} gin_trgm_ops)'
+        )
+
+
+def drop_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for table, column in TRIGRAM_INDEXES:
+        schema_editor.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {schema_editor.quote_name(index_name(table, column))}')
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('inventory', '0018_string_key_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_trigram_indexes, drop_trigram_indexes),
+    ]
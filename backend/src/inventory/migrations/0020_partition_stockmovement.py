@@ -0,0 +1,125 @@
+import re
+from datetime import timedelta
+
+from django.db import migrations
+from django.utils import timezone
+
+TABLE = 'inventory_stockmovement'
+ARCHIVE_TABLE = f'{TABLE}_archive'
+DEFAULT_PARTITION = f'{TABLE}_default'
+# 移行時に当月から何か月先までのパーティションを作成するか (以降は manage_stock_movement_partitions で追加)
+MONTHS_AHEAD = 3
+
+
+def month_start(value):
+    value = timezone.localtime(value)
+    return value.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def next_month(month):
+    return month_start(month + timedelta(days=32))
+
+
+def table_definitions(cursor, table):
+    """主キー以外のインデックス定義と外部キー制約の定義を取得する。"""
+    cursor.execute(
+        'SELECT pg_get_indexdef(indexrelid) FROM pg_index WHERE indrelid = %s::regclass AND NOT indisprimary',
+        [table],
+    )
+    indexes = [row[0] for row in cursor.fetchall()]
+    cursor.execute(
+        "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint WHERE conrelid = %s::regclass AND contype = 'f'",
+        [table],
+    )
+    return indexes, cursor.fetchall()
+
+
+def recreate_definitions(schema_editor, old_table, indexes, foreign_keys):
+    quote = schema_editor.quote_name
+    for indexdef in indexes:
+        # "CREATE INDEX ... ON [ONLY] public.<old_table> USING ..." の対象テーブルを差し替える
+        schema_editor.execute(re.sub(rf' ON (ONLY )?(\S+\.)?{old_table} ', f' ON {quote(TABLE)} ', indexdef, count=1))
+    for name, definition in foreign_keys:
+        schema_editor.execute(f'ALTER TABLE {quote(TABLE)} ADD CONSTRAINT {quote(name)} {definition}')
+
+
+def partition_stock_movement(apps, schema_editor):
+    # 宣言的パーティションは PostgreSQL 専用のため、それ以外 (テスト用の SQLite など) では何もしない
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    quote = schema_editor.quote_name
+    old_table = f'{TABLE}_unpartitioned'
+
+    with schema_editor.connection.cursor() as cursor:
+        schema_editor.execute(f'ALTER TABLE {quote(TABLE)} RENAME TO {quote(old_table)}')
+        indexes, foreign_keys = table_definitions(cursor, old_table)
+
+        # パーティションテーブルの主キーにはパーティションキーを含める必要がある
+        schema_editor.execute(
+            f'CREATE TABLE {quote(TABLE)} (LIKE {quote(old_table)} INCLUDING DEFAULTS INCLUDING CONSTRAINTS INCLUDING STORAGE) '
+            f'PARTITION BY RANGE (movement_date)'
+        )
+        schema_editor.execute(
+            f'CREATE TABLE {quote(ARCHIVE_TABLE)} (LIKE {quote(TABLE)} INCLUDING DEFAULTS INCLUDING CONSTRAINTS) '
+            f'PARTITION BY RANGE (movement_date)'
+        )
+
+        # 既存データの最初の月から、当月の MONTHS_AHEAD か月先 (または最後のデータの月) までのパーティションを作る
+        cursor.execute(f'SELECT MIN(movement_date), MAX(movement_date) FROM {quote(old_table)}')
+        oldest, newest = cursor.fetchone()
+        now = timezone.now()
+        month = month_start(oldest or now)
+        last = month_start(now)
+        for _ in range(MONTHS_AHEAD):
+            last = next_month(last)
+        if newest is not None:
+            last = max(last, month_start(newest))
+        while month <= last:
+            schema_editor.execute(
+                f'CREATE TABLE {quote(f"{TABLE}_p{month:%Y_%m}")} PARTITION OF {quote(TABLE)} FOR VALUES FROM (%s) TO (%s)',
+                [month, next_month(month)],
+            )
+            month = next_month(month)
+        # 月別パーティションの無い移動日時 (未作成の将来月や、アーカイブ済みの月に遡った日付) を受け止める。
+        # 溜まった行は manage_stock_movement_partitions が月別パーティションへ移します
+        schema_editor.execute(f'CREATE TABLE {quote(DEFAULT_PARTITION)} PARTITION OF {quote(TABLE)} DEFAULT')
+
+        schema_editor.execute(f'INSERT INTO {quote(TABLE)} SELECT * FROM {quote(old_table)}')
+        schema_editor.execute(f'DROP TABLE {quote(old_table)}')
+
+    # インデックスはデータ投入後に親テーブルへ作成する (各パーティションにも作成される)
+    schema_editor.execute(f'ALTER TABLE {quote(TABLE)} ADD CONSTRAINT {quote(f"{TABLE}_pkey")} PRIMARY KEY (id, movement_date)')
+    recreate_definitions(schema_editor, old_table, indexes, foreign_keys)
+
+
+def unpartition_stock_movement(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    quote = schema_editor.quote_name
+    old_table = f'{TABLE}_partitioned'
+
+    with schema_editor.connection.cursor() as cursor:
+        schema_editor.execute(f'ALTER TABLE {quote(TABLE)} RENAME TO {quote(old_table)}')
+        indexes, foreign_keys = table_definitions(cursor, old_table)
+
+    schema_editor.execute(
+        f'CREATE TABLE {quote(TABLE)} (LIKE {quote(old_table)} INCLUDING DEFAULTS INCLUDING CONSTRAINTS INCLUDING STORAGE)'
+    )
+    # アーカイブ済みの履歴も元のテーブルに戻す
+    schema_editor.execute(f'INSERT INTO {quote(TABLE)} SELECT * FROM {quote(old_table)}')
+    schema_editor.execute(f'INSERT INTO {quote(TABLE)} SELECT * FROM {quote(ARCHIVE_TABLE)}')
+    schema_editor.execute(f'DROP TABLE {quote(old_table)}')
+    schema_editor.execute(f'DROP TABLE {quote(ARCHIVE_TABLE)}')
+    schema_editor.execute(f'ALTER TABLE {quote(TABLE)} ADD CONSTRAINT {quote(f"{TABLE}_pkey")} PRIMARY KEY (id)')
+    recreate_definitions(schema_editor, old_table, indexes, foreign_keys)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0019_trigram_search_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(partition_stock_movement, unpartition_stock_movement),
+    ]
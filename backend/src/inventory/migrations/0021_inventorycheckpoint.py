@@ -0,0 +1,32 @@
+# Generated by Django 5.1.7 on 2026-10-18 19:25
+
+import uuid6
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0020_partition_stockmovement'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InventoryCheckpoint',
+            fields=[
+                ('id', models.UUIDField(default=uuid6.uuid7, editable=False, primary_key=True, serialize=False, verbose_name='ID')),
+                ('checkpoint_at', models.DateTimeField(verbose_name='スナップショット日時')),
+                ('part_number', models.CharField(max_length=255, verbose_name='品番')),
+                ('warehouse', models.CharField(blank=True, default='', max_length=255, verbose_name='倉庫')),
+                ('location', models.CharField(blank=True, default='', max_length=255, verbose_name='棚番')),
+                ('quantity', models.IntegerField(default=0, verbose_name='在庫数量')),
+            ],
+            options={
+                'verbose_name': '在庫スナップショット',
+                'verbose_name_plural': '在庫スナップショット',
+                'ordering': ['-checkpoint_at', 'part_number', 'warehouse', 'location'],
+                'indexes': [models.Index(fields=['part_number', 'checkpoint_at'], name='checkpoint_part_at_idx')],
+                'unique_together': {('checkpoint_at', 'part_number', 'warehouse', 'location')},
+            },
+        ),
+    ]
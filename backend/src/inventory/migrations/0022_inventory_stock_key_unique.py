@@ -0,0 +1,84 @@
+# Generated by Django 5.1.7 on 2026-10-18 19:27
+
+import django.db.models.functions.comparison
+from django.db import migrations, models
+from django.db.models import Case, Count, F, IntegerField, Q, Sum, Value, When
+from django.db.models.functions import Coalesce
+
+
+def merge_duplicate_stock_keys(apps, schema_editor):
+    # 一意制約を追加する前に、同じ在庫キー (未設定と空文字は同一) の行を1行にまとめる。
+    # 数量・引当済数量は最初の行 (IDの順) に合算し、残りの行は削除する。
+    Inventory = apps.get_model('inventory', 'Inventory')
+    duplicates = (
+        Inventory.objects.annotate(
+            key_part=Coalesce('part_number', Value('')),
+            key_warehouse=Coalesce('warehouse', Value('')),
+            key_location=Coalesce('location', Value('')),
+        )
+        .values('key_part', 'key_warehouse', 'key_location')
+        .annotate(rows=Count('id'), total_quantity=Sum('quantity'), total_reserved=Sum('reserved'))
+        .filter(rows__gt=1)
+        .order_by()
+    )
+    merged_part_numbers = set()
+    for row in duplicates:
+        rows = Inventory.objects.annotate(
+            key_part=Coalesce('part_number', Value('')),
+            key_warehouse=Coalesce('warehouse', Value('')),
+            key_location=Coalesce('location', Value('')),
+        ).filter(key_part=row['key_part'], key_warehouse=row['key_warehouse'], key_location=row['key_location'])
+        keep_id, *other_ids = rows.order_by('pk').values_list('id', flat=True)
+        Inventory.objects.filter(id=keep_id).update(quantity=row['total_quantity'], reserved=row['total_reserved'])
+        Inventory.objects.filter(id__in=other_ids).delete()
+        merged_part_numbers.add(row['key_part'])
+
+    # 行ごとの利用可能数 (数量 - 引当済数量) と有効・引当可能フラグが変わるため、まとめた品番の在庫集計を作り直す
+    rebuild_stock_summary(apps, merged_part_numbers - {''})
+
+
+def rebuild_stock_summary(apps, part_numbers):
+    # inventory.services.refresh_stock_summary と同じ集計 (マイグレーションでは履歴モデルを使うため複製しています)
+    if not part_numbers:
+        return
+    Inventory = apps.get_model('inventory', 'Inventory')
+    StockSummary = apps.get_model('inventory', 'StockSummary')
+    available = Case(
+        When(Q(is_active=True, is_allocatable=True, quantity__gt=F('reserved')), then=F('quantity') - F('reserved')),
+        default=Value(0),
+        output_field=IntegerField(),
+    )
+    rows = (
+        Inventory.objects.filter(part_number__in=part_numbers)
+        .annotate(summary_warehouse=Coalesce('warehouse', Value('')))
+        .values('part_number', 'summary_warehouse')
+        .annotate(
+            total_quantity=Coalesce(Sum('quantity'), 0),
+            total_reserved=Coalesce(Sum('reserved'), 0),
+            total_available=Coalesce(Sum(available), 0),
+        )
+        .order_by()
+    )
+    StockSummary.objects.filter(part_number__in=part_numbers).delete()
+    StockSummary.objects.bulk_create([
+        StockSummary(
+            part_number=row['part_number'], warehouse=row['summary_warehouse'],
+            quantity=row['total_quantity'], reserved=row['total_reserved'], available=row['total_available'],
+        )
+        for row in rows
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0021_inventorycheckpoint'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_stock_keys, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='inventory',
+            constraint=models.UniqueConstraint(django.db.models.functions.comparison.Coalesce('part_number', models.Value('')), django.db.models.functions.comparison.Coalesce('warehouse', models.Value('')), django.db.models.functions.comparison.Coalesce('location', models.Value('')), name='inv_stock_key_uniq'),
+        ),
+    ]
@@ -1,6 +1,7 @@
 from django.db import models
 # from master.models import Item, Supplier, Warehouse
-from django.db.models import Sum
+from django.db.models import Sum, Value
+from django.db.models.functions import Coalesce
 from django.utils import timezone
 from django.conf import settings
 import uuid
@@ -24,6 +25,13 @@ class Inventory(models.Model):
             return 0  # 在庫が無効または引き当て不可なら利用不可
         return max(0, self.quantity - self.reserved)
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # 品番が変更された場合に変更前の品番の在庫集計も更新できるよう、読み込み時の値を保持する
+        instance._loaded_part_number = instance.__dict__.get('part_number')
+        return instance
+
     def __str__(self):
         status = "Active" if self.is_active else "Inactive"
         allocatable = "Allocatable" if self.is_allocatable else "Not Allocatable"
@@ -31,6 +39,42 @@ class Inventory(models.Model):
         warehouse_display = self.warehouse if self.warehouse else "N/A"
         return f"{part_number_display} - {self.quantity} in {warehouse_display} ({self.location}) [{status}, {allocatable}]"
 
+    class Meta:
+        indexes = [
+            # 引当のロック取得など、品番・倉庫 (・棚番) の列をそのまま比較する検索
+            models.Index(fields=['part_number', 'warehouse', 'location'], name='inv_part_wh_loc_idx'),
+            # 棚番照会 (by-location)
+            models.Index(fields=['warehouse', 'location'], name='inv_wh_loc_idx'),
+        ]
+        constraints = [
+            # 在庫キー (品番・倉庫・棚番) ごとに1行。未設定 (NULL) と空文字は同じキーとみなす。
+            # inventory.stock の INSERT ... ON CONFLICT はこの制約を使用する
+            models.UniqueConstraint(
+                Coalesce('part_number', Value('')), Coalesce('warehouse', Value('')), Coalesce('location', Value('')),
+                name='inv_stock_key_uniq',
+            ),
+        ]
+
+
+# 品番・倉庫ごとの在庫集計 (Inventory の更新と同じトランザクションで inventory.services により維持される)
+class StockSummary(models.Model):
+    id = models.UUIDField(primary_key=True, default=uuid7, editable=False, verbose_name="ID")
+    part_number = models.CharField(max_length=255, verbose_name="品番")
+    warehouse = models.CharField(max_length=255, blank=True, default='', verbose_name="倉庫")  # 倉庫未設定の在庫は空文字で集計
+    quantity = models.IntegerField(default=0, verbose_name="在庫数量")  # 棚番をまたいだ在庫数量の合計
+    reserved = models.IntegerField(default=0, verbose_name="引当済数量")  # 棚番をまたいだ引当済数量の合計
+    available = models.IntegerField(default=0, verbose_name="利用可能数")  # 各在庫の available_quantity の合計
+    last_updated = models.DateTimeField(auto_now=True, verbose_name="最終更新日時")
+
+    class Meta:
+        verbose_name = "在庫集計"
+        verbose_name_plural = "在庫集計"
+        unique_together = ('part_number', 'warehouse')
+        ordering = ['part_number', 'warehouse']
+
+    def __str__(self):
+        return f"{self.part_number} @ {self.warehouse or 'N/A'}: {self.available}/{self.quantity}"
+
 
 
 # 入出庫履歴
@@ -63,6 +107,37 @@ class StockMovement(models.Model):
     def __str__(self):
         return f"{self.part_number or 'N/A'} - {self.movement_type} - {self.quantity}"
 
+    class Meta:
+        indexes = [
+            # 入出庫履歴一覧 (移動日時の降順)
+            models.Index(fields=['-movement_date'], name='stockmove_date_idx'),
+            # 品番ごとの履歴照会
+            models.Index(fields=['part_number', '-movement_date'], name='stockmove_part_date_idx'),
+        ]
+
+
+# 在庫残高のスナップショット (時点在庫の照会で使用)
+class InventoryCheckpoint(models.Model):
+    id = models.UUIDField(primary_key=True, default=uuid7, editable=False, verbose_name="ID")
+    checkpoint_at = models.DateTimeField(verbose_name="スナップショット日時")  # 同じ回に作成した行は同じ日時
+    part_number = models.CharField(max_length=255, verbose_name="品番")
+    warehouse = models.CharField(max_length=255, blank=True, default='', verbose_name="倉庫")  # 未設定は空文字
+    location = models.CharField(max_length=255, blank=True, default='', verbose_name="棚番")  # 未設定は空文字
+    quantity = models.IntegerField(default=0, verbose_name="在庫数量")  # スナップショット日時点の在庫数量
+
+    class Meta:
+        verbose_name = "在庫スナップショット"
+        verbose_name_plural = "在庫スナップショット"
+        unique_together = ('checkpoint_at', 'part_number', 'warehouse', 'location')
+        ordering = ['-checkpoint_at', 'part_number', 'warehouse', 'location']
+        indexes = [
+            # 品番を指定した時点在庫の照会
+            models.Index(fields=['part_number', 'checkpoint_at'], name='checkpoint_part_at_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.checkpoint_at:%Y-%m-%d %H:%M} {self.part_number} @ {self.warehouse or 'N/A'}/{self.location or 'N/A'}: {self.quantity}"
+
 
 # 入庫予定
 class PurchaseOrder(models.Model):
@@ -106,6 +181,11 @@ class PurchaseOrder(models.Model):
         """残りの未入庫数量を計算して返す"""
         return self.quantity - self.received_quantity
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['part_number'], name='po_part_idx'),
+        ]
+
 # 入庫実績
 class Receipt(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid7, editable=False, verbose_name="ID")
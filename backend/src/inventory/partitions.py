@@ -0,0 +1,217 @@
+"""
+入出庫履歴 (StockMovement) の月別パーティション管理。
+
+PostgreSQL では `inventory_stockmovement` は `movement_date` による月単位の範囲パーティション
+テーブルです (マイグレーション 0020)。移動日時で絞り込む・並べる検索は該当月の
+パーティションだけを参照します。
+
+月別パーティションの無い移動日時 (未作成の将来月や、アーカイブ済みの月に遡った日付) の行は
+DEFAULT パーティション `inventory_stockmovement_default` に保存されます。
+
+- `ensure_partitions`: 当月から指定月数先までのパーティションを作成します。DEFAULT パーティションに
+  溜まった行も月別パーティションへ移します (アーカイブ済みの月の行はアーカイブテーブルへ移します)。
+  DEFAULT パーティションの行は移動日時で絞り込んでも常に検索対象になるため、定期的に実行してください。
+- `archive_partitions`: 保持期間を過ぎた月のパーティションを切り離し (DETACH)、
+  アーカイブテーブル `inventory_stockmovement_archive` に付け替えます (ATTACH)。
+  行のコピーや DELETE を伴わないため、件数に関わらず短時間で終わります。
+
+`manage_stock_movement_partitions` コマンドと Celery タスク `inventory.tasks.maintain_stock_movement_partitions`
+から呼び出されます。PostgreSQL 以外のデータベースでは何もしません。
+"""
+import re
+from datetime import datetime
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import StockMovement
+
+PARENT_TABLE = StockMovement._meta.db_table
+ARCHIVE_TABLE = f'{PARENT_TABLE}_archive'
+DEFAULT_PARTITION = f'{PARENT_TABLE}_default'
+
+# 月別パーティションのテーブル名 (例: inventory_stockmovement_p2024_05)
+PARTITION_NAME_RE = re.compile(rf'^{PARENT_TABLE}_p(\d{{4}})_(\d{{2}})$')
+
+
+def month_start(value=None):
+    """指定日時 (省略時は現在) を含む月の初日 0:00 (TIME_ZONE の時刻) を返す。"""
+    value = timezone.localtime(value or timezone.now())
+    return value.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def add_months(month, months):
+    """月の初日 month から months か月後 (負数なら前) の月の初日を返す。"""
+    index = month.year * 12 + month.month - 1 + months
+    return month.replace(year=index // 12, month=index % 12 + 1)
+
+
+def partition_name(month):
+    return f'{PARENT_TABLE}_p{month:%Y_%m}'
+
+
+def is_partitioned(table=PARENT_TABLE):
+    if connection.vendor != 'postgresql':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(%s)', [table])
+        return cursor.fetchone() is not None
+
+
+def list_partitions(table=PARENT_TABLE):
+    """パーティションテーブルに付いている月別パーティションを {月の初日: テーブル名} で返す。"""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid '
+            'WHERE i.inhparent = to_regclass(%s)',
+            [table],
+        )
+        names = [row[0] for row in cursor.fetchall()]
+
+    partitions = {}
+    tzinfo = timezone.get_current_timezone()
+    for name in names:
+        match = PARTITION_NAME_RE.match(name)
+        if match:
+            month = datetime(int(match.group(1)), int(match.group(2)), 1, tzinfo=tzinfo)
+            partitions[month] = name
+    return dict(sorted(partitions.items()))
+
+
+def default_partition_months():
+    """DEFAULT パーティションに行がある月 (月の初日) を古い順に返す。"""
+    quote = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'SELECT DISTINCT date_trunc(%s, movement_date, %s) FROM {quote(DEFAULT_PARTITION)} ORDER BY 1',
+            ['month', timezone.get_current_timezone_name()],
+        )
+        return [timezone.localtime(row[0]) for row in cursor.fetchall()]
+
+
+def _month_range(month):
+    return [month, add_months(month, 1)]
+
+
+def _has_default_rows(cursor, month):
+    quote = connection.ops.quote_name
+    cursor.execute(
+        f'SELECT EXISTS (SELECT 1 FROM {quote(DEFAULT_PARTITION)} WHERE movement_date >= %s AND movement_date < %s)',
+        _month_range(month),
+    )
+    return cursor.fetchone()[0]
+
+
+def _move_default_rows(cursor, table, month):
+    """DEFAULT パーティションにある month の行を table へ移す。"""
+    quote = connection.ops.quote_name
+    # 移している間に同じ月の行が DEFAULT パーティションへ追加されないようにする (トランザクションの終了まで保持されます)
+    cursor.execute(f'LOCK TABLE {quote(DEFAULT_PARTITION)} IN SHARE ROW EXCLUSIVE MODE')
+    cursor.execute(
+        f'WITH moved AS ('
+        f'DELETE FROM {quote(DEFAULT_PARTITION)} WHERE movement_date >= %s AND movement_date < %s RETURNING *'
+        f') INSERT INTO {quote(table)} SELECT * FROM moved',
+        _month_range(month),
+    )
+
+
+def _create_partition(cursor, month):
+    quote = connection.ops.quote_name
+    name = quote(partition_name(month))
+    if not _has_default_rows(cursor, month):
+        cursor.execute(
+            f'CREATE TABLE {name} PARTITION OF {quote(PARENT_TABLE)} FOR VALUES FROM (%s) TO (%s)', _month_range(month),
+        )
+        return
+    # DEFAULT パーティションにこの月の行が残っていると PARTITION OF / ATTACH PARTITION は失敗するため、
+    # 単独のテーブルに行を移してから付け替える (インデックスと外部キーは ATTACH 時に作成されます)
+    cursor.execute(f'CREATE TABLE {name} (LIKE {quote(PARENT_TABLE)} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)')
+    _move_default_rows(cursor, partition_name(month), month)
+    cursor.execute(
+        f'ALTER TABLE {quote(PARENT_TABLE)} ATTACH PARTITION {name} FOR VALUES FROM (%s) TO (%s)', _month_range(month),
+    )
+
+
+def archived_before():
+    """
+    アーカイブ済みの入出庫履歴の境界 (本テーブルに残っている最初の月の初日) を返す。
+    これより前の移動日時の行は本テーブル (StockMovement) からは参照できません。
+    アーカイブされた月が無い場合 (PostgreSQL 以外を含む) は None を返します。
+    """
+    if not is_partitioned():
+        return None
+    archived = list_partitions(ARCHIVE_TABLE)
+    if not archived:
+        return None
+    return add_months(max(archived), 1)
+
+
+def ensure_partitions(months_ahead=None, now=None):
+    """
+    当月から months_ahead か月先までのパーティションのうち、存在しないものを作成する。
+    DEFAULT パーティションに行がある月のパーティションも作成して行を移します。保持期間より前の月は
+    このあと archive_partitions がアーカイブし、すでにアーカイブ済みの月の行はアーカイブテーブルへ直接移します。
+    作成したテーブル名のリストを返します。
+    """
+    if not is_partitioned():
+        return []
+    if months_ahead is None:
+        months_ahead = settings.STOCK_MOVEMENT_PARTITION_MONTHS_AHEAD
+
+    existing = list_partitions()
+    archived = list_partitions(ARCHIVE_TABLE)
+    current = month_start(now)
+    months = {add_months(current, offset) for offset in range(months_ahead + 1)}
+    months.update(default_partition_months())
+    created = []
+    for month in sorted(months):
+        if month in existing:
+            continue
+        with transaction.atomic(), connection.cursor() as cursor:
+            if month in archived:
+                if _has_default_rows(cursor, month):
+                    _move_default_rows(cursor, ARCHIVE_TABLE, month)
+                continue
+            _create_partition(cursor, month)
+        created.append(partition_name(month))
+    return created
+
+
+def archive_partitions(retention_months=None, now=None):
+    """
+    保持期間 (retention_months か月) より前の月のパーティションをアーカイブテーブルへ移す。
+    移したテーブル名のリストを返します。
+    """
+    if not is_partitioned():
+        return []
+    if retention_months is None:
+        retention_months = settings.STOCK_MOVEMENT_RETENTION_MONTHS
+
+    quote = connection.ops.quote_name
+    cutoff = add_months(month_start(now), -retention_months)
+    archived = []
+    for month, name in list_partitions().items():
+        if month >= cutoff:
+            break
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(f'ALTER TABLE {quote(PARENT_TABLE)} DETACH PARTITION {quote(name)}')
+            # 記録者 (ユーザー) の削除時に SET NULL されるのは本テーブルのみのため、アーカイブ側の外部キー制約は外す
+            cursor.execute(
+                "SELECT conname FROM pg_constraint WHERE conrelid = to_regclass(%s) AND contype = 'f'", [name]
+            )
+            for (constraint,) in cursor.fetchall():
+                cursor.execute(f'ALTER TABLE {quote(name)} DROP CONSTRAINT {quote(constraint)}')
+            cursor.execute(
+                f'ALTER TABLE {quote(ARCHIVE_TABLE)} ATTACH PARTITION {quote(name)} FOR VALUES FROM (%s) TO (%s)',
+                [month, add_months(month, 1)],
+            )
+        archived.append(name)
+    return archived
+
+
+def maintain_partitions(months_ahead=None, retention_months=None, archive=True):
+    """将来のパーティション作成と古いパーティションのアーカイブをまとめて行い、(作成, アーカイブ) を返す。"""
+    created = ensure_partitions(months_ahead)
+    archived = archive_partitions(retention_months) if archive else []
+    return created, archived
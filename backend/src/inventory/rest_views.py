@@ -4,31 +4,54 @@ from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.pagination import PageNumberPagination # PageNumberPagination は StandardResultsSetPagination で使用
 from rest_framework.views import APIView
-from .serializers import (PurchaseOrderSerializer, InventorySerializer, StockMovementSerializer, SalesOrderSerializer, AllocateInventoryForSalesOrderRequestSerializer, ReceiptSerializer)
-from .models import PurchaseOrder, Inventory, StockMovement, SalesOrder, Receipt # SalesOrder, Receiptモデルをインポート
+from .serializers import (PurchaseOrderSerializer, InventorySerializer, StockMovementSerializer, SalesOrderSerializer, AllocateInventoryForSalesOrderRequestSerializer, ReceiptSerializer, StockSummarySerializer)
+from .checkpoints import StockHistoryUnavailable, stock_as_of
+from .services import refresh_stock_summary
+from .stock import InsufficientStock, add_stock, remove_stock_by_id
+from .models import PurchaseOrder, Inventory, StockMovement, SalesOrder, Receipt, StockSummary # SalesOrder, Receiptモデルをインポート
 from django.http import JsonResponse # JsonResponse をインポート
 from django.db import transaction, IntegrityError # トランザクションのためにインポート # Qオブジェクトをインポートして複雑なクエリを構築
 from django.db import models
 from django.db.models import Q, F
+from base.async_api import async_api_view
+from base.csv_export import CsvExportMixin
+from base.facets import FacetMixin, cached_facet_counts, invalidate_facets
+from base.pagination import CountModePaginationMixin, KeysetPagination
+from base.search import contains_q  # trgm_icontains ルックアップを登録 (PostgreSQL では pg_trgm インデックスを使用)
 from django.shortcuts import get_object_or_404 # オブジェクト取得のためにインポート
 from django.db.models import ProtectedError # Import ProtectedError
 from django.http import HttpResponse
+from django.views.decorators.http import require_GET
 import csv
 import io
-from datetime import datetime
+from datetime import datetime, time
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
 
 # DRFのページネーションクラスを定義 (共通で利用可能)
-class StandardResultsSetPagination(PageNumberPagination):
+class StandardResultsSetPagination(CountModePaginationMixin, PageNumberPagination):
     page_size = 25  # 1ページあたりのデフォルト件数を25に変更（適宜調整してください）
     page_size_query_param = 'page_size' # クライアントが1ページあたりの件数を指定するためのクエリパラメータ
     max_page_size = 1000 # クライアントが指定できる1ページあたりの最大件数
 
+    def paginate_queryset(self, queryset, request, view=None):
+        # ビューが cursor_ordering を定義していれば、?pagination=cursor または ?cursor= でキーセット方式に切り替える
+        cursor_ordering = getattr(view, 'cursor_ordering', None)
+        if cursor_ordering and KeysetPagination.is_requested(request):
+            self.keyset = KeysetPagination(cursor_ordering, self.get_page_size(request))
+            return self.keyset.paginate_queryset(queryset, request, view)
+        self.keyset = None
+        return super().paginate_queryset(queryset, request, view)
+
     def get_paginated_response(self, data):
+        if self.keyset is not None:
+            return self.keyset.get_paginated_response(data)
         return Response({
             'next': self.get_next_link(),
             'previous': self.get_previous_link(),
             'count': self.page.paginator.count,
-            'total_pages': self.page.paginator.num_pages,
+            'count_is_exact': self.page.paginator.count_is_exact, # estimate で推定値を返した場合や none の場合は False
+            'total_pages': self.page.paginator.num_pages if self.page.paginator.count is not None else None,
             'current_page': self.page.number,
             'page_size': self.get_page_size(self.request),
             'results': data
@@ -45,13 +68,15 @@ class ReceiptViewSet(viewsets.ModelViewSet):
     pagination_class = StandardResultsSetPagination
     permission_classes = [IsAuthenticated]
 
-class InventoryViewSet(viewsets.ModelViewSet):
+class InventoryViewSet(CsvExportMixin, FacetMixin, viewsets.ModelViewSet):
     """
     API endpoint that allows inventory to be viewed or edited.
     """
     serializer_class = InventorySerializer
     pagination_class = StandardResultsSetPagination
     permission_classes = [IsAuthenticated]
+    csv_export_data_type = 'inventory'  # export-csv で使用するCSV列マッピングのデータ種別
+    facet_fields = ('part_number', 'warehouse', 'location')  # facets で集計できる項目
 
     def get_queryset(self):
         part_number_query = self.request.query_params.get('part_number_query', None)
@@ -61,11 +86,11 @@ class InventoryViewSet(viewsets.ModelViewSet):
 
         filters = Q()
         if part_number_query:
-            filters &= Q(part_number__icontains=part_number_query)
+            filters &= Q(part_number__trgm_icontains=part_number_query)
         if warehouse_query:
-            filters &= Q(warehouse__icontains=warehouse_query)
+            filters &= Q(warehouse__trgm_icontains=warehouse_query)
         if location_query:
-            filters &= Q(location__icontains=location_query)
+            filters &= Q(location__trgm_icontains=location_query)
 
         queryset = Inventory.objects.filter(filters)
 
@@ -78,25 +103,39 @@ class InventoryViewSet(viewsets.ModelViewSet):
 
         return queryset.order_by('part_number', 'warehouse', 'location')
 
-    @action(detail=False, methods=['get'], url_path='by-location')
-    def by_location(self, request):
-        warehouse = request.query_params.get('warehouse')
-        location = request.query_params.get('location')
+    @action(detail=False, methods=['get'], url_path='as-of')
+    def as_of(self, request):
+        """
+        指定日時 (as_of) 時点の品番・倉庫・棚番ごとの在庫数量を返す。
+        最も近い在庫スナップショット (または現在の在庫) を基準に、間の入出庫履歴だけを加減して求めます。
+        日付のみを指定した場合はその日の終わりの時点とします。
+        """
+        value = request.query_params.get('as_of', '')
+        as_of = parse_datetime(value)
+        if as_of is None:
+            as_of_date = parse_date(value)
+            if as_of_date is None:
+                return Response(
+                    {'success': False, 'error': 'as_of には日時 (YYYY-MM-DDTHH:MM:SS) または日付 (YYYY-MM-DD) を指定してください。'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            as_of = datetime.combine(as_of_date, time.max)
+        if timezone.is_naive(as_of):
+            as_of = timezone.make_aware(as_of)
 
-        if not warehouse or location is None:
-            return Response(
-                {'success': False, 'error': '倉庫(warehouse)と棚番(location)は必須のクエリパラメータです。'},
-                status=status.HTTP_400_BAD_REQUEST
+        try:
+            results, basis = stock_as_of(
+                as_of,
+                part_number=request.query_params.get('part_number') or None,
+                warehouse=request.query_params.get('warehouse'),
+                location=request.query_params.get('location'),
             )
-
-        inventory_items = Inventory.objects.filter(
-            warehouse=warehouse,
-            location=location,
-            quantity__gt=0
-        ).order_by('part_number')
-
-        serializer = self.get_serializer(inventory_items, many=True)
-        return Response(serializer.data)
+        except StockHistoryUnavailable as e:
+            return Response({'success': False, 'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        page = self.paginate_queryset(results)
+        response = self.get_paginated_response(page)
+        response.data.update({'as_of': as_of, **basis})
+        return response
 
     @action(detail=True, methods=['post'], url_path='move')
     def move(self, request, pk=None):
@@ -120,45 +159,42 @@ class InventoryViewSet(viewsets.ModelViewSet):
 
         try:
             with transaction.atomic():
-                # 移動元から在庫を減らす
-                source_inventory.quantity -= quantity_to_move
-                source_inventory.save()
+                # 移動元から在庫を減らす (在庫数が足りる場合だけ1文で減算する)
+                try:
+                    remove_stock_by_id(source_inventory.pk, quantity_to_move)
+                except InsufficientStock:
+                    # 確認後に他の端末から出庫された場合
+                    return Response({'success': False, 'error': '移動数量が現在の在庫数を超えています。'}, status=status.HTTP_400_BAD_REQUEST)
 
                 # 移動先に在庫を追加または作成
-                target_inventory, created = Inventory.objects.get_or_create(
-                    part_number=source_inventory.part_number,
-                    warehouse=target_warehouse,
-                    location=target_location,
-                    defaults={'quantity': quantity_to_move}
-                )
-                if not created:
-                    target_inventory.quantity += quantity_to_move
-                    target_inventory.save()
+                add_stock(source_inventory.part_number, target_warehouse, target_location, quantity_to_move)
 
                 # 在庫移動履歴を記録
                 operator = request.user if request.user.is_authenticated else None
-
-                # 移動元の履歴 (出庫)
-                StockMovement.objects.create(
-                    part_number=source_inventory.part_number,
-                    movement_type='outgoing',
-                    quantity=quantity_to_move,
-                    warehouse=source_inventory.warehouse,
-                    location=source_inventory.location,
-                    description=f"棚番移動: {target_warehouse} の {target_location} へ",
-                    operator=operator
-                )
-
-                # 移動先の履歴 (入庫)
-                StockMovement.objects.create(
-                    part_number=source_inventory.part_number,
-                    movement_type='incoming',
-                    quantity=quantity_to_move,
-                    warehouse=target_warehouse,
-                    location=target_location,
-                    description=f"棚番移動: {source_inventory.warehouse} の {source_inventory.location} から",
-                    operator=operator
-                )
+                StockMovement.objects.bulk_create([
+                    # 移動元の履歴 (出庫)
+                    StockMovement(
+                        part_number=source_inventory.part_number,
+                        movement_type='outgoing',
+                        quantity=quantity_to_move,
+                        warehouse=source_inventory.warehouse,
+                        location=source_inventory.location,
+                        description=f"棚番移動: {target_warehouse} の {target_location} へ",
+                        operator=operator
+                    ),
+                    # 移動先の履歴 (入庫)
+                    StockMovement(
+                        part_number=source_inventory.part_number,
+                        movement_type='incoming',
+                        quantity=quantity_to_move,
+                        warehouse=target_warehouse,
+                        location=target_location,
+                        description=f"棚番移動: {source_inventory.warehouse} の {source_inventory.location} から",
+                        operator=operator
+                    ),
+                ])
+                refresh_stock_summary({source_inventory.part_number})
+                invalidate_facets(StockMovement)  # bulk_create は post_save を送信しないため
 
             return Response({'success': True, 'message': '在庫を正常に移動しました。'})
 
@@ -174,22 +210,51 @@ class InventoryViewSet(viewsets.ModelViewSet):
         return Response({'message': 'Adjust action is not fully implemented yet.'}, status=status.HTTP_501_NOT_IMPLEMENTED)
 
 
-class PurchaseOrderViewSet(viewsets.ModelViewSet):
+@require_GET
+@async_api_view()
+async def inventory_by_location(request):
+    """
+    倉庫・棚番にある在庫 (数量が0より大きいもの) を品番順に返す。
+    ハンディ端末の棚番照会から頻繁に呼び出されるため、非同期ビューとして非同期ORMで取得します。
+    """
+    warehouse = request.GET.get('warehouse')
+    location = request.GET.get('location')
+
+    if not warehouse or location is None:
+        return JsonResponse(
+            {'success': False, 'error': '倉庫(warehouse)と棚番(location)は必須のクエリパラメータです。'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    inventory_items = [
+        item async for item in Inventory.objects.filter(
+            warehouse=warehouse,
+            location=location,
+            quantity__gt=0
+        ).order_by('part_number')
+    ]
+    return JsonResponse(InventorySerializer(inventory_items, many=True).data, safe=False)
+
+
+class PurchaseOrderViewSet(CsvExportMixin, FacetMixin, viewsets.ModelViewSet):
     """
     API endpoint that allows purchase orders to be viewed or edited.
     """
     serializer_class = PurchaseOrderSerializer
     pagination_class = StandardResultsSetPagination
     permission_classes = [IsAuthenticated]
+    cursor_ordering = ('expected_arrival', 'order_number', 'id')  # ?pagination=cursor で使用する並び順
+    csv_export_data_type = 'purchase_order'  # export-csv で使用するCSV列マッピングのデータ種別
+    facet_fields = ('supplier', 'warehouse', 'location', 'status', 'model_type', 'delivery_destination', 'delivery_source')  # facets で集計できる項目
 
     def get_queryset(self):
         filters = Q()
         search_params_text = {
-            'search_order_number': 'order_number__icontains',
-            'search_shipment_number': 'shipment_number__icontains',
-            'search_supplier': 'supplier__icontains',
-            'search_part_number': 'part_number__icontains',
-            'search_warehouse': 'warehouse__icontains',
+            'search_order_number': 'order_number__trgm_icontains',
+            'search_shipment_number': 'shipment_number__trgm_icontains',
+            'search_supplier': 'supplier__trgm_icontains',
+            'search_part_number': 'part_number__trgm_icontains',
+            'search_warehouse': 'warehouse__trgm_icontains',
         }
         for param, field_lookup in search_params_text.items():
             value = self.request.query_params.get(param)
@@ -199,18 +264,11 @@ class PurchaseOrderViewSet(viewsets.ModelViewSet):
         # Add a general search parameter 'search_q' for mobile view
         search_q = self.request.query_params.get('search_q')
         if search_q:
-            filters &= (
-                Q(order_number__icontains=search_q) |
-                Q(part_number__icontains=search_q) |
-                Q(product_name__icontains=search_q) |
-                Q(supplier__icontains=search_q) |
-                Q(item__icontains=search_q)
-            )
+            filters &= contains_q(search_q, 'order_number', 'part_number', 'product_name', 'supplier', 'item')
 
         search_item_product_name = self.request.query_params.get('search_item_product_name')
         if search_item_product_name:
-            filters &= (Q(item__icontains=search_item_product_name) | 
-                        Q(product_name__icontains=search_item_product_name))
+            filters &= contains_q(search_item_product_name, 'item', 'product_name')
 
         search_status = self.request.query_params.get('search_status')
         if search_status:
@@ -283,14 +341,9 @@ class PurchaseOrderViewSet(viewsets.ModelViewSet):
                     warehouse=warehouse, location=location, operator=operator
                 )
 
-                # 2. Update/Create Inventory
-                inventory, created = Inventory.objects.get_or_create(
-                    part_number=po.part_number, warehouse=warehouse, location=location,
-                    defaults={'quantity': received_quantity}
-                )
-                if not created:
-                    inventory.quantity += received_quantity
-                    inventory.save()
+                # 2. Update/Create Inventory (INSERT ... ON CONFLICT で加算または作成)
+                add_stock(po.part_number, warehouse, location, received_quantity)
+                refresh_stock_summary({po.part_number})
 
                 # 3. Create Stock Movement
                 StockMovement.objects.create(
@@ -299,16 +352,13 @@ class PurchaseOrderViewSet(viewsets.ModelViewSet):
                     description=f"発注番号 {po.order_number} の入庫", operator=operator
                 )
 
-                # 4. Update Purchase Order status
+                # 4. Update Purchase Order status (発注行はロック済みのため、数量とステータスを1回で保存する)
                 po.received_quantity += received_quantity
-                po.save()
-                po.refresh_from_db()
-
                 if po.received_quantity >= po.quantity:
                     po.status = 'fully_received'
                 else:
                     po.status = 'partially_received'
-                po.save()
+                po.save(update_fields=['received_quantity', 'status'])
 
                 return Response({
                     'success': True, 'message': f'発注 {po.order_number} の入庫処理が正常に完了しました。',
@@ -334,32 +384,33 @@ class PurchaseOrderViewSet(viewsets.ModelViewSet):
         if not field_name or field_name not in allowed_fields:
             return Response({'error': 'Invalid or missing field parameter.'}, status=status.HTTP_400_BAD_REQUEST)
 
-        # 空やNULLでない値のみを取得し、ソートする
-        values = PurchaseOrder.objects.filter(**{f'{field_name}__isnull': False}).exclude(**{f'{field_name}': ''}).values_list(field_name, flat=True).distinct().order_by(field_name)
+        # 空やNULLでない値のみを、ソートして返す (facets と同じ集計・キャッシュを使用)
+        values = cached_facet_counts(PurchaseOrder.objects.all(), [field_name])[field_name]
 
-        return Response(list(values))
+        return Response([item['value'] for item in values])
 
-class SalesOrderViewSet(viewsets.ModelViewSet):
+class SalesOrderViewSet(FacetMixin, viewsets.ModelViewSet):
     """
     API endpoint that allows sales orders to be viewed or edited.
     """
     serializer_class = SalesOrderSerializer
     pagination_class = StandardResultsSetPagination
     permission_classes = [IsAuthenticated]
+    facet_fields = ('item', 'warehouse', 'status')  # facets で集計できる項目
 
     def get_queryset(self):
         filters = Q()
         search_order_number = self.request.query_params.get('search_order_number')
         if search_order_number:
-            filters &= Q(order_number__icontains=search_order_number)
+            filters &= Q(order_number__trgm_icontains=search_order_number)
 
         search_item = self.request.query_params.get('search_item')
         if search_item:
-            filters &= Q(item__icontains=search_item)
+            filters &= Q(item__trgm_icontains=search_item)
 
         search_warehouse = self.request.query_params.get('search_warehouse')
         if search_warehouse:
-            filters &= Q(warehouse__icontains=search_warehouse)
+            filters &= Q(warehouse__trgm_icontains=search_warehouse)
 
         search_status = self.request.query_params.get('search_status')
         if search_status:
@@ -378,22 +429,25 @@ class SalesOrderViewSet(viewsets.ModelViewSet):
         return Response({'message': 'Issue action is not fully implemented yet.'}, status=status.HTTP_501_NOT_IMPLEMENTED)
 
 
-class StockMovementViewSet(viewsets.ReadOnlyModelViewSet):
+class StockMovementViewSet(CsvExportMixin, FacetMixin, viewsets.ReadOnlyModelViewSet):
     """
     API endpoint that allows stock movements to be viewed.
     """
     serializer_class = StockMovementSerializer
     pagination_class = StandardResultsSetPagination
     permission_classes = [IsAuthenticated]
+    cursor_ordering = ('-movement_date', 'part_number', 'id')  # ?pagination=cursor で使用する並び順
+    csv_export_data_type = 'stock_movement'  # export-csv で使用するCSV列マッピングのデータ種別
+    facet_fields = ('movement_type', 'warehouse', 'location')  # facets で集計できる項目
 
     def get_queryset(self):
         filters = Q()
         text_search_params = {
-            'search_part_number': 'part_number__icontains',
-            'search_warehouse': 'warehouse__icontains',
-            'search_reference_document': 'reference_document__icontains',
-            'search_description': 'description__icontains',
-            'search_operator': 'operator__username__icontains',
+            'search_part_number': 'part_number__trgm_icontains',
+            'search_warehouse': 'warehouse__trgm_icontains',
+            'search_reference_document': 'reference_document__trgm_icontains',
+            'search_description': 'description__trgm_icontains',
+            'search_operator': 'operator__username__trgm_icontains',
         }
         for param, field_lookup in text_search_params.items():
             value = self.request.query_params.get(param)
@@ -418,4 +472,68 @@ class StockMovementViewSet(viewsets.ReadOnlyModelViewSet):
         if date_to:
             filters &= Q(movement_date__date__lte=date_to)
 
-        return StockMovement.objects.filter(filters).order_by('-movement_date', 'part_number')
\ No newline at end of file
+        return StockMovement.objects.filter(filters).order_by('-movement_date', 'part_number')
+
+
+class StockSummaryViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    API endpoint that exposes per-part, per-warehouse stock totals.
+    Rows are maintained from Inventory in the same transaction as each stock change,
+    so a part's totals are read from a handful of rows instead of aggregating every location.
+    """
+    serializer_class = StockSummarySerializer
+    pagination_class = StandardResultsSetPagination
+    permission_classes = [IsAuthenticated]
+
+    def _part_numbers_param(self):
+        value = self.request.query_params.get('part_number', '')
+        return [p.strip() for p in value.split(',') if p.strip()]
+
+    def get_queryset(self):
+        queryset = StockSummary.objects.all()
+
+        part_numbers = self._part_numbers_param()
+        if part_numbers:
+            queryset = queryset.filter(part_number__in=part_numbers)
+        part_number_query = self.request.query_params.get('part_number_query')
+        if part_number_query:
+            queryset = queryset.filter(part_number__trgm_icontains=part_number_query)
+        warehouse = self.request.query_params.get('warehouse')
+        if warehouse is not None:
+            queryset = queryset.filter(warehouse=warehouse)
+        if self.request.query_params.get('hide_zero_stock_query', 'false').lower() == 'true':
+            queryset = queryset.filter(available__gt=0)
+
+        return queryset.order_by('part_number', 'warehouse')
+
+    @action(detail=False, methods=['get'], url_path='totals')
+    def totals(self, request):
+        """
+        Returns stock totals per part with a per-warehouse breakdown.
+        Query params: part_number (required, comma-separated), warehouse (optional).
+        """
+        if not self._part_numbers_param():
+            return Response(
+                {'success': False, 'error': '品番(part_number)は必須のクエリパラメータです。'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        totals = {}
+        for summary in self.get_queryset():
+            entry = totals.setdefault(summary.part_number, {
+                'part_number': summary.part_number,
+                'quantity': 0,
+                'reserved': 0,
+                'available': 0,
+                'warehouses': [],
+            })
+            entry['quantity'] += summary.quantity
+            entry['reserved'] += summary.reserved
+            entry['available'] += summary.available
+            entry['warehouses'].append({
+                'warehouse': summary.warehouse,
+                'quantity': summary.quantity,
+                'reserved': summary.reserved,
+                'available': summary.available,
+            })
+        return Response(list(totals.values()))
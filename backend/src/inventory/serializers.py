@@ -1,9 +1,10 @@
 from rest_framework import serializers
-from .models import PurchaseOrder, Inventory, StockMovement, SalesOrder, Receipt # StockMovement, SalesOrder, Receiptモデルをインポート
+from .models import PurchaseOrder, Inventory, StockMovement, SalesOrder, Receipt, StockSummary # StockMovement, SalesOrder, Receiptモデルをインポート
 # master.modelsのインポートは、将来的に関連モデルとして扱うための準備か、
 # あるいはビューなどで型ヒント等に利用されている可能性があります。
 # 現状このシリアライザー内では直接参照されていません。
 from master.models import Item, Supplier, Warehouse # masterアプリケーションからモデルをインポート
+from .stock import stock_key_conditions
 
 class ReceiptSerializer(serializers.ModelSerializer):
     """
@@ -117,6 +118,35 @@ class InventorySerializer(serializers.ModelSerializer):
         ]
         read_only_fields = ['id', 'last_updated', 'available_quantity']
 
+    def validate(self, attrs):
+        """
+        在庫キー (品番・倉庫・棚番) が他の在庫と重複しないことを確認します。
+        一意制約 inv_stock_key_uniq は式による制約でシリアライザの検証対象にならないため、
+        ここで同じ条件 (未設定と空文字は同じキー) で確認し、重複を 500 ではなく 400 で返します。
+        """
+        instance = self.instance
+        key = [
+            attrs[name] if name in attrs else getattr(instance, name, None)
+            for name in ('part_number', 'warehouse', 'location')
+        ]
+        query = Inventory.objects.filter(*stock_key_conditions(*key))
+        if instance and instance.pk:
+            query = query.exclude(pk=instance.pk)
+
+        if query.exists():
+            raise serializers.ValidationError("同じ品番・倉庫・棚番の在庫が既に登録されています。")
+        return attrs
+
+
+class StockSummarySerializer(serializers.ModelSerializer):
+    """
+    品番・倉庫ごとの在庫集計のためのシリアライザ。
+    """
+    class Meta:
+        model = StockSummary
+        fields = ['part_number', 'warehouse', 'quantity', 'reserved', 'available', 'last_updated']
+        read_only_fields = fields
+
 
 class StockMovementSerializer(serializers.ModelSerializer):
     """
@@ -0,0 +1,133 @@
+"""
+在庫の集計処理。
+
+`StockSummary` は Inventory を品番・倉庫ごとに集計したテーブルです。
+Inventory の保存・削除 (inventory.signals) とCSVインポートの一括保存から
+同じトランザクション内で `refresh_stock_summary` が呼び出され、常に最新の状態に保たれます。
+"""
+from django.db import connection
+from django.db.models import Case, F, IntegerField, Q, Sum, Value, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import Inventory, StockSummary
+
+# StockSummary を一括で作り直す際に1度に保存する件数
+SUMMARY_BATCH_SIZE = 1000
+
+
+def _summary_rows(queryset):
+    """Inventory のクエリセットを品番・倉庫ごとに集計した辞書のイテレータを返す。"""
+    available = Case(
+        When(
+            Q(is_active=True, is_allocatable=True, quantity__gt=F('reserved')),
+            then=F('quantity') - F('reserved'),
+        ),
+        default=Value(0),
+        output_field=IntegerField(),
+    )
+    return (
+        queryset.filter(part_number__isnull=False)
+        .exclude(part_number='')
+        .annotate(summary_warehouse=Coalesce('warehouse', Value('')))
+        .values('part_number', 'summary_warehouse')
+        .annotate(
+            total_quantity=Coalesce(Sum('quantity'), 0),
+            total_reserved=Coalesce(Sum('reserved'), 0),
+            total_available=Coalesce(Sum(available), 0),
+        )
+        .order_by()
+    )
+
+
+def _to_summary(row):
+    return StockSummary(
+        part_number=row['part_number'],
+        warehouse=row['summary_warehouse'],
+        quantity=row['total_quantity'],
+        reserved=row['total_reserved'],
+        available=row['total_available'],
+    )
+
+
+def _upsert(summaries):
+    StockSummary.objects.bulk_create(
+        summaries,
+        update_conflicts=True,
+        unique_fields=['part_number', 'warehouse'],
+        update_fields=['quantity', 'reserved', 'available', 'last_updated'],
+    )
+
+
+def _lock_part_numbers(part_numbers):
+    """
+    品番ごとのトランザクションレベルのロックを取得する (PostgreSQL のみ、コミット・ロールバックで解放されます)。
+
+    READ COMMITTED では、並行するトランザクションがそれぞれ相手の未コミットの在庫変更を含まない集計を
+    書き込み、後からコミットした方が先の結果を上書きしてしまいます。同じ品番の再集計をロックで直列化し、
+    待機後に実行する集計で先にコミットされた変更を必ず読み込むようにします。
+    まだ Inventory・StockSummary の行が無い品番もロックできるよう、行ロックではなく advisory lock を使用します。
+    SQLite は書き込みがデータベース単位で直列化されるため不要です。
+    """
+    if connection.vendor != 'postgresql':
+        return
+    with connection.cursor() as cursor:
+        # デッドロックを避けるため、常に同じ順序でロックする (unnest は配列の順に行を返します)。
+        # 品番の数に関わらず1回のクエリで取得します
+        cursor.execute(
+            "SELECT pg_advisory_xact_lock(hashtext('inventory_stocksummary'), hashtext(part_number)) "
+            "FROM unnest(%s::text[]) WITH ORDINALITY AS locks(part_number, position) ORDER BY position",
+            [sorted(part_numbers)],
+        )
+
+
+def refresh_stock_summary(part_numbers):
+    """
+    指定した品番の在庫集計を Inventory から再計算して保存する。
+
+    品番ごとに全倉庫分をまとめて集計し直すため、倉庫の変更や在庫の削除にも追従します。
+    呼び出し元のトランザクション内で実行してください (品番のロックはトランザクションの終了まで保持されます)。
+    """
+    part_numbers = {p for p in part_numbers if p}
+    if not part_numbers:
+        return
+
+    _lock_part_numbers(part_numbers)
+    summaries = [_to_summary(row) for row in _summary_rows(Inventory.objects.filter(part_number__in=part_numbers))]
+    if summaries:
+        _upsert(summaries)
+
+    # 在庫が無くなった品番・倉庫の集計行を削除する
+    current_keys = {(s.part_number, s.warehouse) for s in summaries}
+    stale_ids = [
+        summary_id
+        for summary_id, part_number, warehouse in StockSummary.objects.filter(
+            part_number__in=part_numbers
+        ).values_list('id', 'part_number', 'warehouse')
+        if (part_number, warehouse) not in current_keys
+    ]
+    if stale_ids:
+        StockSummary.objects.filter(id__in=stale_ids).delete()
+
+
+def rebuild_stock_summary():
+    """
+    全品番の在庫集計を作り直す。初期構築や、Inventory を直接SQLで更新した後の整合性回復に使用します。
+    作成・更新した集計行の件数を返します。
+    """
+    started_at = timezone.now()
+    summaries = []
+    count = 0
+    for row in _summary_rows(Inventory.objects.all()).iterator():
+        summaries.append(_to_summary(row))
+        if len(summaries) >= SUMMARY_BATCH_SIZE:
+            _upsert(summaries)
+            count += len(summaries)
+            summaries = []
+    if summaries:
+        _upsert(summaries)
+        count += len(summaries)
+
+    # 今回の集計で更新されなかった (在庫の存在しない) 集計行を削除する
+    StockSummary.objects.filter(last_updated__lt=started_at).delete()
+    return count
@@ -0,0 +1,47 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from base.facets import invalidate_facets
+from base.signals import csv_batch_imported
+from .models import Inventory, PurchaseOrder, SalesOrder, StockMovement
+from .services import refresh_stock_summary
+
+
+@receiver(post_save, sender=Inventory)
+def refresh_stock_summary_on_save(sender, instance, **kwargs):
+    """
+    在庫の保存と同じトランザクション内で品番の在庫集計を更新する。
+    品番が変更された場合は変更前の品番も更新します。
+    """
+    refresh_stock_summary({instance.part_number, getattr(instance, '_loaded_part_number', None)})
+    instance._loaded_part_number = instance.part_number
+
+
+@receiver(post_delete, sender=Inventory)
+def refresh_stock_summary_on_delete(sender, instance, **kwargs):
+    refresh_stock_summary({instance.part_number, getattr(instance, '_loaded_part_number', None)})
+
+
+@receiver(csv_batch_imported, sender=Inventory)
+def refresh_stock_summary_on_csv_import(sender, objs, **kwargs):
+    """CSVインポートで一括保存された在庫の品番をまとめて集計し直す。"""
+    part_numbers = set()
+    for obj in objs:
+        part_numbers.add(obj.part_number)
+        part_numbers.add(getattr(obj, '_loaded_part_number', None))
+        obj._loaded_part_number = obj.part_number
+    refresh_stock_summary(part_numbers)
+
+
+# 一覧の facets アクションで集計するモデル。保存・削除・CSVインポートでキャッシュを無効にする
+FACET_MODELS = (Inventory, PurchaseOrder, SalesOrder, StockMovement)
+
+
+def invalidate_facets_on_change(sender, **kwargs):
+    invalidate_facets(sender)
+
+
+for model in FACET_MODELS:
+    post_save.connect(invalidate_facets_on_change, sender=model, dispatch_uid=f'invalidate_facets_save_{model.__name__}')
+    post_delete.connect(invalidate_facets_on_change, sender=model, dispatch_uid=f'invalidate_facets_delete_{model.__name__}')
+    csv_batch_imported.connect(invalidate_facets_on_change, sender=model, dispatch_uid=f'invalidate_facets_csv_{model.__name__}')
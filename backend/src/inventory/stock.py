@@ -0,0 +1,124 @@
+"""
+在庫数量の更新処理。
+
+在庫数量の増減は Python 側で読み込んで `save()` せず、1文の SQL で行います。
+
+- `add_stock`: `INSERT ... ON CONFLICT DO UPDATE SET quantity = quantity + ...` で、
+  在庫キー (品番・倉庫・棚番) の行が無ければ作成し、あれば加算します。
+- `remove_stock` / `remove_stock_by_id`: `UPDATE ... SET quantity = quantity - %s WHERE ... AND quantity >= %s`
+  で、在庫が足りる場合だけ減算します。
+- `stock_location`: 棚番を指定しない呼び出し元 (生産完了入庫など) のために、品番・倉庫の既存の在庫の棚番を返します。
+
+在庫キーは一意制約 `inv_stock_key_uniq` (未設定の倉庫・棚番は空文字として比較) で保証されるため、
+同じ在庫キーへの同時の入庫でも行が重複せず、行ロックは更新の瞬間だけ取得されます。
+いずれも post_save を送信しないため、呼び出し元で `refresh_stock_summary` を呼び出してください
+(`add_stock` はファセット集計のキャッシュのみ自身で無効にします)。
+"""
+from django.db import connection
+from django.db.models import F, Value
+from django.db.models.functions import Coalesce
+from django.db.models.lookups import Exact
+from django.utils import timezone
+from uuid6 import uuid7
+
+from base.facets import invalidate_facets
+from .models import Inventory
+
+
+class InsufficientStock(ValueError):
+    """在庫が存在しない、または減算する数量に足りない場合に送出されます。"""
+
+    def __init__(self, message, current_quantity=None):
+        super().__init__(message)
+        self.current_quantity = current_quantity
+
+
+def stock_key_conditions(part_number, warehouse, location):
+    """
+    在庫キーに一致する条件を返す。
+    一意制約と同じ式 (COALESCE(列, '')) で比較するため、制約のインデックスが使用されます。
+    """
+    return [
+        Exact(Coalesce(field, Value('')), value or '')
+        for field, value in (('part_number', part_number), ('warehouse', warehouse), ('location', location))
+    ]
+
+
+def stock_location(part_number, warehouse):
+    """
+    品番・倉庫の在庫がある棚番を返す (棚番を指定せずに倉庫単位で在庫を増減する呼び出し元向け)。
+    複数の棚番に在庫がある場合は最初に作成された行 (IDの順) の棚番を返します。
+    行が無い場合は None (棚番未設定の在庫キー) を返します。
+    """
+    return (
+        Inventory.objects.filter(part_number=part_number, warehouse=warehouse)
+        .order_by('pk').values_list('location', flat=True).first()
+    )
+
+
+def add_stock(part_number, warehouse, location, quantity):
+    """
+    在庫キーの在庫数量に quantity を加算する。行が無ければ在庫数量 quantity の行を作成する。
+    (在庫ID, 加算後の在庫数量) を返します。
+    """
+    meta = Inventory._meta
+    values = {
+        'id': uuid7(),
+        'part_number': part_number,
+        'warehouse': warehouse,
+        'location': location,
+        'quantity': quantity,
+        'reserved': 0,
+        'last_updated': timezone.now(),
+        'is_active': True,
+        'is_allocatable': True,
+    }
+    columns = [meta.get_field(name).column for name in values]
+    params = [meta.get_field(name).get_db_prep_save(value, connection) for name, value in values.items()]
+
+    quote = connection.ops.quote_name
+    table = quote(meta.db_table)
+    key = ', '.join(f"(COALESCE({quote(meta.get_field(name).column)}, ''))" for name in ('part_number', 'warehouse', 'location'))
+    sql = (
+        f"INSERT INTO {table} ({', '.join(quote(column) for column in columns)}) "
+        f"VALUES ({', '.join(['%s'] * len(columns))}) "
+        f"ON CONFLICT ({key}) DO UPDATE SET "
+        f"{quote('quantity')} = {table}.{quote('quantity')} + EXCLUDED.{quote('quantity')}, "
+        f"{quote('last_updated')} = EXCLUDED.{quote('last_updated')} "
+        f"RETURNING {quote('id')}, {quote('quantity')}"
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        inventory_id, new_quantity = cursor.fetchone()
+    # 新しい倉庫・棚番の行が作成された可能性があるため、絞り込み候補のキャッシュを無効にする
+    invalidate_facets(Inventory)
+    return meta.pk.to_python(inventory_id), new_quantity
+
+
+def _remove(queryset, quantity, description):
+    updated = queryset.filter(quantity__gte=quantity).update(
+        quantity=F('quantity') - quantity, last_updated=timezone.now()
+    )
+    if updated:
+        return
+    # 失敗した場合のみ、エラーメッセージのために現在の在庫数量を取得する
+    current = queryset.values_list('quantity', flat=True).first()
+    if current is None:
+        raise InsufficientStock(f"{description} の在庫が見つかりません。")
+    raise InsufficientStock(
+        f"{description} の在庫が不足しています。減算数量: {quantity}, 現在の在庫数量: {current}", current_quantity=current
+    )
+
+
+def remove_stock(part_number, warehouse, location, quantity):
+    """在庫キーの在庫数量から quantity を減算する。在庫が無い・足りない場合は InsufficientStock を送出します。"""
+    _remove(
+        Inventory.objects.filter(*stock_key_conditions(part_number, warehouse, location)),
+        quantity,
+        f"品番 {part_number} (倉庫: {warehouse or '-'}, 棚番: {location or '-'})",
+    )
+
+
+def remove_stock_by_id(inventory_id, quantity):
+    """在庫ID の在庫数量から quantity を減算する。在庫が無い・足りない場合は InsufficientStock を送出します。"""
+    _remove(Inventory.objects.filter(pk=inventory_id), quantity, f"在庫 {inventory_id}")
@@ -0,0 +1,26 @@
+from celery import shared_task
+from django.db import transaction
+
+from .checkpoints import create_checkpoint, prune_checkpoints
+from .partitions import maintain_partitions
+
+
+@shared_task
+def maintain_stock_movement_partitions():
+    """
+    入出庫履歴の将来月のパーティションを作成し、保持期間を過ぎた月をアーカイブテーブルへ移す。
+    celery beat から毎日実行されます (CELERY_BEAT_SCHEDULE)。
+    """
+    created, archived = maintain_partitions()
+    return {'created': created, 'archived': archived}
+
+
+@shared_task
+def create_inventory_checkpoint():
+    """
+    現在の在庫数量のスナップショットを作成し、保持期間を過ぎたスナップショットを削除する。
+    celery beat から毎晩実行されます (CELERY_BEAT_SCHEDULE)。
+    """
+    with transaction.atomic():
+        created = create_checkpoint()
+    return {'created': created, 'deleted': prune_checkpoints()}
@@ -1,8 +1,25 @@
+from unittest import mock, skipUnless
+
 from django.urls import reverse
 from rest_framework import status
 from rest_framework.test import APITestCase
+from rest_framework_simplejwt.tokens import AccessToken
 from django.contrib.auth import get_user_model
-from .models import Inventory, PurchaseOrder
+from django.core.cache import cache
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F
+from django.test import TestCase, override_settings
+from base.csv_import import CsvImportWriter
+from base.models import CsvColumnMapping
+from datetime import timedelta
+from django.utils import timezone
+from .checkpoints import StockHistoryUnavailable, create_checkpoint, stock_as_of
+from .models import Inventory, InventoryCheckpoint, PurchaseOrder, StockMovement, StockSummary
+from .partitions import (
+    ARCHIVE_TABLE, DEFAULT_PARTITION, add_months, archive_partitions, ensure_partitions, month_start, partition_name
+)
+from .services import rebuild_stock_summary, refresh_stock_summary
+from .stock import InsufficientStock, add_stock, remove_stock
 
 User = get_user_model()
 
@@ -77,3 +94,441 @@ class PurchaseOrderAPITests(APITestCase):
         response = self.client.delete(url)
         self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
         self.assertEqual(PurchaseOrder.objects.count(), 1)
+
+
+class StockSummaryTests(TestCase):
+    def summary(self, part_number, warehouse):
+        s = StockSummary.objects.get(part_number=part_number, warehouse=warehouse)
+        return (s.quantity, s.reserved, s.available)
+
+    def test_summary_follows_inventory_changes(self):
+        """在庫の作成・更新・削除に合わせて集計が更新されることを確認"""
+        item = Inventory.objects.create(part_number='P-1', warehouse='WH-A', location='A-01', quantity=10, reserved=3)
+        Inventory.objects.create(part_number='P-1', warehouse='WH-A', location='A-02', quantity=5, is_allocatable=False)
+        Inventory.objects.create(part_number='P-1', location='X', quantity=2)
+        self.assertEqual(self.summary('P-1', 'WH-A'), (15, 3, 7))
+        self.assertEqual(self.summary('P-1', ''), (2, 0, 2))
+
+        item = Inventory.objects.get(pk=item.pk)
+        item.warehouse = 'WH-B'
+        item.save()
+        self.assertEqual(self.summary('P-1', 'WH-A'), (5, 0, 0))
+        self.assertEqual(self.summary('P-1', 'WH-B'), (10, 3, 7))
+
+        item.part_number = 'P-2'
+        item.save()
+        self.assertFalse(StockSummary.objects.filter(part_number='P-1', warehouse='WH-B').exists())
+        self.assertEqual(self.summary('P-2', 'WH-B'), (10, 3, 7))
+
+        item.delete()
+        self.assertFalse(StockSummary.objects.filter(part_number='P-2').exists())
+
+    def test_summary_follows_csv_import(self):
+        """CSVインポートの一括保存でも集計が更新されることを確認"""
+        Inventory.objects.create(part_number='P-1', warehouse='WH-A', location='A-01', quantity=1)
+        writer = CsvImportWriter(Inventory, ['part_number', 'warehouse', 'location'])
+        writer.write_batch([
+            (2, {'part_number': 'P-1', 'warehouse': 'WH-A', 'location': 'A-01'}, {'quantity': 8}),
+            (3, {'part_number': 'P-1', 'warehouse': 'WH-A', 'location': 'A-02'}, {'quantity': 4}),
+        ])
+        self.assertEqual(self.summary('P-1', 'WH-A'), (12, 0, 12))
+
+    def test_rebuild(self):
+        """集計を作り直すと、在庫と一致しない集計行が修正・削除されることを確認"""
+        Inventory.objects.create(part_number='P-1', warehouse='WH-A', quantity=4)
+        StockSummary.objects.filter(part_number='P-1').update(quantity=99)
+        StockSummary.objects.create(part_number='P-GONE', warehouse='WH-A', quantity=1)
+        self.assertEqual(rebuild_stock_summary(), 1)
+        self.assertEqual(self.summary('P-1', 'WH-A'), (4, 0, 4))
+        self.assertFalse(StockSummary.objects.filter(part_number='P-GONE').exists())
+
+    def test_refresh_locks_part_numbers(self):
+        """PostgreSQL では、再集計の前に品番ごとのロックを常に同じ順序で取得することを確認"""
+        with mock.patch('inventory.services.connection') as connection:
+            connection.vendor = 'postgresql'
+            refresh_stock_summary(['P-2', 'P-1', ''])
+        cursor = connection.cursor.return_value.__enter__.return_value
+        cursor.execute.assert_called_once()
+        self.assertEqual(cursor.execute.call_args.args[1], [['P-1', 'P-2']])
+        self.assertIn('pg_advisory_xact_lock', cursor.execute.call_args.args[0])
+
+
+class StockSummaryAPITests(APITestCase):
+    def setUp(self):
+        self.client.force_authenticate(user=User(custom_id='summary-user', username='summaryuser'))
+        Inventory.objects.create(part_number='P-1', warehouse='WH-A', location='A-01', quantity=10, reserved=4)
+        Inventory.objects.create(part_number='P-1', warehouse='WH-B', location='B-01', quantity=6)
+        Inventory.objects.create(part_number='P-2', warehouse='WH-A', location='A-02', quantity=3)
+
+    def test_list(self):
+        """品番と倉庫で集計を絞り込めることを確認"""
+        url = reverse('inventory_api:stocksummary-list')
+        response = self.client.get(url, {'part_number': 'P-1', 'warehouse': 'WH-B'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['count'], 1)
+        self.assertEqual(response.data['results'][0]['available'], 6)
+
+    def test_totals(self):
+        """品番ごとの合計と倉庫別内訳が返されることを確認"""
+        url = reverse('inventory_api:stocksummary-totals')
+        with self.assertNumQueries(1):
+            response = self.client.get(url, {'part_number': 'P-1,P-2'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        totals = {t['part_number']: t for t in response.data}
+        self.assertEqual((totals['P-1']['quantity'], totals['P-1']['available']), (16, 12))
+        self.assertEqual(len(totals['P-1']['warehouses']), 2)
+        self.assertEqual(totals['P-2']['available'], 3)
+
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class KeysetPaginationTests(APITestCase):
+    def setUp(self):
+        self.client.force_authenticate(user=User(custom_id='cursor-user', username='cursoruser'))
+
+    def walk(self, url, params):
+        """カーソルをたどって全ページを取得し、取得したIDの順序とリクエスト回数を返す"""
+        ids, requests = [], 0
+        response = self.client.get(url, params)
+        while True:
+            requests += 1
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertNotIn('count', response.data)
+            ids.extend(row['id'] for row in response.data['results'])
+            if not response.data['next']:
+                return ids, requests
+            response = self.client.get(response.data['next'])
+
+    def test_stock_movements_follow_list_ordering(self):
+        """同一日時・NULL品番を含んでも、重複や欠落なく既定の並び順で全件をたどれることを確認"""
+        base = timezone.now()
+        for i in range(23):
+            StockMovement.objects.create(
+                part_number=None if i % 5 == 0 else f'P-{i % 3}', movement_type='incoming', quantity=1,
+                movement_date=base - timedelta(seconds=i // 4),
+            )
+        url = reverse('inventory_api:stockmovement-list')
+        ids, requests = self.walk(url, {'pagination': 'cursor', 'page_size': 4})
+
+        expected = [str(pk) for pk in StockMovement.objects.order_by(
+            F('movement_date').desc(), F('part_number').asc(nulls_last=True), 'id'
+        ).values_list('id', flat=True)]
+        self.assertEqual(ids, expected)
+        self.assertEqual(requests, 6)
+
+    def test_purchase_orders_with_null_keys(self):
+        """入荷予定日時・発注番号が NULL の入庫予定も末尾までたどれることを確認"""
+        base = timezone.now()
+        for i in range(11):
+            PurchaseOrder.objects.create(
+                order_number=None if i % 4 == 0 else f'PO-{i % 3}{i}', quantity=1,
+                expected_arrival=None if i % 3 == 0 else base + timedelta(days=i % 2),
+            )
+        ids, _ = self.walk(reverse('inventory_api:purchaseorder-list'), {'pagination': 'cursor', 'page_size': 3})
+        self.assertEqual(len(ids), 11)
+        self.assertEqual(len(set(ids)), 11)
+        last = PurchaseOrder.objects.get(pk=ids[-1])
+        self.assertIsNone(last.expected_arrival)
+
+    def test_deep_page_costs_one_query(self):
+        """カーソル指定のページ取得が件数集計なしの1クエリで行われることを確認"""
+        for i in range(10):
+            StockMovement.objects.create(part_number=f'P-{i}', movement_type='incoming', quantity=1)
+        url = reverse('inventory_api:stockmovement-list')
+        next_url = self.client.get(url, {'pagination': 'cursor', 'page_size': 3}).data['next']
+        with self.assertNumQueries(1):
+            response = self.client.get(next_url)
+        self.assertEqual(len(response.data['results']), 3)
+
+    def test_count_none(self):
+        """?count=none では件数を集計せず、count_is_exact が False になることを確認"""
+        for i in range(3):
+            StockMovement.objects.create(part_number=f'P-{i}', movement_type='incoming', quantity=1)
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('inventory_api:stockmovement-list'), {'count': 'none', 'page_size': 2})
+        self.assertIsNone(response.data['count'])
+        self.assertFalse(response.data['count_is_exact'])
+        self.assertIsNotNone(response.data['next'])
+
+    def test_invalid_cursor(self):
+        """不正なカーソルは404になることを確認"""
+        response = self.client.get(reverse('inventory_api:stockmovement-list'), {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class CsvExportTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.client.force_authenticate(user=User(custom_id='export-user', username='exportuser'))
+
+    def read_csv(self, response):
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        content = b''.join(response.streaming_content).decode('utf-8')
+        self.assertTrue(content.startswith('\ufeff'))
+        return content[1:].splitlines()
+
+    def test_inventory_export_uses_mapping_and_list_filters(self):
+        """CSV列マッピングの表示順・ヘッダー名で出力し、一覧と同じ絞り込み条件が適用されることを確認"""
+        CsvColumnMapping.objects.bulk_create([
+            CsvColumnMapping(data_type='inventory', csv_header='数量', model_field_name='quantity', order=2),
+            CsvColumnMapping(data_type='inventory', csv_header='品番', model_field_name='part_number', order=1),
+            CsvColumnMapping(data_type='inventory', csv_header='無効列', model_field_name='location', order=3, is_active=False),
+        ])
+        Inventory.objects.create(part_number='EXP-1', warehouse='WH', location='A', quantity=5)
+        Inventory.objects.create(part_number='EXP-2', warehouse='WH', location='A', quantity=7)
+        Inventory.objects.create(part_number='OTHER', warehouse='WH', location='A', quantity=9)
+
+        response = self.client.get(reverse('inventory_api:inventory-export-csv'), {'part_number_query': 'exp'})
+        self.assertEqual(self.read_csv(response), ['品番,数量', 'EXP-1,5', 'EXP-2,7'])
+        self.assertIn('attachment;', response['Content-Disposition'])
+
+    def test_stock_movement_export_without_mapping(self):
+        """マッピングが無いデータ種別はモデルの全項目を出力し、日時はインポート可能な書式になることを確認"""
+        moved_at = timezone.make_aware(timezone.datetime(2024, 5, 1, 9, 30))
+        StockMovement.objects.create(part_number='P-1', movement_type='incoming', quantity=3, movement_date=moved_at)
+
+        lines = self.read_csv(self.client.get(reverse('inventory_api:stockmovement-export-csv')))
+        self.assertEqual(len(lines), 2)
+        self.assertIn('移動日時', lines[0].split(','))
+        self.assertIn('2024-05-01 09:30:00', lines[1].split(','))
+
+    async def test_export_streams_asynchronously_under_asgi(self):
+        """ASGI では、全件を読み込まずに非同期のイテレーターで出力されることを確認"""
+        user = User(custom_id='asgi-export-user', username='asgiexportuser')
+        await User.objects.abulk_create([user])
+        await Inventory.objects.acreate(part_number='EXP-1', warehouse='WH', location='A', quantity=5)
+
+        response = await self.async_client.get(
+            reverse('inventory_api:inventory-export-csv'), headers={'Authorization': f'Bearer {AccessToken.for_user(user)}'},
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.is_async)
+        content = b''.join([chunk async for chunk in response.streaming_content]).decode('utf-8')
+        self.assertIn('EXP-1', content)
+
+
+class StockMovementPartitionTests(TestCase):
+    def test_month_boundaries(self):
+        """パーティションの月境界とテーブル名がローカル時刻の月初で計算されることを確認"""
+        month = month_start(timezone.make_aware(timezone.datetime(2024, 11, 30, 23, 59)))
+        self.assertEqual((month.year, month.month, month.day, month.hour), (2024, 11, 1, 0))
+        self.assertEqual(add_months(month, 2).strftime('%Y-%m-%d'), '2025-01-01')
+        self.assertEqual(add_months(month, -11).strftime('%Y-%m-%d'), '2023-12-01')
+        self.assertEqual(partition_name(month), 'inventory_stockmovement_p2024_11')
+
+    def test_maintenance_is_noop_without_partitioning(self):
+        """パーティション化されていないデータベース (SQLite) では何もしないことを確認"""
+        self.assertEqual(ensure_partitions(), [])
+        self.assertEqual(archive_partitions(), [])
+
+    @skipUnless(connection.vendor == 'postgresql', '宣言的パーティションは PostgreSQL のみ')
+    def test_default_partition_rows_are_split_out(self):
+        """パーティションの無い月の行が DEFAULT パーティションに保存され、月別パーティションやアーカイブへ移されることを確認"""
+        current = month_start()
+        future, past = add_months(current, 12), add_months(current, -24)
+        for month in (future, past):
+            StockMovement.objects.create(part_number='P-1', movement_type='incoming', quantity=1, movement_date=month + timedelta(days=3))
+        self.assertEqual(self.count(DEFAULT_PARTITION), 2)
+
+        created = ensure_partitions(months_ahead=0)
+        self.assertIn(partition_name(future), created)
+        self.assertIn(partition_name(past), created)
+        self.assertEqual(self.count(DEFAULT_PARTITION), 0)
+        self.assertEqual(self.count(partition_name(future)), 1)
+        self.assertEqual(archive_partitions(retention_months=12), [partition_name(past)])
+
+        # アーカイブ済みの月に遡った行はアーカイブテーブルへ移す
+        StockMovement.objects.create(part_number='P-1', movement_type='adjustment', quantity=1, movement_date=past + timedelta(days=5))
+        self.assertNotIn(partition_name(past), ensure_partitions(months_ahead=0))
+        self.assertEqual(self.count(DEFAULT_PARTITION), 0)
+        self.assertEqual(self.count(ARCHIVE_TABLE), 2)
+        self.assertEqual(StockMovement.objects.count(), 1)
+
+    def count(self, table):
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT COUNT(*) FROM {connection.ops.quote_name(table)}')
+            return cursor.fetchone()[0]
+
+
+class StockAsOfTests(APITestCase):
+    def setUp(self):
+        self.client.force_authenticate(user=User(custom_id='asof-user', username='asofuser'))
+        self.now = timezone.now()
+        self.checkpoint_at = self.now - timedelta(days=10)
+        Inventory.objects.create(part_number='P-1', warehouse='WH', location='A', quantity=10)
+        InventoryCheckpoint.objects.create(checkpoint_at=self.checkpoint_at, part_number='P-1', warehouse='WH', location='A', quantity=4)
+        for days, movement_type, quantity in [(1, 'incoming', 3), (2, 'outgoing', 1), (5, 'incoming', 2), (9.5, 'incoming', 2)]:
+            StockMovement.objects.create(
+                part_number='P-1', warehouse='WH', location='A', movement_type=movement_type, quantity=quantity,
+                movement_date=self.checkpoint_at + timedelta(days=days),
+            )
+
+    def test_replays_forward_from_nearest_checkpoint(self):
+        """照会時点の直前のスナップショットから、その後の入出庫だけを加減することを確認"""
+        results, basis = stock_as_of(self.checkpoint_at + timedelta(days=3), now=self.now)
+        self.assertEqual(basis, {'basis': 'checkpoint', 'basis_at': self.checkpoint_at})
+        self.assertEqual(results, [{'part_number': 'P-1', 'warehouse': 'WH', 'location': 'A', 'quantity': 6}])
+
+    def test_reverses_from_current_inventory(self):
+        """現在に近い時点は現在の在庫から、それ以降の入出庫を取り消して求めることを確認"""
+        results, basis = stock_as_of(self.now - timedelta(days=1), now=self.now)
+        self.assertEqual(basis['basis'], 'inventory')
+        self.assertEqual(results[0]['quantity'], 8)
+
+    def test_create_checkpoint(self):
+        """スナップショットが品番・倉庫・棚番ごとに作成され、未設定の倉庫は空文字になることを確認"""
+        Inventory.objects.create(part_number='P-2', warehouse=None, location='B', quantity=5)
+        self.assertEqual(create_checkpoint(self.now), 2)
+        self.assertEqual(
+            InventoryCheckpoint.objects.get(checkpoint_at=self.now, part_number='P-2').warehouse, ''
+        )
+
+    @override_settings(INVENTORY_CHECKPOINT_SAFETY_MARGIN_SECONDS=600)
+    def test_create_checkpoint_applies_safety_margin(self):
+        """スナップショットは安全マージン分さかのぼった時点の在庫として、それ以降の入出庫を取り消して作成されることを確認"""
+        StockMovement.objects.create(
+            part_number='P-1', warehouse='WH', location='A', movement_type='incoming', quantity=3,
+            movement_date=self.now - timedelta(minutes=1),
+        )
+        self.assertEqual(create_checkpoint(now=self.now), 1)
+        checkpoint = InventoryCheckpoint.objects.get(checkpoint_at=self.now - timedelta(minutes=10))
+        self.assertEqual(checkpoint.quantity, 7)
+
+    def test_basis_does_not_cross_archived_history(self):
+        """アーカイブ済みの期間にかかる基準は使用せず、使用できる基準が無ければ照会できないことを確認"""
+        with mock.patch('inventory.checkpoints.archived_before', return_value=self.checkpoint_at + timedelta(days=2)):
+            results, basis = stock_as_of(self.checkpoint_at + timedelta(days=3), now=self.now)
+            self.assertEqual(basis['basis'], 'inventory')
+            self.assertEqual(results[0]['quantity'], 6)
+            with self.assertRaises(StockHistoryUnavailable):
+                stock_as_of(self.checkpoint_at + timedelta(days=1), now=self.now)
+
+            url = reverse('inventory_api:inventory-as-of')
+            as_of = timezone.localtime(self.checkpoint_at + timedelta(days=1))
+            self.assertEqual(self.client.get(url, {'as_of': as_of.isoformat()}).status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_api(self):
+        url = reverse('inventory_api:inventory-as-of')
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_400_BAD_REQUEST)
+        as_of = timezone.localtime(self.checkpoint_at + timedelta(days=3))
+        response = self.client.get(url, {'as_of': as_of.isoformat(), 'part_number': 'P-1', 'warehouse': 'WH'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['basis'], 'checkpoint')
+        self.assertEqual([row['quantity'] for row in response.data['results']], [6])
+
+
+class StockMutationTests(APITestCase):
+    def setUp(self):
+        # 入出庫履歴に記録者として保存されるため、ユーザーを作成しておく (post_save のトークン作成は通さない)
+        user, = User.objects.bulk_create([User(custom_id='stock-user', username='stockuser')])
+        self.client.force_authenticate(user=user)
+
+    def test_add_stock_upserts_one_row_per_key(self):
+        """未設定と空文字の棚番を同じ在庫キーとして1行に加算することを確認"""
+        inventory_id, quantity = add_stock('P-1', 'WH', None, 5)
+        self.assertEqual(add_stock('P-1', 'WH', '', 3), (inventory_id, 8))
+        self.assertEqual(Inventory.objects.get().quantity, 8)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Inventory.objects.create(part_number='P-1', warehouse='WH', location='')
+
+    def test_remove_stock_is_conditional(self):
+        """在庫が足りない場合は減算せずに InsufficientStock を送出することを確認"""
+        add_stock('P-1', 'WH', 'A', 5)
+        with self.assertNumQueries(1):
+            remove_stock('P-1', 'WH', 'A', 5)
+        with self.assertRaises(InsufficientStock) as cm:
+            remove_stock('P-1', 'WH', 'A', 1)
+        self.assertEqual(cm.exception.current_quantity, 0)
+        with self.assertRaises(InsufficientStock):
+            remove_stock('P-2', 'WH', 'A', 1)
+
+    def test_move(self):
+        """棚番移動で移動元を減算・移動先に加算し、履歴と在庫集計が更新されることを確認"""
+        source = Inventory.objects.create(part_number='P-1', warehouse='WH', location='A', quantity=10)
+        Inventory.objects.create(part_number='P-1', warehouse='WH2', location='B', quantity=1)
+        url = reverse('inventory_api:inventory-move', args=[source.pk])
+        response = self.client.post(url, {'quantity_to_move': 4, 'target_warehouse': 'WH2', 'target_location': 'B'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            sorted(Inventory.objects.values_list('warehouse', 'quantity')), [('WH', 6), ('WH2', 5)]
+        )
+        self.assertEqual(StockMovement.objects.count(), 2)
+        self.assertEqual(StockSummary.objects.get(part_number='P-1', warehouse='WH2').quantity, 5)
+
+        response = self.client.post(url, {'quantity_to_move': 7, 'target_warehouse': 'WH2'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_duplicate_stock_key_is_rejected(self):
+        """在庫キーが重複する登録・更新は 500 ではなく 400 を返すことを確認"""
+        Inventory.objects.create(part_number='P-1', warehouse='WH', quantity=1)
+        other = Inventory.objects.create(part_number='P-1', warehouse='WH', location='B', quantity=1)
+        url = reverse('inventory_api:inventory-list')
+        response = self.client.post(url, {'part_number': 'P-1', 'warehouse': 'WH', 'location': '', 'quantity': 2}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        detail_url = reverse('inventory_api:inventory-detail', args=[other.pk])
+        self.assertEqual(self.client.patch(detail_url, {'location': None}, format='json').status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.patch(detail_url, {'quantity': 3}, format='json').status_code, status.HTTP_200_OK)
+
+
+class FacetTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.client.force_authenticate(user=User(custom_id='facet-user', username='facetuser'))
+        for i, (supplier, status_value) in enumerate([('S-1', 'pending'), ('S-1', 'pending'), ('S-2', 'fully_received'), ('', 'pending')]):
+            PurchaseOrder.objects.create(order_number=f'FPO-{i}', supplier=supplier or None, status=status_value, quantity=1)
+        self.url = reverse('inventory_api:purchaseorder-facets')
+
+    def test_counts_several_fields_in_one_query(self):
+        """複数項目の値ごとの件数を1回のクエリで集計し、一覧と同じ絞り込み条件を適用することを確認"""
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url, {'fields': 'supplier,status', 'search_status': 'pending'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, {
+            'supplier': [{'value': 'S-1', 'count': 2}],
+            'status': [{'value': 'pending', 'count': 3}],
+        })
+
+    def test_cached_until_invalidated(self):
+        """2回目はキャッシュから返し、発注の保存後のコミットで無効化されることを確認"""
+        self.client.get(self.url, {'fields': 'supplier'})
+        with self.assertNumQueries(0):
+            self.client.get(self.url, {'fields': 'supplier'})
+        with self.captureOnCommitCallbacks(execute=True):
+            PurchaseOrder.objects.create(order_number='FPO-9', supplier='S-3', quantity=1)
+        response = self.client.get(self.url, {'fields': 'supplier'})
+        self.assertEqual([item['value'] for item in response.data['supplier']], ['S-1', 'S-2', 'S-3'])
+
+    def test_invalid_field(self):
+        response = self.client.get(self.url, {'fields': 'remarks1'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_distinct_values(self):
+        """distinct-values が従来どおり空・NULLを除いたソート済みの値のリストを返すことを確認"""
+        response = self.client.get(reverse('inventory_api:purchaseorder-distinct-values'), {'field': 'supplier'})
+        self.assertEqual(response.data, ['S-1', 'S-2'])
+
+
+class InventoryByLocationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        user = User(custom_id='location-user', username='locationuser')
+        User.objects.bulk_create([user])
+        self.auth = {'HTTP_AUTHORIZATION': f'Bearer {AccessToken.for_user(user)}'}
+
+    def test_by_location(self):
+        """非同期ビューが在庫のある品番を品番順に返し、パラメータ不足・未認証を拒否することを確認"""
+        Inventory.objects.create(part_number='B', warehouse='WH', location='A-1', quantity=2)
+        Inventory.objects.create(part_number='A', warehouse='WH', location='A-1', quantity=5)
+        Inventory.objects.create(part_number='C', warehouse='WH', location='A-1', quantity=0)
+        Inventory.objects.create(part_number='D', warehouse='WH', location='B-1', quantity=1)
+
+        url = reverse('inventory_api:inventory-by-location')
+        response = self.client.get(url, {'warehouse': 'WH', 'location': 'A-1'}, **self.auth)
+        self.assertEqual([row['part_number'] for row in response.json()], ['A', 'B'])
+        self.assertEqual(response.json()[0]['available_quantity'], 5)
+
+        self.assertEqual(self.client.get(url, {'warehouse': 'WH'}, **self.auth).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.get(url, {'warehouse': 'WH', 'location': 'A-1'}).status_code, status.HTTP_401_UNAUTHORIZED)
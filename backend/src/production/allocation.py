@@ -0,0 +1,295 @@
+"""
+Set-based material allocation for production plans.
+
+All Inventory rows needed by a request are locked with a single
+SELECT ... FOR UPDATE ordered by primary key, so concurrent allocators always
+acquire locks in the same order and cannot deadlock. Availability is checked in
+memory, and the results are written with one bulk_update (Inventory.reserved)
+and one bulk_create each for MaterialAllocation and the internal SalesOrder rows.
+
+`run_allocation` applies the same approach to many production plans at once
+(an MRP-style allocation run), so the cost does not grow with one round trip per plan.
+"""
+from collections import defaultdict
+
+from django.db.models import Q, Sum
+from django.utils import timezone
+
+from base.facets import invalidate_facets
+from inventory.models import Inventory, SalesOrder
+from inventory.services import refresh_stock_summary
+from .models import MaterialAllocation, PartsUsed
+
+
+class AllocationError(ValueError):
+    """Raised when one or more allocation lines cannot be fulfilled. The transaction must be rolled back."""
+
+    def __init__(self, errors):
+        super().__init__("Errors occurred during allocation process. Transaction rolled back.")
+        self.errors = errors
+
+
+def parse_allocation_lines(allocations_data):
+    """
+    Validates the raw request lines.
+    Returns (lines, errors) where lines is a list of (part_number, warehouse, quantity).
+    Lines with a quantity of 0 are skipped, as before.
+    """
+    lines = []
+    errors = []
+    for alloc_item_data in allocations_data:
+        part_number = alloc_item_data.get('part_number')
+        warehouse = alloc_item_data.get('warehouse')
+        quantity_to_allocate = alloc_item_data.get('quantity_to_allocate')
+
+        if not all([part_number, warehouse, quantity_to_allocate is not None]):
+            errors.append(f"Missing data for allocation item (part_number, warehouse, or quantity_to_allocate): {alloc_item_data}")
+            continue
+
+        try:
+            quantity_to_allocate = int(quantity_to_allocate)
+        except (TypeError, ValueError):
+            errors.append(f"Invalid quantity for {part_number}.")
+            continue
+        if quantity_to_allocate < 0:
+            errors.append(f"Quantity to allocate must be non-negative for {part_number}.")
+            continue
+        if quantity_to_allocate == 0:
+            continue
+        lines.append((part_number, warehouse, quantity_to_allocate))
+    return lines, errors
+
+
+def lock_inventory(keys):
+    """
+    Locks every Inventory row for the given (part_number, warehouse) keys in one query, ordered by pk.
+    Returns {(part_number, warehouse): [Inventory, ...]}.
+    """
+    if not keys:
+        return {}
+    condition = Q(*[Q(part_number=part_number, warehouse=warehouse) for part_number, warehouse in keys], _connector=Q.OR)
+    rows = defaultdict(list)
+    for inventory_item in Inventory.objects.select_for_update().filter(condition).order_by('pk'):
+        rows[(inventory_item.part_number, inventory_item.warehouse)].append(inventory_item)
+    return rows
+
+
+def reserve_from_rows(inventory_items, quantity):
+    """
+    Reserves quantity across the allocatable rows of one part/warehouse, in pk order, in memory.
+    Returns the rows that were changed. The caller must have checked the total available quantity.
+    """
+    changed = []
+    remaining = quantity
+    for inventory_item in inventory_items:
+        if remaining <= 0:
+            break
+        take = min(inventory_item.available_quantity, remaining)
+        if take <= 0:
+            continue
+        inventory_item.reserved += take
+        remaining -= take
+        changed.append(inventory_item)
+    return changed
+
+
+def allocate_lines(production_plan, lines, locked_rows=None):
+    """
+    Allocates the given lines for a production plan. Must be called inside transaction.atomic().
+
+    lines is a list of (part_number, warehouse, quantity). locked_rows may be passed when the
+    caller has already locked the inventory (see lock_inventory); otherwise it is locked here.
+    Raises AllocationError if any line cannot be fulfilled, otherwise returns the per-line summary
+    in the same shape as the allocate-materials response.
+    """
+    if locked_rows is None:
+        locked_rows = lock_inventory({(part_number, warehouse) for part_number, warehouse, _ in lines})
+
+    errors = []
+    changed_inventory = {}
+    allocations = []
+    for part_number, warehouse, quantity in lines:
+        inventory_items = locked_rows.get((part_number, warehouse))
+        if not inventory_items:
+            errors.append(f"Inventory not found for part '{part_number}' in warehouse '{warehouse}'.")
+            continue
+        if not any(item.is_active and item.is_allocatable for item in inventory_items):
+            errors.append(f"Inventory for part '{part_number}' in warehouse '{warehouse}' is not active or allocatable.")
+            continue
+
+        available = sum(item.available_quantity for item in inventory_items)
+        if available < quantity:
+            errors.append(
+                f"Insufficient available stock for part '{part_number}' in warehouse '{warehouse}'. "
+                f"Required: {quantity}, Available: {available}"
+            )
+            continue
+
+        for inventory_item in reserve_from_rows(inventory_items, quantity):
+            changed_inventory[inventory_item.pk] = inventory_item
+        allocations.append((production_plan, part_number, warehouse, quantity, inventory_items))
+
+    if errors:
+        raise AllocationError(errors)
+
+    return write_allocations(allocations, changed_inventory.values())
+
+
+def write_allocations(allocations, changed_inventory):
+    """
+    Persists reservations and creates the MaterialAllocation and internal SalesOrder rows in bulk.
+    allocations is a list of (production_plan, part_number, warehouse, quantity, inventory_items).
+    """
+    changed_inventory = list(changed_inventory)
+    if changed_inventory:
+        Inventory.objects.bulk_update(changed_inventory, ['reserved'])
+        # last_updated is the same for every row, so set it with a plain UPDATE instead of a second CASE column
+        Inventory.objects.filter(pk__in=[item.pk for item in changed_inventory]).update(last_updated=timezone.now())
+        # bulk_update does not send post_save, so refresh the stock summary explicitly
+        refresh_stock_summary({inventory_item.part_number for inventory_item in changed_inventory})
+
+    material_allocations = []
+    sales_orders = []
+    for production_plan, part_number, warehouse, quantity, _ in allocations:
+        material_allocation = MaterialAllocation(
+            production_plan=production_plan,
+            material_code=part_number,
+            allocated_quantity=quantity,
+            status='ALLOCATED'
+        )
+        material_allocations.append(material_allocation)
+        # SalesOrder for this material allocation to put it on the shipment schedule
+        sales_orders.append(SalesOrder(
+            order_number=f"INT-{material_allocation.id.hex[:15]}",
+            item=part_number,
+            quantity=quantity,
+            warehouse=warehouse,
+            expected_shipment=production_plan.planned_start_datetime,
+            status='pending'
+        ))
+    MaterialAllocation.objects.bulk_create(material_allocations)
+    SalesOrder.objects.bulk_create(sales_orders)
+    # bulk_create/bulk_update do not send post_save either; the facet caches are invalidated once the transaction commits
+    if changed_inventory:
+        invalidate_facets(Inventory)
+    if sales_orders:
+        invalidate_facets(SalesOrder)
+
+    summary = []
+    for (_, part_number, warehouse, quantity, inventory_items), material_allocation, sales_order in zip(
+        allocations, material_allocations, sales_orders
+    ):
+        summary.append({
+            "part_number": part_number,
+            "warehouse": warehouse,
+            "allocated_quantity": quantity,
+            "material_allocation_id": material_allocation.id,
+            "new_inventory_reserved": sum(item.reserved for item in inventory_items),
+            "new_inventory_available": sum(item.available_quantity for item in inventory_items),
+            "sales_order_id": sales_order.id,
+            "sales_order_number": sales_order.order_number
+        })
+    return summary
+
+
+def run_allocation(plans, dry_run=False):
+    """
+    Allocates the outstanding PartsUsed requirements of many production plans in one locked pass.
+
+    plans must be ordered by priority (earliest planned start first); stock goes to earlier plans first.
+    Each line's outstanding quantity is its quantity_used minus what is already allocated to the plan
+    for that part, so a run can be repeated safely. Lines with a warehouse are allocated from that
+    warehouse only; lines without one may draw from any warehouse. Partial allocation is allowed and
+    any remainder is reported as a shortage. With dry_run=True nothing is locked or written.
+
+    Returns (report, allocations_created) where report is a list of per-plan dicts.
+    Must be called inside transaction.atomic() unless dry_run is set.
+    """
+    plans = [plan for plan in plans if plan.production_plan]
+    if not plans:
+        return [], 0
+
+    # One query for the BOM lines of every plan, one for what is already allocated.
+    lines_by_identifier = defaultdict(list)
+    for part_used in PartsUsed.objects.filter(
+        production_plan__in={plan.production_plan for plan in plans}
+    ).order_by('part_code', 'pk'):
+        lines_by_identifier[part_used.production_plan].append(part_used)
+
+    already_allocated = {
+        (row['production_plan_id'], row['material_code']): row['total_allocated']
+        for row in MaterialAllocation.objects.filter(
+            production_plan__in=[plan.pk for plan in plans]
+        ).values('production_plan_id', 'material_code').annotate(
+            total_allocated=Sum('allocated_quantity')
+        ).order_by()
+    }
+
+    part_numbers = {line.part_code for lines in lines_by_identifier.values() for line in lines}
+    inventory_qs = Inventory.objects.filter(part_number__in=part_numbers).order_by('pk')
+    if not dry_run:
+        inventory_qs = inventory_qs.select_for_update()
+    rows_by_key = defaultdict(list)
+    rows_by_part = defaultdict(list)
+    for inventory_item in inventory_qs:
+        rows_by_key[(inventory_item.part_number, inventory_item.warehouse)].append(inventory_item)
+        rows_by_part[inventory_item.part_number].append(inventory_item)
+    for rows in rows_by_part.values():
+        # Lines without a warehouse consume warehouses in a stable order
+        rows.sort(key=lambda item: (item.warehouse or '', item.pk))
+
+    report = []
+    allocations = []
+    changed_inventory = {}
+    for plan in plans:
+        remaining_allocated = {}
+        plan_lines = []
+        for line in lines_by_identifier.get(plan.production_plan, []):
+            allocated_before = remaining_allocated.setdefault(
+                line.part_code, already_allocated.get((plan.pk, line.part_code), 0)
+            )
+            covered = min(allocated_before, line.quantity_used)
+            remaining_allocated[line.part_code] = allocated_before - covered
+            outstanding = line.quantity_used - covered
+
+            allocated_now = 0
+            if outstanding > 0:
+                if line.warehouse:
+                    candidates = rows_by_key.get((line.part_code, line.warehouse), [])
+                else:
+                    candidates = rows_by_part.get(line.part_code, [])
+                # Group the consumed rows by warehouse: each warehouse becomes its own allocation / SalesOrder
+                portions = defaultdict(int)
+                for inventory_item in candidates:
+                    if allocated_now >= outstanding:
+                        break
+                    take = min(inventory_item.available_quantity, outstanding - allocated_now)
+                    if take <= 0:
+                        continue
+                    inventory_item.reserved += take
+                    allocated_now += take
+                    portions[inventory_item.warehouse] += take
+                    changed_inventory[inventory_item.pk] = inventory_item
+                for warehouse, quantity in portions.items():
+                    allocations.append((plan, line.part_code, warehouse, quantity, rows_by_key[(line.part_code, warehouse)]))
+
+            plan_lines.append({
+                "part_code": line.part_code,
+                "warehouse": line.warehouse,
+                "required_quantity": line.quantity_used,
+                "already_allocated_quantity": covered,
+                "allocated_quantity": allocated_now,
+                "shortage_quantity": outstanding - allocated_now,
+            })
+
+        report.append({
+            "production_plan_id": plan.pk,
+            "plan_name": plan.plan_name,
+            "planned_start_datetime": plan.planned_start_datetime,
+            "fully_allocated": all(line["shortage_quantity"] == 0 for line in plan_lines),
+            "lines": plan_lines,
+        })
+
+    if not dry_run and allocations:
+        write_allocations(allocations, changed_inventory.values())
+    return report, len(allocations)
@@ -0,0 +1,33 @@
+# Generated by Django 5.1.7 on 2026-10-18 19:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('production', '0005_workprogress_actual_reported_quantity_and_more'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='materialallocation',
+            index=models.Index(fields=['production_plan', 'material_code'], name='matalloc_plan_material_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='materialallocation',
+            index=models.Index(fields=['material_code'], name='matalloc_material_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='partsused',
+            index=models.Index(fields=['production_plan', 'part_code'], name='partsused_plan_part_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='productionplan',
+            index=models.Index(fields=['status', 'planned_start_datetime'], name='plan_status_start_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='productionplan',
+            index=models.Index(fields=['-planned_start_datetime'], name='plan_start_idx'),
+        ),
+    ]
@@ -52,6 +52,11 @@ class ProductionPlan(models.Model):
         verbose_name = "生産計画"
         verbose_name_plural = "生産計画"
         ordering = ['-planned_start_datetime']
+        indexes = [
+            # 一覧の既定の並び順と、引当実行でのステータス・開始日時による絞り込み
+            models.Index(fields=['status', 'planned_start_datetime'], name='plan_status_start_idx'),
+            models.Index(fields=['-planned_start_datetime'], name='plan_start_idx'),
+        ]
 
 class PartsUsed(models.Model):
     """
@@ -90,6 +95,10 @@ class PartsUsed(models.Model):
         verbose_name = "使用部品"
         verbose_name_plural = "使用部品"
         ordering = ['-used_datetime']
+        indexes = [
+            # 生産計画識別子ごとの部品一覧 (required_parts, 引当実行)
+            models.Index(fields=['production_plan', 'part_code'], name='partsused_plan_part_idx'),
+        ]
 
 class MaterialAllocation(models.Model):
     """
@@ -125,6 +134,11 @@ class MaterialAllocation(models.Model):
         verbose_name = "材料引当"
         verbose_name_plural = "材料引当"
         ordering = ['-allocation_datetime']
+        indexes = [
+            # 計画・材料ごとの引当済数量の集計
+            models.Index(fields=['production_plan', 'material_code'], name='matalloc_plan_material_idx'),
+            models.Index(fields=['material_code'], name='matalloc_material_idx'),
+        ]
 
 class WorkProgress(models.Model):
     """
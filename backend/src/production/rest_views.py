@@ -6,30 +6,44 @@ from rest_framework.decorators import action # actionデコレータをインポ
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response # Responseをインポート
 from .models import ProductionPlan, PartsUsed, MaterialAllocation, WorkProgress
+from .allocation import AllocationError, allocate_lines, parse_allocation_lines, run_allocation
 from .serializers import (
     ProductionPlanSerializer, PartsUsedSerializer, RequiredPartSerializer,
     MaterialAllocationSerializer, WorkProgressSerializer
 )
+from base.pagination import CountModePaginationMixin
+from base.query_inspection import QueryBudgetMixin
 from inventory.rest_views import StandardResultsSetPagination # inventoryアプリのページネーションクラスをインポート
-from django.db.models import Q # Qオブジェクトをインポート
-from inventory.models import Inventory, StockMovement, SalesOrder # Add StockMovement and SalesOrder
+from django.db.models import Q, Sum # Qオブジェクトをインポート
+from inventory.models import StockMovement, SalesOrder, StockSummary # Add StockMovement and SalesOrder
+from inventory.services import refresh_stock_summary
+from inventory.stock import InsufficientStock, add_stock, remove_stock, stock_location
 from rest_framework.filters import OrderingFilter # OrderingFilterをインポート
 from django.utils.dateparse import parse_datetime # 日時文字列のパース用
 from django.utils import timezone # timezoneをインポート
 from django.db import transaction # トランザクションのためにインポート
+import logging
 # from .models import Product, BillOfMaterialItem # BOMに関連するモデル (仮のインポート、実際には適切なモデルを定義・インポートしてください)
 # from .serializers import RequiredPartSerializer # BOM部品用のシリアライザ (仮のインポート)
 
+logger = logging.getLogger(__name__)
+
 # Define a constant for the default finished goods warehouse
 DEFAULT_FINISHED_GOODS_WAREHOUSE = "FG-MAIN" # TODO: Make this configurable
 
 # Define a pagination class specifically for Production Plans API
-class ProductionPlanApiPagination(PageNumberPagination):
+class ProductionPlanApiPagination(CountModePaginationMixin, PageNumberPagination):
     page_size = 100  # Default number of items per page
     page_size_query_param = 'page_size'  # Allow client to override page_size via query param
     max_page_size = 200  # Maximum page size allowed
 
-class ProductionPlanViewSet(viewsets.ModelViewSet):
+    def get_paginated_response(self, data):
+        response = super().get_paginated_response(data)
+        # Tells the client whether 'count' is exact (see ?count=exact|estimate|none)
+        response.data['count_is_exact'] = self.page.paginator.count_is_exact
+        return response
+
+class ProductionPlanViewSet(QueryBudgetMixin, viewsets.ModelViewSet):
     """
     API endpoint that allows Production Plans to be viewed or created.
     """
@@ -42,6 +56,7 @@ class ProductionPlanViewSet(viewsets.ModelViewSet):
         'planned_start_datetime', 'status'
     ] # ソート可能なフィールドを指定
     ordering = ['-planned_start_datetime'] # デフォルトのソート順
+    query_budget = {'list': 2, 'retrieve': 1} # Queries per request after authentication, enforced in tests (see base.query_inspection)
 
     def get_queryset(self):
         queryset = ProductionPlan.objects.all() # Start with all objects
@@ -110,63 +125,47 @@ class ProductionPlanViewSet(viewsets.ModelViewSet):
             }, status=404)
 
         # Query PartsUsed based on this string identifier
-        parts_used_queryset = PartsUsed.objects.filter(production_plan=plan_identifier_for_parts)
+        parts_used_items = list(PartsUsed.objects.filter(production_plan=plan_identifier_for_parts))
 
-        if not parts_used_queryset.exists():
+        if not parts_used_items:
             return Response({
                 "detail": f"生産計画 '{production_plan_instance.plan_name}' (ID: {production_plan_instance.id}) の参照識別子 '{plan_identifier_for_parts}' に紐づく使用部品情報は見つかりませんでした。"
             }, status=404)
 
+        part_codes = {item.part_code for item in parts_used_items}
+
+        # Available stock per (part, warehouse) from the maintained stock summary, in one query.
+        # StockSummary.available already excludes inactive / non-allocatable inventory rows.
+        available_by_warehouse = {}
+        available_by_part = {}
+        for part_code, warehouse, available in StockSummary.objects.filter(
+            part_number__in=part_codes
+        ).values_list('part_number', 'warehouse', 'available'):
+            available_by_warehouse[(part_code, warehouse)] = available
+            available_by_part[part_code] = available_by_part.get(part_code, 0) + available
+
+        # Quantity already allocated to this plan per material, in one grouped query.
+        allocated_by_part = dict(
+            MaterialAllocation.objects.filter(
+                production_plan=production_plan_instance,
+                material_code__in=part_codes
+            ).values('material_code').annotate(
+                total_allocated=Sum('allocated_quantity')
+            ).order_by().values_list('material_code', 'total_allocated')
+        )
+
         # Prepare data for the RequiredPartSerializer
         data_for_serializer = []
-        from django.db.models import Sum # Ensure Sum is imported
-        for part_used_item in parts_used_queryset:
+        for part_used_item in parts_used_items:
             part_code = part_used_item.part_code
             part_specific_warehouse = part_used_item.warehouse # Warehouse from PartsUsed
-            current_inventory_quantity = 0
 
             if part_specific_warehouse:
-                # If a specific warehouse is designated for the part, get inventory from that warehouse.
-                try:
-                    inventory_item = Inventory.objects.get(
-                        part_number=part_code,
-                        warehouse=part_specific_warehouse,
-                        is_active=True,
-                        is_allocatable=True
-                    )
-                    current_inventory_quantity = inventory_item.available_quantity
-                except Inventory.DoesNotExist:
-                    current_inventory_quantity = 0
-                except Inventory.MultipleObjectsReturned:
-                    # This case implies multiple inventory entries for the same part in the same warehouse.
-                    # Summing them up is a safe approach.
-                    inventory_items = Inventory.objects.filter(
-                        part_number=part_code,
-                        warehouse=part_specific_warehouse,
-                        is_active=True,
-                        is_allocatable=True
-                    )
-                    for inv_item in inventory_items:
-                        current_inventory_quantity += inv_item.available_quantity
-                    if inventory_items.count() > 1:
-                        print(f"Warning: Multiple inventory records found for part {part_code} in warehouse {part_specific_warehouse}. Summing quantities.")
+                # If a specific warehouse is designated for the part, use inventory from that warehouse.
+                current_inventory_quantity = available_by_warehouse.get((part_code, part_specific_warehouse), 0)
             else:
-                # If no specific warehouse is designated for the part in PartsUsed,
-                # sum available inventory from all warehouses for that part.
-                inventory_items = Inventory.objects.filter(
-                    part_number=part_code,
-                    is_active=True,
-                    is_allocatable=True
-                )
-                for inv_item in inventory_items:
-                    current_inventory_quantity += inv_item.available_quantity
-
-            # Calculate already allocated quantity for this part for the current production plan
-            already_allocated_for_part = MaterialAllocation.objects.filter(
-                production_plan=production_plan_instance, # The specific plan instance for the popup
-                material_code=part_code
-            ).aggregate(total_allocated=Sum('allocated_quantity'))['total_allocated'] or 0
-
+                # Otherwise, sum available inventory from all warehouses for that part.
+                current_inventory_quantity = available_by_part.get(part_code, 0)
 
             data_for_serializer.append({
                 "part_code": part_code,
@@ -175,7 +174,7 @@ class ProductionPlanViewSet(viewsets.ModelViewSet):
                 "unit": "個",  # Placeholder for unit, e.g., '個' (pieces)
                 "inventory_quantity": current_inventory_quantity,
                 "warehouse": part_specific_warehouse,
-                "already_allocated_quantity": already_allocated_for_part
+                "already_allocated_quantity": allocated_by_part.get(part_code, 0)
             })
 
         serializer = RequiredPartSerializer(data=data_for_serializer, many=True)
@@ -197,102 +196,17 @@ class ProductionPlanViewSet(viewsets.ModelViewSet):
         if not allocations_data:
             return Response({"error": "Allocations list cannot be empty."}, status=status.HTTP_400_BAD_REQUEST)
 
-        processed_allocations_summary = []
-        errors = []
+        # Lines are validated first, then allocated in one locked, set-based pass (see production.allocation).
+        lines, errors = parse_allocation_lines(allocations_data)
 
         try:
             with transaction.atomic():
-                for alloc_item_data in allocations_data:
-                    part_number = alloc_item_data.get('part_number')
-                    warehouse = alloc_item_data.get('warehouse')
-                    quantity_to_allocate = alloc_item_data.get('quantity_to_allocate')
-
-                    if not all([part_number, warehouse, quantity_to_allocate is not None]):
-                        errors.append(f"Missing data for allocation item (part_number, warehouse, or quantity_to_allocate): {alloc_item_data}")
-                        continue
-                    
-                    try:
-                        quantity_to_allocate = int(quantity_to_allocate)
-                        if quantity_to_allocate <= 0:
-                            # Allow 0 for cases where user explicitly sets it, but skip processing
-                            if quantity_to_allocate < 0:
-                                errors.append(f"Quantity to allocate must be non-negative for {part_number}.")
-                            continue # Skip if 0 or negative after explicit error for < 0
-                    except ValueError:
-                        errors.append(f"Invalid quantity for {part_number}.")
-                        continue
-
-                    try:
-                        inventory_item = Inventory.objects.select_for_update().get(
-                            part_number=part_number,
-                            warehouse=warehouse
-                        )
-                    except Inventory.DoesNotExist:
-                        errors.append(f"Inventory not found for part '{part_number}' in warehouse '{warehouse}'.")
-                        continue
-                    
-                    if not inventory_item.is_active or not inventory_item.is_allocatable:
-                        errors.append(f"Inventory for part '{part_number}' in warehouse '{warehouse}' is not active or allocatable.")
-                        continue
-
-                    if inventory_item.available_quantity < quantity_to_allocate:
-                        errors.append(
-                            f"Insufficient available stock for part '{part_number}' in warehouse '{warehouse}'. "
-                            f"Required: {quantity_to_allocate}, Available: {inventory_item.available_quantity}"
-                        )
-                        continue
-
-                    # Reserve inventory
-                    inventory_item.reserved += quantity_to_allocate
-                    inventory_item.save()
-
-                    # Create MaterialAllocation record
-                    material_allocation = MaterialAllocation.objects.create(
-                        production_plan=production_plan,
-                        material_code=part_number, 
-                        allocated_quantity=quantity_to_allocate,
-                        status='ALLOCATED' 
-                    )
-
-                    # Create SalesOrder for this material allocation to put it on the shipment schedule
-                    so_order_number = f"INT-{material_allocation.id.hex[:15]}"
-
-                    sales_order, so_created = SalesOrder.objects.get_or_create(
-                        order_number=so_order_number,
-                        defaults={
-                            'item': material_allocation.material_code, # This is part_number
-                            'quantity': material_allocation.allocated_quantity,
-                            'warehouse': warehouse, # Warehouse from the allocation request
-                            'expected_shipment': production_plan.planned_start_datetime,
-                            'status': 'pending'
-                        }
-                    )
-
-                    if not so_created:
-                        # This case should ideally not happen if so_order_number is truly unique
-                        # based on material_allocation.id.hex.
-                        # If it occurs, it might indicate an issue with the uniqueness strategy
-                        # or a retry of a partially failed previous operation.
-                        # For now, log a warning. If updates are needed, logic would go here.
-                        print(f"Warning: SalesOrder with order_number {so_order_number} already existed. Item: {sales_order.item}, Qty: {sales_order.quantity}") # noqa: E501
-                        # Potentially update if logic requires:
-                        # sales_order.quantity = material_allocation.allocated_quantity
-                        # sales_order.item = material_allocation.material_code # etc.
-                        # sales_order.save()
-
-                    processed_allocations_summary.append({
-                        "part_number": part_number,
-                        "warehouse": warehouse,
-                        "allocated_quantity": quantity_to_allocate,
-                        "material_allocation_id": material_allocation.id,
-                        "new_inventory_reserved": inventory_item.reserved, # noqa: E501
-                        "new_inventory_available": inventory_item.available_quantity, # noqa: E501
-                        "sales_order_id": sales_order.id,
-                        "sales_order_number": sales_order.order_number
-                    })
-
+                try:
+                    processed_allocations_summary = allocate_lines(production_plan, lines)
+                except AllocationError as e:
+                    errors.extend(e.errors)
                 if errors:
-                    raise ValueError("Errors occurred during allocation process. Transaction rolled back.")
+                    raise AllocationError(errors)
 
             return Response({
                 "message": "Materials allocated successfully for production plan.",
@@ -300,11 +214,48 @@ class ProductionPlanViewSet(viewsets.ModelViewSet):
                 "allocations_summary": processed_allocations_summary
             }, status=status.HTTP_200_OK)
 
-        except ValueError as e:
-            return Response({"error": str(e), "details": errors}, status=status.HTTP_400_BAD_REQUEST)
+        except AllocationError as e:
+            return Response({"error": str(e), "details": e.errors}, status=status.HTTP_400_BAD_REQUEST)
         except Exception as e:
             return Response({"error": "An unexpected error occurred during material allocation.", "detail": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+    @action(detail=False, methods=['post'], url_path='allocation-run')
+    def allocation_run(self, request):
+        """
+        Allocates materials for many production plans in one pass (MRP-style).
+        Body: status__in (comma-separated, default 'PENDING'), planned_start_datetime_after,
+        planned_start_datetime_before, dry_run (bool). Plans are served earliest start first.
+        Returns a per-plan shortage report.
+        """
+        statuses = [s.strip() for s in str(request.data.get('status__in') or 'PENDING').split(',') if s.strip()]
+        filters = Q(status__in=statuses, production_plan__isnull=False) & ~Q(production_plan='')
+        for param, lookup in (
+            ('planned_start_datetime_after', 'planned_start_datetime__gte'),
+            ('planned_start_datetime_before', 'planned_start_datetime__lte'),
+        ):
+            value = request.data.get(param)
+            if value:
+                parsed = parse_datetime(str(value))
+                if parsed is None:
+                    return Response({"error": f"Invalid datetime for {param}."}, status=status.HTTP_400_BAD_REQUEST)
+                filters &= Q(**{lookup: parsed})
+        dry_run = str(request.data.get('dry_run', False)).lower() in ('true', '1')
+
+        plans = ProductionPlan.objects.filter(filters).order_by('planned_start_datetime', 'created_at', 'id')
+        try:
+            with transaction.atomic():
+                report, allocations_created = run_allocation(plans, dry_run=dry_run)
+        except Exception as e:
+            return Response({"error": "An unexpected error occurred during the allocation run.", "detail": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        return Response({
+            "dry_run": dry_run,
+            "plans_processed": len(report),
+            "plans_with_shortage": sum(1 for plan_report in report if not plan_report["fully_allocated"]),
+            "allocations_created": 0 if dry_run else allocations_created,
+            "plans": report,
+        }, status=status.HTTP_200_OK)
+
     @action(detail=True, methods=['post'], url_path='update-progress')
     def update_progress(self, request, pk=None):
         """
@@ -422,42 +373,41 @@ class ProductionPlanViewSet(viewsets.ModelViewSet):
                         quantity_to_reverse = previous_wp_completed_quantity # This is the good quantity previously completed
                         warehouse_to_reverse_from = DEFAULT_FINISHED_GOODS_WAREHOUSE
 
+                        # Single conditional UPDATE: only deducts when enough stock is on hand.
+                        # Finished goods are tracked per warehouse, so use the existing row whatever its location.
+                        location_to_reverse_from = stock_location(product_code_to_reverse, warehouse_to_reverse_from)
                         try:
-                            inventory_item_to_reverse = Inventory.objects.select_for_update().get(
-                                part_number=product_code_to_reverse,
-                                warehouse=warehouse_to_reverse_from
-                            )
-
-                            if inventory_item_to_reverse.quantity < quantity_to_reverse:
+                            remove_stock(product_code_to_reverse, warehouse_to_reverse_from, location_to_reverse_from, quantity_to_reverse)
+                        except InsufficientStock as e:
+                            if e.current_quantity is None:
                                 raise ValueError(
-                                    f"Cannot reverse production for {product_code_to_reverse} in {warehouse_to_reverse_from}. "
-                                    f"Required to deduct: {quantity_to_reverse}, Current stock: {inventory_item_to_reverse.quantity}."
+                                    f"Inventory for product {product_code_to_reverse} in warehouse {warehouse_to_reverse_from} not found for reversal."
                                 )
-                            
-                            inventory_item_to_reverse.quantity -= quantity_to_reverse
-                            inventory_item_to_reverse.save()
-
-                            StockMovement.objects.create(
-                                part_number=product_code_to_reverse,
-                                quantity=quantity_to_reverse, 
-                                warehouse=warehouse_to_reverse_from,
-                                movement_type='PRODUCTION_REVERSAL', # New movement type
-                                movement_date=now,
-                                reference_document=f"Reversal for PPlan-{plan.id}",
-                                description=f"Prod. completion reversed for plan {plan.id} (status: {old_plan_status} -> {new_status}).",
-                                operator=request.user if request.user.is_authenticated else None
+                            raise ValueError(
+                                f"Cannot reverse production for {product_code_to_reverse} in {warehouse_to_reverse_from}. "
+                                f"Required to deduct: {quantity_to_reverse}, Current stock: {e.current_quantity}."
                             )
-                            print(f"Inventory reversed for {product_code_to_reverse} in {warehouse_to_reverse_from}. Deducted: {quantity_to_reverse}. New QOH: {inventory_item_to_reverse.quantity}")
+                        refresh_stock_summary({product_code_to_reverse})
 
-                            # Reset WorkProgress quantities as the completion is undone
-                            work_progress.quantity_completed = 0
-                            work_progress.actual_reported_quantity = None # Or 0, depending on desired behavior
-                            work_progress.defective_reported_quantity = None # Or 0
+                        StockMovement.objects.create(
+                            part_number=product_code_to_reverse,
+                            quantity=quantity_to_reverse, 
+                            warehouse=warehouse_to_reverse_from,
+                            movement_type='PRODUCTION_REVERSAL', # New movement type
+                            movement_date=now,
+                            reference_document=f"Reversal for PPlan-{plan.id}",
+                            description=f"Prod. completion reversed for plan {plan.id} (status: {old_plan_status} -> {new_status}).",
+                            operator=request.user if request.user.is_authenticated else None
+                        )
+                        logger.info(
+                            "Inventory reversed for %s in %s. Deducted: %s.",
+                            product_code_to_reverse, warehouse_to_reverse_from, quantity_to_reverse,
+                        )
 
-                        except Inventory.DoesNotExist:
-                            raise ValueError(
-                                f"Inventory for product {product_code_to_reverse} in warehouse {warehouse_to_reverse_from} not found for reversal."
-                            )
+                        # Reset WorkProgress quantities as the completion is undone
+                        work_progress.quantity_completed = 0
+                        work_progress.actual_reported_quantity = None # Or 0, depending on desired behavior
+                        work_progress.defective_reported_quantity = None # Or 0
                 
                 plan.save()
                 work_progress.save() # Save work_progress after potential quantity resets or updates
@@ -478,33 +428,20 @@ class ProductionPlanViewSet(viewsets.ModelViewSet):
                     if quantity_to_adjust_inventory_by != 0:
                         target_warehouse = DEFAULT_FINISHED_GOODS_WAREHOUSE
                         
-                        # Get or create inventory item, ensuring row lock for update
-                        try:
-                            inventory_item = Inventory.objects.select_for_update().get(
-                                part_number=product_code,
-                                warehouse=target_warehouse
-                            )
-                        except Inventory.DoesNotExist:
-                            # If it doesn't exist, create it.
-                            inventory_item = Inventory.objects.create(
-                                part_number=product_code,
-                                warehouse=target_warehouse,
-                                quantity=0, # Initial quantity before adjustment
-                                reserved=0,
-                                is_active=True,
-                                is_allocatable=True
-                            )
-                        
-                        # Check for sufficient stock if reducing
-                        if quantity_to_adjust_inventory_by < 0:
-                            if inventory_item.quantity < abs(quantity_to_adjust_inventory_by):
+                        # Atomic delta: INSERT ... ON CONFLICT when adding, conditional UPDATE when reducing.
+                        # Adjust the existing finished-goods row whatever its location (a row without location is created only if none exists).
+                        target_location = stock_location(product_code, target_warehouse)
+                        if quantity_to_adjust_inventory_by > 0:
+                            add_stock(product_code, target_warehouse, target_location, quantity_to_adjust_inventory_by)
+                        else:
+                            try:
+                                remove_stock(product_code, target_warehouse, target_location, -quantity_to_adjust_inventory_by)
+                            except InsufficientStock as e:
                                 raise ValueError(
                                     f"Cannot reduce completed quantity for {product_code} in {target_warehouse}. "
-                                    f"Attempting to deduct: {abs(quantity_to_adjust_inventory_by)}, Current stock: {inventory_item.quantity}."
+                                    f"Attempting to deduct: {abs(quantity_to_adjust_inventory_by)}, Current stock: {e.current_quantity or 0}."
                                 )
-                        
-                        inventory_item.quantity += quantity_to_adjust_inventory_by
-                        inventory_item.save()
+                        refresh_stock_summary({product_code})
 
                         # Create a stock movement record
                         movement_quantity_log = abs(quantity_to_adjust_inventory_by)
@@ -520,18 +457,16 @@ class ProductionPlanViewSet(viewsets.ModelViewSet):
                             description=f"Plan {plan.id} completion. Qty changed by: {quantity_to_adjust_inventory_by}. New total completed: {newly_reported_completed_quantity}.",
                             operator=request.user if request.user.is_authenticated else None
                         )
-                        print(f"Inventory for {product_code} in {target_warehouse} changed by: {quantity_to_adjust_inventory_by}. New QOH: {inventory_item.quantity}")
+                        logger.info("Inventory for %s in %s changed by: %s.", product_code, target_warehouse, quantity_to_adjust_inventory_by)
                     else:
-                        print(f"No inventory change for {product_code} as calculated adjustment is zero for plan {plan.id}.")
+                        logger.info("No inventory change for %s as calculated adjustment is zero for plan %s.", product_code, plan.id)
 
         except ValueError as ve:
             # Catch specific ValueErrors from our logic (e.g., insufficient stock for reversal)
             return Response({"error": f"Failed to save progress: {str(ve)}"}, status=status.HTTP_400_BAD_REQUEST)
         except Exception as e:
             # Log the detailed error for debugging
-            import traceback
-            print(f"Error during progress update transaction: {str(e)}")
-            print(traceback.format_exc())
+            logger.exception("Error during progress update transaction: %s", e)
             return Response({"error": f"Failed to save progress due to an unexpected error. Please check logs."}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
         return Response({
@@ -540,17 +475,18 @@ class ProductionPlanViewSet(viewsets.ModelViewSet):
             "new_status": plan.get_status_display()
         }, status=status.HTTP_200_OK)
 
-class PartsUsedViewSet(viewsets.ModelViewSet):
+class PartsUsedViewSet(QueryBudgetMixin, viewsets.ModelViewSet):
     """
     API endpoint that allows PartsUsed records to be viewed or created.
     """
     queryset = PartsUsed.objects.all().order_by('-used_datetime')
     serializer_class = PartsUsedSerializer
     pagination_class = StandardResultsSetPagination # ページネーションクラスを指定
+    query_budget = {'list': 2, 'retrieve': 1}
     # permission_classes = [permissions.IsAuthenticated] # Example: Add authentication
 
 
-class MaterialAllocationViewSet(viewsets.ModelViewSet):
+class MaterialAllocationViewSet(QueryBudgetMixin, viewsets.ModelViewSet):
     """
     API endpoint that allows Material Allocations to be viewed or created.
     """
@@ -561,6 +497,7 @@ class MaterialAllocationViewSet(viewsets.ModelViewSet):
     filter_backends = [OrderingFilter]
     ordering_fields = ['material_code', 'allocated_quantity', 'allocation_datetime', 'status']
     ordering = ['-allocation_datetime']
+    query_budget = {'list': 2, 'retrieve': 1}
 
     def get_queryset(self):
         queryset = super().get_queryset()
@@ -570,7 +507,7 @@ class MaterialAllocationViewSet(viewsets.ModelViewSet):
         return queryset
 
 
-class WorkProgressViewSet(viewsets.ModelViewSet):
+class WorkProgressViewSet(QueryBudgetMixin, viewsets.ModelViewSet):
     """
     API endpoint that allows Work Progress records to be viewed or created.
     """
@@ -581,6 +518,7 @@ class WorkProgressViewSet(viewsets.ModelViewSet):
     filter_backends = [OrderingFilter]
     ordering_fields = ['process_step', 'status', 'start_datetime', 'end_datetime', 'quantity_completed']
     ordering = ['start_datetime']
+    query_budget = {'list': 2, 'retrieve': 1}
 
     def get_queryset(self):
         queryset = super().get_queryset()
@@ -1,3 +1,275 @@
-from django.test import TestCase
+from datetime import timedelta
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APITestCase
+from rest_framework_simplejwt.tokens import AccessToken
+
+from base.cache import get_version
+from base.facets import facet_namespace
+from inventory.models import Inventory, SalesOrder, StockMovement, StockSummary
+from .models import MaterialAllocation, PartsUsed, ProductionPlan, WorkProgress
+
+User = get_user_model()
+
+
+class RequiredPartsTests(APITestCase):
+    def setUp(self):
+        self.client.force_authenticate(user=User(custom_id='plan-user', username='planuser'))
+        now = timezone.now()
+        self.plan = ProductionPlan.objects.create(
+            plan_name='Plan A', product_code='PRD-1', production_plan='PP-001', planned_quantity=10,
+            planned_start_datetime=now, planned_end_datetime=now + timedelta(days=1),
+        )
+        self.url = reverse('production_api:production-plan-required-parts', kwargs={'pk': self.plan.pk})
+
+    def add_parts(self, count, start=0):
+        for i in range(start, start + count):
+            PartsUsed.objects.create(production_plan='PP-001', part_code=f'P-{i}', warehouse='WH-A' if i % 2 else None, quantity_used=i + 1)
+            Inventory.objects.create(part_number=f'P-{i}', warehouse='WH-A', location='A-01', quantity=10, reserved=2)
+            Inventory.objects.create(part_number=f'P-{i}', warehouse='WH-B', location='B-01', quantity=5)
+            MaterialAllocation.objects.create(production_plan=self.plan, material_code=f'P-{i}', allocated_quantity=1)
+            MaterialAllocation.objects.create(production_plan=self.plan, material_code=f'P-{i}', allocated_quantity=2)
+
+    def test_inventory_and_allocation_quantities(self):
+        """倉庫指定の有無に応じた在庫数と、計画ごとの引当済数量が返されることを確認"""
+        self.add_parts(2)
+        Inventory.objects.create(part_number='P-0', warehouse='WH-C', quantity=50, is_active=False)
+
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        parts = {p['part_code']: p for p in response.data}
+        self.assertEqual(parts['P-0']['inventory_quantity'], 13)  # 倉庫指定なし: 全倉庫の利用可能数 (無効在庫は除外)
+        self.assertEqual(parts['P-1']['inventory_quantity'], 8)   # 倉庫指定あり: WH-A のみ
+        self.assertEqual(parts['P-1']['already_allocated_quantity'], 3)
+
+    def test_query_count_does_not_depend_on_bom_size(self):
+        """部品数に関わらずクエリ数が一定であることを確認"""
+        self.add_parts(3)
+        with self.assertNumQueries(4):  # 計画取得 + 使用部品 + 在庫集計 + 引当集計
+            self.client.get(self.url)
+
+        self.add_parts(30, start=3)
+        with self.assertNumQueries(4):
+            response = self.client.get(self.url)
+        self.assertEqual(len(response.data), 33)
+
+
+class AllocateMaterialsTests(APITestCase):
+    def setUp(self):
+        self.client.force_authenticate(user=User(custom_id='plan-user', username='planuser'))
+        now = timezone.now()
+        self.plan = ProductionPlan.objects.create(
+            plan_name='Plan A', product_code='PRD-1', planned_quantity=10,
+            planned_start_datetime=now, planned_end_datetime=now + timedelta(days=1),
+        )
+        self.url = reverse('production_api:production-plan-allocate-materials', kwargs={'pk': self.plan.pk})
+
+    def allocate(self, lines):
+        return self.client.post(self.url, {'allocations': [
+            {'part_number': p, 'warehouse': w, 'quantity_to_allocate': q} for p, w, q in lines
+        ]}, format='json')
+
+    def test_allocates_across_locations(self):
+        """同一倉庫の複数棚番にまたがって引当され、出庫予定と在庫集計が作成・更新されることを確認"""
+        first = Inventory.objects.create(part_number='P-1', warehouse='WH-A', location='A-01', quantity=5, reserved=2)
+        second = Inventory.objects.create(part_number='P-1', warehouse='WH-A', location='A-02', quantity=10)
+
+        response = self.allocate([('P-1', 'WH-A', 6)])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        line = response.data['allocations_summary'][0]
+        self.assertEqual((line['new_inventory_reserved'], line['new_inventory_available']), (8, 7))
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual((first.reserved, second.reserved), (5, 3))
+        self.assertEqual(MaterialAllocation.objects.get(production_plan=self.plan).allocated_quantity, 6)
+        self.assertEqual(SalesOrder.objects.get(order_number=line['sales_order_number']).quantity, 6)
+        self.assertEqual(StockSummary.objects.get(part_number='P-1', warehouse='WH-A').available, 7)
+
+    def test_invalidates_facets_on_commit(self):
+        """一括保存はシグナルを送信しないため、コミット後に在庫と出庫予定の絞り込み候補のキャッシュを無効にすることを確認"""
+        Inventory.objects.create(part_number='P-1', warehouse='WH-A', quantity=5)
+        namespaces = [facet_namespace(Inventory), facet_namespace(SalesOrder)]
+        versions = [get_version(namespace) for namespace in namespaces]
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            self.assertEqual(self.allocate([('P-1', 'WH-A', 2)]).status_code, status.HTTP_200_OK)
+            self.assertEqual([get_version(namespace) for namespace in namespaces], versions)
+        self.assertTrue(callbacks)
+        for namespace, version in zip(namespaces, versions):
+            self.assertNotEqual(get_version(namespace), version)
+
+    def test_insufficient_stock_rolls_back(self):
+        """1行でも在庫不足がある場合、すべての引当が取り消されることを確認"""
+        Inventory.objects.create(part_number='P-1', warehouse='WH-A', quantity=5)
+        Inventory.objects.create(part_number='P-2', warehouse='WH-A', quantity=1)
+
+        response = self.allocate([('P-1', 'WH-A', 3), ('P-2', 'WH-A', 2), ('P-3', 'WH-A', 1)])
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(len(response.data['details']), 2)
+        self.assertEqual(Inventory.objects.get(part_number='P-1').reserved, 0)
+        self.assertFalse(MaterialAllocation.objects.exists())
+        self.assertFalse(SalesOrder.objects.exists())
+
+    def test_query_count_does_not_depend_on_line_count(self):
+        """引当行数に関わらずクエリ数が一定であることを確認"""
+        for i in range(60):
+            Inventory.objects.create(part_number=f'P-{i}', warehouse='WH-A', quantity=100)
+
+        with CaptureQueriesContext(connection) as small:
+            self.assertEqual(self.allocate([(f'P-{i}', 'WH-A', 1) for i in range(3)]).status_code, status.HTTP_200_OK)
+        with CaptureQueriesContext(connection) as large:
+            self.assertEqual(self.allocate([(f'P-{i}', 'WH-A', 1) for i in range(60)]).status_code, status.HTTP_200_OK)
+        self.assertEqual(len(small), len(large))
+
+
+class AllocationRunTests(APITestCase):
+    def setUp(self):
+        self.client.force_authenticate(user=User(custom_id='plan-user', username='planuser'))
+        self.url = reverse('production_api:production-plan-allocation-run')
+        self.now = timezone.now()
+
+    def create_plan(self, name, start_offset_days, identifier, status_value='PENDING'):
+        start = self.now + timedelta(days=start_offset_days)
+        return ProductionPlan.objects.create(
+            plan_name=name, product_code='PRD-1', production_plan=identifier, planned_quantity=1,
+            planned_start_datetime=start, planned_end_datetime=start + timedelta(hours=8), status=status_value,
+        )
+
+    def test_earliest_plan_is_served_first(self):
+        """開始日時の早い計画から引当され、不足分が計画ごとに報告されることを確認"""
+        late = self.create_plan('Late', 2, 'BOM-1')
+        early = self.create_plan('Early', 1, 'BOM-1')
+        self.create_plan('Done', 0, 'BOM-1', status_value='COMPLETED')
+        PartsUsed.objects.create(production_plan='BOM-1', part_code='P-1', warehouse='WH-A', quantity_used=6)
+        PartsUsed.objects.create(production_plan='BOM-1', part_code='P-2', quantity_used=4)
+        Inventory.objects.create(part_number='P-1', warehouse='WH-A', quantity=10)
+        Inventory.objects.create(part_number='P-2', warehouse='WH-A', quantity=2)
+        Inventory.objects.create(part_number='P-2', warehouse='WH-B', quantity=3)
+        MaterialAllocation.objects.create(production_plan=early, material_code='P-2', allocated_quantity=1)
+
+        response = self.client.post(self.url, {}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([p['plan_name'] for p in response.data['plans']], ['Early', 'Late'])
+        early_lines = {line['part_code']: line for line in response.data['plans'][0]['lines']}
+        late_lines = {line['part_code']: line for line in response.data['plans'][1]['lines']}
+        self.assertTrue(response.data['plans'][0]['fully_allocated'])
+        self.assertEqual((early_lines['P-2']['already_allocated_quantity'], early_lines['P-2']['allocated_quantity']), (1, 3))
+        self.assertEqual((late_lines['P-1']['allocated_quantity'], late_lines['P-1']['shortage_quantity']), (4, 2))
+        self.assertEqual((late_lines['P-2']['allocated_quantity'], late_lines['P-2']['shortage_quantity']), (2, 2))
+        self.assertEqual(response.data['plans_with_shortage'], 1)
+
+        # 倉庫指定のない部品は複数の倉庫から引当され、倉庫ごとに出庫予定が作成される
+        self.assertEqual(SalesOrder.objects.filter(item='P-2').count(), 3)
+        self.assertEqual(StockSummary.objects.get(part_number='P-2', warehouse='WH-B').available, 0)
+        self.assertEqual(StockSummary.objects.get(part_number='P-1', warehouse='WH-A').available, 0)
+        self.assertEqual(
+            sum(MaterialAllocation.objects.filter(production_plan=late).values_list('allocated_quantity', flat=True)), 6
+        )
+
+        # 再実行しても引当済の数量は二重に引き当てられない
+        response = self.client.post(self.url, {}, format='json')
+        self.assertEqual(response.data['allocations_created'], 0)
+
+    def test_dry_run_writes_nothing(self):
+        """dry_run の場合は不足レポートのみ返し、在庫や引当を変更しないことを確認"""
+        self.create_plan('Plan', 1, 'BOM-1')
+        PartsUsed.objects.create(production_plan='BOM-1', part_code='P-1', warehouse='WH-A', quantity_used=6)
+        Inventory.objects.create(part_number='P-1', warehouse='WH-A', quantity=2)
+
+        response = self.client.post(self.url, {'dry_run': True}, format='json')
+        self.assertEqual(response.data['plans'][0]['lines'][0]['shortage_quantity'], 4)
+        self.assertEqual(Inventory.objects.get(part_number='P-1').reserved, 0)
+        self.assertFalse(MaterialAllocation.objects.exists())
+
+    def test_query_count_does_not_depend_on_plan_count(self):
+        """計画数に関わらずクエリ数が一定であることを確認"""
+        PartsUsed.objects.create(production_plan='BOM-1', part_code='P-1', warehouse='WH-A', quantity_used=1)
+        Inventory.objects.create(part_number='P-1', warehouse='WH-A', quantity=1000)
+        for i in range(3):
+            self.create_plan(f'Plan {i}', i, 'BOM-1')
+        with CaptureQueriesContext(connection) as small:
+            self.client.post(self.url, {}, format='json')
+        for i in range(3, 40):
+            self.create_plan(f'Plan {i}', i, 'BOM-1')
+        with CaptureQueriesContext(connection) as large:
+            response = self.client.post(self.url, {}, format='json')
+        self.assertEqual(response.data['allocations_created'], 37)
+        self.assertEqual(len(small), len(large))
+
+
+class UpdateProgressTests(APITestCase):
+    def setUp(self):
+        # 入出庫履歴・作業進捗に記録者として保存されるため、ユーザーを作成しておく
+        user, = User.objects.bulk_create([User(custom_id='progress-user', username='progressuser')])
+        self.client.force_authenticate(user=user)
+        now = timezone.now()
+        self.plan = ProductionPlan.objects.create(
+            plan_name='Plan A', product_code='PRD-1', production_plan='PP-001', planned_quantity=10,
+            planned_start_datetime=now, planned_end_datetime=now + timedelta(days=1),
+        )
+        self.url = reverse('production_api:production-plan-update-progress', kwargs={'pk': self.plan.pk})
+
+    def test_completion_updates_existing_finished_goods_row(self):
+        """完成品在庫は棚番を問わず既存の行に加算・減算され、棚番未設定の行が作られないことを確認"""
+        stock = Inventory.objects.create(part_number='PRD-1', warehouse='FG-MAIN', location='FG-01', quantity=5)
+
+        response = self.client.post(self.url, {'status': 'COMPLETED', 'good_quantity': 3}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(list(Inventory.objects.values_list('pk', 'quantity')), [(stock.pk, 8)])
+        self.assertEqual(StockSummary.objects.get(part_number='PRD-1').quantity, 8)
+
+        response = self.client.post(self.url, {'status': 'IN_PROGRESS'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(list(Inventory.objects.values_list('pk', 'quantity')), [(stock.pk, 5)])
+        self.assertEqual(
+            sorted(StockMovement.objects.values_list('movement_type', flat=True)), ['PRODUCTION_OUTPUT', 'PRODUCTION_REVERSAL']
+        )
+
+    def test_completion_creates_row_when_no_stock(self):
+        """完成品在庫が無い場合は棚番未設定の行を作成することを確認"""
+        response = self.client.post(self.url, {'status': 'COMPLETED', 'good_quantity': 4}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(list(Inventory.objects.values_list('warehouse', 'location', 'quantity')), [('FG-MAIN', None, 4)])
+
+
+@override_settings(QUERY_INSPECTION_SAMPLE_RATE=1.0, QUERY_INSPECTION_STRICT=True)
+class QueryBudgetTests(APITestCase):
+    def setUp(self):
+        self.client.force_authenticate(user=User(custom_id='plan-user', username='planuser'))
+        now = timezone.now()
+        for i in range(6):
+            plan = ProductionPlan.objects.create(
+                plan_name=f'Plan {i}', product_code='PRD-1', production_plan=f'PP-{i:03}', planned_quantity=10,
+                planned_start_datetime=now, planned_end_datetime=now + timedelta(days=1),
+            )
+            MaterialAllocation.objects.create(production_plan=plan, material_code=f'P-{i}', allocated_quantity=1)
+            WorkProgress.objects.create(production_plan=plan, process_step='assembly')
+
+    def test_lists_within_budget(self):
+        """Each list endpoint stays within its declared query budget regardless of the number of plans"""
+        for name in ['production-plan-list', 'material-allocation-list', 'work-progress-list', 'parts-used-list']:
+            with self.subTest(name=name):
+                response = self.client.get(reverse(f'production_api:{name}'))
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_retrieve_within_budget(self):
+        allocation = MaterialAllocation.objects.first()
+        response = self.client.get(reverse('production_api:material-allocation-detail', kwargs={'pk': allocation.pk}))
+        self.assertEqual(response.data['production_plan_name'], allocation.production_plan.plan_name)
+
+    @override_settings(JWT_USER_CACHE_ENABLED=False)
+    def test_authentication_not_counted(self):
+        """Loading the JWT user is not counted towards the budget (retrieve allows 1 query)"""
+        user = User(custom_id='budget-user', username='budgetuser')
+        User.objects.bulk_create([user])
+        self.client.force_authenticate(user=None)
+        allocation = MaterialAllocation.objects.first()
+        url = reverse('production_api:material-allocation-detail', kwargs={'pk': allocation.pk})
+        with self.assertNumQueries(2):  # authentication + the allocation with its plan
+            response = self.client.get(url, HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(user)}')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
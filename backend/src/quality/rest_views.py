@@ -4,6 +4,7 @@ from rest_framework import viewsets, status, permissions
 from rest_framework.response import Response
 from rest_framework.decorators import action
 from django.db.models import ProtectedError
+from base.query_inspection import QueryBudgetMixin
 from .models import InspectionItem, InspectionResult, InspectionResultDetail, MeasurementDetail
 from .serializers import (
     InspectionItemListSerializer,
@@ -70,12 +71,13 @@ class CustomSuccessMessageMixin:
         except ProtectedError:
             return Response({'status': 'error', 'message': f'この{model_name}は実績データが関連付けられているため削除できません。'}, status=status.HTTP_400_BAD_REQUEST)
 
-class InspectionItemViewSet(CustomSuccessMessageMixin, viewsets.ModelViewSet):
+class InspectionItemViewSet(QueryBudgetMixin, CustomSuccessMessageMixin, viewsets.ModelViewSet):
     """
     API endpoint for Inspection Items (検査項目マスター).
     """
     queryset = InspectionItem.objects.prefetch_related('measurement_details').all().order_by('code')
     permission_classes = [permissions.IsAuthenticated]
+    query_budget = {'list': 2, 'retrieve': 2}  # see base.query_inspection
 
     def get_serializer_class(self):
         if self.action == 'list':
@@ -157,13 +159,15 @@ class InspectionItemViewSet(CustomSuccessMessageMixin, viewsets.ModelViewSet):
             errors = getattr(e, 'detail', str(e))
             return Response({'success': False, 'message': '検査結果の登録中にエラーが発生しました。', 'errors': errors}, status=status.HTTP_400_BAD_REQUEST)
 
-class InspectionResultViewSet(CustomSuccessMessageMixin, viewsets.ModelViewSet):
+class InspectionResultViewSet(QueryBudgetMixin, CustomSuccessMessageMixin, viewsets.ModelViewSet):
     """
     API endpoint for Inspection Results (検査実績).
     """
-    queryset = InspectionResult.objects.all().order_by('-inspected_at')
+    # inspected_by_username and details are serialized per row, and __str__ (used in the delete message) reads inspection_item
+    queryset = InspectionResult.objects.select_related('inspection_item', 'inspected_by').prefetch_related('details').order_by('-inspected_at')
     serializer_class = InspectionResultSerializer
     permission_classes = [permissions.IsAuthenticated]
+    query_budget = {'list': 2, 'retrieve': 2}
 
     def get_serializer_context(self):
         """
@@ -1,3 +1,49 @@
-from django.test import TestCase
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.test import override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+from base.query_inspection import QueryInspectionError
+from .models import InspectionItem, InspectionResult, InspectionResultDetail, MeasurementDetail
+from .rest_views import InspectionResultViewSet
+
+User = get_user_model()
+
+
+@override_settings(QUERY_INSPECTION_SAMPLE_RATE=1.0, QUERY_INSPECTION_STRICT=True)
+class InspectionResultQueryBudgetTests(APITestCase):
+    def setUp(self):
+        User.objects.bulk_create([User(custom_id=f'inspector-{i}', username=f'inspector{i}') for i in range(6)])
+        self.client.force_authenticate(user=User.objects.first())
+        item = InspectionItem.objects.create(code='INS-1', name='外観検査')
+        detail = MeasurementDetail.objects.create(inspection_item=item, name='傷')
+        for user in User.objects.all():
+            result = InspectionResult.objects.create(inspection_item=item, inspected_by=user, judgment='pass')
+            InspectionResultDetail.objects.create(inspection_result=result, measurement_detail=detail, result_qualitative='OK')
+        self.url = reverse('quality_api:inspection-result-list')
+
+    def test_list_within_budget(self):
+        """検査員・詳細の件数に関わらず、一覧がクエリ予算内で返されることを確認"""
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['data']), 6)
+        self.assertEqual(response.data['data'][0]['details'][0]['result_qualitative'], 'OK')
+        self.assertTrue(all(row['inspected_by_username'] for row in response.data['data']))
+
+    def test_missing_select_related_fails(self):
+        """select_related / prefetch_related が外れると、テストでクエリ予算の超過が検出されることを確認"""
+        with mock.patch.object(InspectionResultViewSet, 'queryset', InspectionResult.objects.order_by('-inspected_at')):
+            with self.assertRaisesMessage(QueryInspectionError, 'exceed the budget of 2'):
+                self.client.get(self.url)
+
+    @override_settings(QUERY_INSPECTION_STRICT=False)
+    def test_missing_select_related_logs_warning(self):
+        """本番 (QUERY_INSPECTION_STRICT=False) では、問題が警告としてログに出力されることを確認"""
+        with mock.patch.object(InspectionResultViewSet, 'queryset', InspectionResult.objects.order_by('-inspected_at')):
+            with self.assertLogs('base.query_inspection', 'WARNING') as logs:
+                response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('possible N+1', '\n'.join(logs.output))
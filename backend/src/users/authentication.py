@@ -0,0 +1,52 @@
+"""
+ユーザーをキャッシュする JWT 認証。
+
+`JWTAuthentication` はリクエストのたびにトークンのユーザーをデータベースから読み込みます。
+`CachedJWTAuthentication` は読み込んだユーザーを短時間 (JWT_USER_CACHE_TIMEOUT 秒) キャッシュし、
+以降のリクエストではクエリを発行せずに認証します。キャッシュにはユーザーの全項目
+(is_active・is_staff・password_last_changed など) が含まれるため、パスワード有効期限の判定にもクエリは不要です。
+ユーザーが保存・削除されるとシグナル (users/signals.py) でキャッシュが削除されます。
+削除を他のプロセスに伝えるため、キャッシュは JWT_USER_CACHE_ENABLED (既定では CACHE_URL を設定した場合のみ) の
+場合だけ使用し、無効な場合は JWTAuthentication と同じく毎回データベースから読み込みます。
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+
+def user_cache_key(user_id):
+    return f'jwt_user:{user_id}'
+
+
+def invalidate_cached_user(user_id):
+    """ユーザーのキャッシュを削除する。トランザクション内ではコミット後に削除します。"""
+    key = user_cache_key(user_id)
+    transaction.on_commit(lambda: cache.delete(key))
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    def get_user(self, validated_token):
+        user_id = validated_token.get(api_settings.USER_ID_CLAIM)
+        if user_id is None or not settings.JWT_USER_CACHE_ENABLED:
+            return super().get_user(validated_token)
+
+        key = user_cache_key(user_id)
+        user = cache.get(key)
+        if user is None:
+            user = super().get_user(validated_token)
+            cache.set(key, user, timeout=settings.JWT_USER_CACHE_TIMEOUT)
+            return user
+
+        # キャッシュから取得した場合も JWTAuthentication と同じ検証を行う
+        if not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+        if api_settings.CHECK_REVOKE_TOKEN and validated_token.get(
+            api_settings.REVOKE_TOKEN_CLAIM
+        ) != get_md5_hash_password(user.password):
+            raise AuthenticationFailed(_("The user's password has been changed."), code="password_changed")
+        return user
@@ -4,11 +4,11 @@ from django.http import JsonResponse
 from django.utils.deprecation import MiddlewareMixin
 
 class PasswordExpirationMiddleware(MiddlewareMixin):
-    def _should_check_password_expiration(self, request):
+    def _should_check_password_expiration(self, user, request):
         """
         Determines if password expiration check should be performed for the current request.
         """
-        if not request.user.is_authenticated:
+        if not user.is_authenticated:
             return False
 
         # request.resolver_matchはURL解決後に利用可能 (process_view内)
@@ -36,11 +36,14 @@ class PasswordExpirationMiddleware(MiddlewareMixin):
 
         return True
 
-    def process_view(self, request, view_func, view_args, view_kwargs):
-        if not self._should_check_password_expiration(request):
-            return None
+    def __init__(self, get_response):
+        super().__init__(get_response)
+        if self.async_mode:
+            # ASGI では process_view もイベントループ上で実行し、リクエストごとにスレッドへ移らないようにする
+            self.process_view = self.aprocess_view
 
-        if hasattr(request.user, 'is_password_expired') and request.user.is_password_expired:
+    def _expired_response(self, user):
+        if getattr(user, 'is_password_expired', False):
             # パスワードの有効期限が切れています。除外されていないリクエストに対してJSONレスポンスを返します。
             # これにより、リダイレクトの責務をフロントエンドクライアントに委任します。
             return JsonResponse({
@@ -48,3 +51,15 @@ class PasswordExpirationMiddleware(MiddlewareMixin):
                 'detail': 'パスワードの有効期限が切れています。新しいパスワードを設定してください。'
             }, status=403)  # 403 Forbidden はこの場合に適切です。
         return None
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if not self._should_check_password_expiration(request.user, request):
+            return None
+        return self._expired_response(request.user)
+
+    async def aprocess_view(self, request, view_func, view_args, view_kwargs):
+        # request.user の評価はセッションの読み込みを伴うため、非同期版の auser() を使用する
+        user = await request.auser()
+        if not self._should_check_password_expiration(user, request):
+            return None
+        return self._expired_response(user)
@@ -1,16 +1,18 @@
 from django.http import JsonResponse
 from django.views.decorators.csrf import requires_csrf_token, ensure_csrf_cookie
+from django.views.decorators.http import require_GET
 import logging
 from rest_framework import status, viewsets, permissions
-from rest_framework.decorators import api_view, permission_classes, authentication_classes
+from rest_framework.decorators import api_view, permission_classes
 from rest_framework.response import Response
 from rest_framework.authtoken.models import Token
 from rest_framework.authtoken.views import ObtainAuthToken as DefaultObtainAuthToken
 from .serializers import CustomUserSerializer, CustomAuthTokenSerializer, AdminUserSerializer, UserProfileUpdateSerializer, PasswordChangeSerializer
 from django.contrib.auth import login, logout, update_session_auth_hash
-from rest_framework.permissions import IsAuthenticated, AllowAny
+from rest_framework.permissions import IsAuthenticated
 from rest_framework.views import APIView
 from django.middleware import csrf
+from base.async_api import async_api_view
 from .models import CustomUser
 
 logger = logging.getLogger(__name__)
@@ -85,13 +87,14 @@ class APILogoutView(APIView):
         
         return Response({'success': True, 'message': 'Successfully logged out.'}, status=status.HTTP_200_OK)
 
-@api_view(['GET'])
-@permission_classes([AllowAny]) # 認証されていないユーザーもアクセスできるように変更
+@require_GET
 @ensure_csrf_cookie
-def get_session_info(request):
+@async_api_view(login_required=False) # 認証されていないユーザーもアクセスできる
+async def get_session_info(request):
     """
     現在のセッション情報を返し、CSRFクッキーを保証するビュー。
     認証状態に関わらず、常に200 OKを返す。
+    画面遷移のたびに呼び出されるため、非同期ビューとして処理します (ユーザーは認証時のキャッシュから取得されます)。
     """
     is_authenticated = request.user.is_authenticated
     if is_authenticated:
@@ -143,7 +146,8 @@ class UserPasswordChangeView(APIView):
         if serializer.is_valid():
             user = request.user
             user.set_password(serializer.validated_data['new_password1'])
-            user.save()
+            # request.user はキャッシュされたユーザーの場合があるため、変更した項目だけを保存する
+            user.save(update_fields=['password', 'password_last_changed'])
             # To keep the user logged in after password change
             update_session_auth_hash(request, user)
             return Response({'message': 'パスワードが正常に変更されました。'}, status=status.HTTP_200_OK)
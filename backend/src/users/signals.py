@@ -1,12 +1,25 @@
 from django.conf import settings
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 from rest_framework.authtoken.models import Token
 
+from .authentication import invalidate_cached_user
+
+
 @receiver(post_save, sender=settings.AUTH_USER_MODEL)
 def create_auth_token(sender, instance=None, created=False, **kwargs):
     """
     Signal handler to create an authentication token for a new user.
     """
     if created:
-        Token.objects.create(user=instance)
\ No newline at end of file
+        Token.objects.create(user=instance)
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+def invalidate_cached_user_on_change(sender, instance, **kwargs):
+    """
+    パスワードの変更 (UserPasswordChangeView) や管理者による編集 (UserViewSet・管理サイト) で
+    ユーザーが保存・削除された場合に、JWT 認証のユーザーのキャッシュを削除する。
+    """
+    invalidate_cached_user(instance.pk)
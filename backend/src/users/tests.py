@@ -1,3 +1,70 @@
-from django.test import TestCase
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
 
-# Create your tests here.
+from .models import CustomUser
+
+
+@override_settings(JWT_USER_CACHE_ENABLED=True)
+class CachedJWTAuthenticationTests(TestCase):
+    url = '/api/base/qr-code-actions/execute/'
+
+    def setUp(self):
+        cache.clear()
+        # authtoken がインストールされていないため、トークンを作成する post_save を送信しない bulk_create で作成する
+        self.user = CustomUser(custom_id='scanner')
+        self.user.set_password('old-password')
+        CustomUser.objects.bulk_create([self.user])
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(self.user)}')
+
+    def test_cached_user_needs_no_queries(self):
+        """2回目以降の認証はクエリを発行しないことを確認 (qr_data が無いため 400 を返す)"""
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.post(self.url).status_code, 400)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.post(self.url).status_code, 400)
+
+    @override_settings(JWT_USER_CACHE_ENABLED=False)
+    def test_disabled_without_shared_cache(self):
+        """無効な場合は JWTAuthentication と同じく毎回ユーザーを読み込むことを確認"""
+        for _ in range(2):
+            with self.assertNumQueries(1):
+                self.assertEqual(self.client.post(self.url).status_code, 400)
+        self.assertIsNone(cache.get(f'jwt_user:{self.user.pk}'))
+
+    def test_cache_invalidated_when_user_saved(self):
+        """ユーザーが保存されるとキャッシュが削除され、無効化したユーザーは認証されないことを確認"""
+        self.client.post(self.url)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.is_active = False
+            self.user.save()
+        self.assertEqual(self.client.post(self.url).status_code, 401)
+
+    def test_password_change(self):
+        """パスワード変更は変更した項目だけを保存し、キャッシュを削除することを確認"""
+        self.client.post(self.url)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/users/settings/password/', {
+                'old_password': 'old-password', 'new_password1': 'Xq7!new-passw0rd', 'new_password2': 'Xq7!new-passw0rd',
+            }, format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertIsNone(cache.get(f'jwt_user:{self.user.pk}'))
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.check_password('Xq7!new-passw0rd'))
+
+
+class SessionInfoTests(TestCase):
+    def test_session_info(self):
+        """認証状態に関わらず 200 を返し、CSRFクッキーを設定することを確認"""
+        response = self.client.get('/api/users/session/')
+        self.assertEqual(response.json(), {'isAuthenticated': False, 'isStaff': False, 'isSuperuser': False})
+        self.assertIn('csrftoken', response.cookies)
+
+        user = CustomUser(custom_id='session-user', username='sessionuser', is_staff=True)
+        CustomUser.objects.bulk_create([user])
+        response = self.client.get('/api/users/session/', HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(user)}')
+        self.assertEqual(response.json(), {
+            'isAuthenticated': True, 'isStaff': True, 'isSuperuser': False, 'username': 'sessionuser', 'isPasswordExpired': False,
+        })